@@ -1,10 +1,12 @@
 import streamlit as st
-from engine import Engine
+from engine_loader import EngineLoader
+from resources import get_config
 from utils import Utils
 from session_manager import SessionManager
 from auth import OAuth
 import logging
 import uuid
+from datetime import datetime, time, timezone
 
 # Set the page configuration
 st.set_page_config(page_title='Edvisor', page_icon='🎓', layout="wide")
@@ -12,18 +14,28 @@ st.title('Edvisor 🤖')
 st.write('Chatbot for Finland Study and Visa Services')
 
 
-# Initialize the chatbot engine and OAuth
+# Start loading the chatbot engine in the background and initialize OAuth
 @st.cache_resource
-def initialize_engine():
-    return Engine()
+def initialize_engine_loader():
+    config = get_config()
+    loader = EngineLoader(warm_up=config.warmup_on_start).start()
+    if config.startup_mode == "eager":
+        loader.wait()
+    return loader
 
 @st.cache_resource
 def initialize_oauth():
     return OAuth()
 
-chatbot = initialize_engine()
+engine_loader = initialize_engine_loader()
 oauth = initialize_oauth()
 
+STARTUP_MESSAGES = {
+    "starting": "Edvisor is starting up...",
+    "loading": "Loading the language and embedding models...",
+    "warming_up": "Warming up the models...",
+}
+
 # Check for existing session
 user_email = SessionManager.get_session()
 print(user_email)
@@ -74,25 +86,75 @@ else:
    
     st.success(f"Logged in as: {user_email}")
 
+    # The engine loads in the background, so the login page does not wait for it.
+    # The status is read once, as the loader thread may finish between two reads.
+    status = engine_loader.status()
+    if status["state"] == "failed":
+        st.error(f"Edvisor failed to start: {status['error']}")
+        st.stop()
+    if status["state"] != "ready":
+        st.info(f"{STARTUP_MESSAGES.get(status['state'], STARTUP_MESSAGES['starting'])} ({status['elapsed_s']} s)")
+        engine_loader.wait(timeout=2)
+        st.rerun()
+    chatbot = engine_loader.engine
+
     # Sidebar for chat history
     st.sidebar.title("Edvisor")
 
+    def open_chat(chat_id, messages=None, older_cursor=None):
+        # Only the latest window of a chat is loaded, older messages are fetched page by page on request
+        st.session_state.chat_id = chat_id
+        st.session_state.messages = messages or []
+        st.session_state.older_cursor = older_cursor
+        st.session_state.visible_messages = chatbot.config.chat_history_window
+
     # Initialize session state variables
     if "chat_id" not in st.session_state:
-        st.session_state.chat_id = chatbot.chat_manager.create_new_chat()
-        st.session_state.messages = []
+        open_chat(chatbot.chat_manager.create_new_chat())
 
     # Create a new chat button
     if st.sidebar.button("New Chat"):
-        st.session_state.chat_id = chatbot.chat_manager.create_new_chat()
-        st.session_state.messages = []
+        open_chat(chatbot.chat_manager.create_new_chat())
         st.rerun()
 
+    # Semantic search over past messages
+    if chatbot.chat_manager.conversation_search is not None:
+        search_query = st.sidebar.text_input("Search conversations", key="conversation_search_query")
+        with st.sidebar.expander("Search filters"):
+            date_range = st.date_input("Date range", value=(), key="conversation_search_dates")
+            current_chat_only = st.checkbox("Only this chat", key="conversation_search_current_chat")
+        if search_query:
+            start = end = None
+            if len(date_range) > 0:
+                start = datetime.combine(date_range[0], time.min, tzinfo=timezone.utc)
+                end = datetime.combine(date_range[-1], time.max, tzinfo=timezone.utc)
+            results = chatbot.chat_manager.search_conversations(
+                user_email,
+                search_query,
+                start=start,
+                end=end,
+                chat_ids=[st.session_state.chat_id] if current_chat_only else None
+            )
+            if not results:
+                st.sidebar.caption("No matching messages")
+            for i, result in enumerate(results):
+                snippet = result['content'][:60] + "..." if len(result['content']) > 60 else result['content']
+                label = f"{'🧑' if result['role'] == 'user' else '🤖'} {snippet}"
+                if st.sidebar.button(label, key=f"search_{i}_{result['chat_id']}", use_container_width=True,
+                                     help=f"{Utils.get_relative_time(result['created_at'])} · score {result['score']:.2f}"):
+                    open_chat(result['chat_id'], *chatbot.chat_manager.get_chat_window(result['chat_id'], user_email))
+                    st.rerun()
+
     st.sidebar.subheader("Previous Conversations")
 
-    # Display previous conversations
-    previous_conversations = chatbot.chat_manager.get_all_conversations(user_email)
-    for chat in previous_conversations:
+    # Display previous conversations, one page at a time
+    if "conversation_limit" not in st.session_state:
+        st.session_state.conversation_limit = chatbot.config.conversation_page_size
+    # One extra row tells whether there is a next page
+    previous_conversations = chatbot.chat_manager.get_all_conversations(
+        user_email, limit=st.session_state.conversation_limit + 1)
+    has_more = len(previous_conversations) > st.session_state.conversation_limit
+    for chat in previous_conversations[:st.session_state.conversation_limit]:
         col1, col2, col3, col4 = st.sidebar.columns([1, 2, 1, 1])
         relative_time = Utils.get_relative_time(chat["created_at"])
         with col1:
@@ -102,8 +164,7 @@ else:
                 st.write(" ")  # Empty space for alignment
         with col2:
             if st.button(f"{chat['title']}", key=f"chat_{chat['id']}", use_container_width=True):
-                st.session_state.chat_id = chat['id']
-                st.session_state.messages = chatbot.chat_manager.get_chat_history(chat['id'], user_email)
+                open_chat(chat['id'], *chatbot.chat_manager.get_chat_window(chat['id'], user_email))
                 st.rerun()
         with col3:
             st.write(f"{relative_time}")
@@ -111,9 +172,11 @@ else:
             if st.button("🗑️", key=f"delete_{chat['id']}", help="Delete this conversation", use_container_width=True):
                 chatbot.chat_manager.del_conversation(chat['id'], user_email)
                 if st.session_state.chat_id == chat['id']:
-                    st.session_state.chat_id = chatbot.chat_manager.create_new_chat()
-                    st.session_state.messages = []
+                    open_chat(chatbot.chat_manager.create_new_chat())
                 st.rerun()
+    if has_more and st.sidebar.button("Show more", use_container_width=True):
+        st.session_state.conversation_limit += chatbot.config.conversation_page_size
+        st.rerun()
 
     # Create a container for the chat messages
     chat_container = st.container()
@@ -128,22 +191,35 @@ else:
         with st.chat_message("assistant"):
             thinking_placeholder = st.empty()
             thinking_placeholder.markdown("Thinking...")
-        
-            # Use the LangChain-based Engine to generate a response
-            response = chatbot.generate_response(st.session_state.chat_id, user_email, user_query)
-        
-            thinking_placeholder.empty()
 
-            st.markdown(response)
+            def response_stream():
+                # Render the answer as it is generated, replacing "Thinking..." with the first delta
+                for i, delta in enumerate(chatbot.stream_response(st.session_state.chat_id, user_email, user_query)):
+                    if i == 0:
+                        thinking_placeholder.empty()
+                    yield delta
+
+            response = st.write_stream(response_stream())
         
         st.session_state.messages.append({"role": "assistant", "content": response})
 
-    # Display all messages within the chat container
+    # Display the latest messages within the chat container
     with chat_container:
         if not st.session_state.messages:
             st.info("No messages yet. Start a conversation!")
         else:
-            for message in st.session_state.messages:
+            visible = st.session_state.visible_messages
+            if len(st.session_state.messages) > visible or st.session_state.older_cursor:
+                if st.button("Load earlier messages"):
+                    page_size = chatbot.config.chat_history_window
+                    # Show hidden messages of this session first, then fetch older pages from the store
+                    if len(st.session_state.messages) - visible < page_size and st.session_state.older_cursor:
+                        older, st.session_state.older_cursor = chatbot.chat_manager.get_chat_page(
+                            st.session_state.chat_id, user_email, before=st.session_state.older_cursor)
+                        st.session_state.messages = older + st.session_state.messages
+                    st.session_state.visible_messages += page_size
+                    st.rerun()
+            for message in st.session_state.messages[-visible:]:
                 with st.chat_message(message["role"]):
                     st.markdown(message["content"])
 
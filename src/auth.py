@@ -1,13 +1,13 @@
 from google_auth_oauthlib.flow import Flow
 from googleapiclient.discovery import build
-from config import Config
+from resources import get_config
 import os
 
 class OAuth:
     def __init__(self):
         os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'  # Only for development
         os.environ['OAUTHLIB_RELAX_TOKEN_SCOPE'] = '1'  # Allow scope downgrade
-        self.config = Config()
+        self.config = get_config()
         self.flow = Flow.from_client_config(
             {
                 "web": {
@@ -0,0 +1,242 @@
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, Iterator, List, Optional
+from config import Config
+
+
+class InferenceBackend(ABC):
+    """
+    Text generation behind the Engine.
+
+    A backend turns a fully rendered prompt into a stream of text deltas and reports
+    its throughput. `tokenizer` is the tokenizer used to budget the prompt: a Hugging
+    Face tokenizer, or any object with the same encode(text, add_special_tokens) and
+    decode(ids). It is None when the backend has none (token counts are then estimated).
+    """
+
+    name = ""
+    tokenizer = None
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {"requests": 0, "generated_tokens": 0, "generation_ms": 0.0}
+
+    @abstractmethod
+    def stream(self, prompt: str) -> Iterator[str]:
+        """Yield the response to `prompt` as text deltas."""
+
+    def generate(self, prompt: str) -> str:
+        return "".join(self.stream(prompt))
+
+    def count_tokens(self, text: str) -> int:
+        if self.tokenizer is None:
+            # About 4 characters per token
+            return len(text) // 4 + 1
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
+
+    def register_prefix(self, name: str, text: str):
+        """Hint that prompts often start with `text`. Backends without prefix caching ignore it."""
+
+    def warm_up(self):
+        """Run a short generation so that kernels, allocators and caches are initialized before the first request."""
+
+    def _record(self, tokens: int, start: float):
+        with self.lock:
+            self.counters["requests"] += 1
+            self.counters["generated_tokens"] += tokens
+            self.counters["generation_ms"] += (time.perf_counter() - start) * 1000
+
+    def metrics(self) -> Dict[str, float]:
+        with self.lock:
+            metrics = dict(self.counters)
+        metrics["backend"] = self.name
+        metrics["tokens_per_sec"] = (
+            metrics["generated_tokens"] / (metrics["generation_ms"] / 1000) if metrics["generation_ms"] else 0.0
+        )
+        return metrics
+
+
+class TransformersBackend(InferenceBackend):
+    """
+    The fine-tuned model through transformers, served by the GenerationScheduler.
+
+    On "cuda" the model is loaded 4-bit with bitsandbytes. On "cpu" it is loaded in
+    float32 and its linear layers are quantized to int8 with PyTorch dynamic
+    quantization, which needs neither a GPU nor bitsandbytes.
+    """
+
+    def __init__(self, config: Config, device: str = "cuda"):
+        super().__init__()
+        # Imported here so the other backends do not need torch and transformers
+        from model import Model
+        from generation_scheduler import GenerationScheduler
+        from prefix_cache import PrefixCache
+
+        self.name = f"transformers-{device}"
+        self.config = config
+        self.model = Model(device=device)
+        model, tokenizer = self.model.get_model_tokenizer()
+        self.tokenizer = tokenizer
+        self.prefix_cache = None
+        # Assisted generation keeps its own caches, so the prefix cache is not used with a draft model
+        if config.prefix_cache_enabled and not config.draft_model:
+            self.prefix_cache = PrefixCache(model, tokenizer)
+        # All generation goes through the scheduler so concurrent sessions share batched generate calls
+        self.scheduler = GenerationScheduler(
+            model,
+            tokenizer,
+            self._generation_kwargs(),
+            max_batch_size=config.generation_max_batch_size,
+            max_wait_ms=config.generation_max_wait_ms,
+            length_bucket=config.generation_length_bucket,
+            prefix_cache=self.prefix_cache,
+            assistant_model=self.model.draft_model,
+            assistant_tokenizer=self.model.draft_tokenizer
+        )
+
+    def _generation_kwargs(self) -> Dict:
+        return {
+            "max_new_tokens": self.config.max_new_tokens,
+            "temperature": 0.7,
+            "top_p": 0.9,
+            "do_sample": True,
+            "eos_token_id": self.tokenizer.eos_token_id,
+            **({"num_assistant_tokens": self.config.num_assistant_tokens} if self.config.draft_model else {}),
+        }
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        yield from self.scheduler.stream(prompt)
+
+    def register_prefix(self, name: str, text: str):
+        if self.prefix_cache is not None:
+            self.prefix_cache.register(name, text)
+
+    def warm_up(self):
+        import torch
+        model, _ = self.model.get_model_tokenizer()
+        inputs = self.tokenizer("Hello", return_tensors="pt").to(model.device)
+        with torch.no_grad():
+            model.generate(**inputs, max_new_tokens=8, do_sample=False, pad_token_id=self.tokenizer.pad_token_id)
+
+    def metrics(self) -> Dict[str, float]:
+        # Token and time counts come from the scheduler, which sees every batch
+        metrics = self.scheduler.metrics()
+        metrics["backend"] = self.name
+        metrics["requests"] = metrics["completed"] + metrics["failed"]
+        metrics["tokens_per_sec"] = (
+            metrics["generated_tokens"] / (metrics["generation_ms"] / 1000) if metrics["generation_ms"] else 0.0
+        )
+        return metrics
+
+
+class LlamaCppTokenizer:
+    """
+    The tokenizer of a llama.cpp model behind the encode/decode interface of a Hugging Face
+    tokenizer. llama.cpp enforces its context length exactly, so prompts must be budgeted
+    with the model's own token counts; special tokens such as <|eot_id|> count as one token,
+    as they do when llama.cpp evaluates the prompt.
+    """
+
+    def __init__(self, llm):
+        self.llm = llm
+
+    def encode(self, text: str, add_special_tokens: bool = False) -> List[int]:
+        return self.llm.tokenize(text.encode("utf-8"), add_bos=add_special_tokens, special=True)
+
+    def decode(self, token_ids: List[int]) -> str:
+        return self.llm.detokenize(token_ids).decode("utf-8", errors="ignore")
+
+
+class GGUFBackend(InferenceBackend):
+    """
+    A GGUF-quantized export of the model (e.g. Q4_K_M or Q8_0) on CPU through llama.cpp.
+
+    llama.cpp keeps the key/values of the previous prompt, so prompts sharing the fixed
+    RAG prefix only evaluate their new tokens. A Llama instance is not thread-safe, so
+    requests are served one at a time.
+    """
+
+    name = "gguf"
+
+    def __init__(self, config: Config):
+        super().__init__()
+        try:
+            from llama_cpp import Llama, LlamaRAMCache
+        except ImportError as e:
+            raise ImportError("The 'gguf' inference backend requires llama-cpp-python: pip install llama-cpp-python") from e
+        if not config.gguf_model_path:
+            raise ValueError("Config.gguf_model_path must point to a GGUF file for the 'gguf' inference backend")
+        self.config = config
+        self.llm = Llama(
+            model_path=config.gguf_model_path,
+            n_ctx=config.max_context_length,
+            n_threads=config.cpu_threads or None,
+            verbose=False
+        )
+        self.llm.set_cache(LlamaRAMCache())
+        self.tokenizer = LlamaCppTokenizer(self.llm)
+        self.generation_lock = threading.Lock()
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        # llama.cpp adds the begin-of-text token itself
+        prompt = prompt.strip()
+        if prompt.startswith("<|begin_of_text|>"):
+            prompt = prompt[len("<|begin_of_text|>"):]
+        with self.generation_lock:
+            start, tokens = time.perf_counter(), 0
+            for chunk in self.llm(
+                prompt,
+                max_tokens=self.config.max_new_tokens,
+                temperature=0.7,
+                top_p=0.9,
+                stop=["<|eot_id|>"],
+                stream=True
+            ):
+                tokens += 1
+                yield chunk["choices"][0]["text"]
+            self._record(tokens, start)
+
+    def warm_up(self):
+        with self.generation_lock:
+            self.llm("Hello", max_tokens=8)
+
+
+class StubBackend(InferenceBackend):
+    """
+    Deterministic stand-in for the model, for load tests and pipeline benchmarks without a GPU.
+
+    It answers with a fixed sentence quoting the user query, streamed word by word
+    over `latency_ms` in total.
+    """
+
+    name = "stub"
+
+    def __init__(self, latency_ms: float = 0.0, response: Optional[str] = None):
+        super().__init__()
+        self.latency_ms = latency_ms
+        self.response = response
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        start = time.perf_counter()
+        query = prompt.split("<|start_header_id|>user<|end_header_id|>")[-1].split("<|eot_id|>")[0].strip()
+        response = self.response or f"This is a stub answer to: {query}"
+        words = response.split(" ")
+        for i, word in enumerate(words):
+            if self.latency_ms:
+                time.sleep(self.latency_ms / 1000 / len(words))
+            yield word if i == 0 else f" {word}"
+        self._record(len(words), start)
+
+
+def create_backend(config: Config) -> InferenceBackend:
+    """Create the backend selected by Config.inference_backend."""
+    if config.inference_backend == "cuda":
+        return TransformersBackend(config, device="cuda")
+    if config.inference_backend == "cpu":
+        return TransformersBackend(config, device="cpu")
+    if config.inference_backend == "gguf":
+        return GGUFBackend(config)
+    if config.inference_backend == "stub":
+        return StubBackend(latency_ms=config.stub_latency_ms)
+    raise ValueError(f"Unknown inference backend: {config.inference_backend}")
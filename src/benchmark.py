@@ -0,0 +1,171 @@
+"""
+Retrieval and end-to-end benchmark driven by datasets/rag/qa_pairs_eval.xlsx.
+
+Usage (from the src directory):
+    python benchmark.py --k 5 --output benchmark_report.json
+    python benchmark.py --k 5 --e2e --llm stub --stub-latency-ms 200
+
+Relevance: when the sheet has a "Source" column, a retrieved document is relevant if its
+`source` metadata matches it. Otherwise a document is relevant when it contains at least
+--answer-overlap of the content words of the reference answer.
+
+The JSON report is written with sorted keys and no run id or timestamp, so that two runs
+can be diffed directly.
+"""
+import argparse
+import json
+import math
+import os
+import statistics
+import time
+from typing import Dict, List
+from openpyxl import load_workbook
+from bm25 import BM25Index
+from resources import get_config, get_chroma_client
+from rag import RAG
+
+
+def load_qa_pairs(file_path: str) -> List[Dict[str, str]]:
+    """Read the QA sheet into dicts keyed by lowercased column header (question, answer and optionally source)."""
+    workbook = load_workbook(file_path, read_only=True)
+    rows = workbook.active.iter_rows(values_only=True)
+    headers = [str(header).strip().lower() if header else "" for header in next(rows)]
+    qa_pairs = []
+    for row in rows:
+        pair = {header: str(value).strip() for header, value in zip(headers, row) if header and value is not None}
+        if pair.get("question"):
+            qa_pairs.append(pair)
+    return qa_pairs
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def nearest_rank(p: float) -> float:
+        return ordered[min(len(ordered) - 1, max(0, math.ceil(p * len(ordered) / 100) - 1))]
+
+    return {
+        "mean": round(statistics.fmean(ordered), 3),
+        "p50": round(nearest_rank(50), 3),
+        "p95": round(nearest_rank(95), 3),
+        "p99": round(nearest_rank(99), 3),
+        "max": round(ordered[-1], 3),
+    }
+
+
+def is_relevant(doc, pair: Dict[str, str], answer_overlap: float) -> bool:
+    if pair.get("source"):
+        return doc.metadata.get("source", "").lower() == pair["source"].lower()
+    answer_terms = set(BM25Index.tokenize(pair.get("answer", "")))
+    if not answer_terms:
+        return False
+    doc_terms = set(BM25Index.tokenize(doc.page_content))
+    return len(answer_terms & doc_terms) / len(answer_terms) >= answer_overlap
+
+
+def run_retrieval(rag: RAG, qa_pairs: List[Dict[str, str]], k: int, answer_overlap: float) -> Dict:
+    latencies, reciprocal_ranks, hits, queries = [], [], 0, []
+    for pair in qa_pairs:
+        start = time.perf_counter()
+        docs = rag.query_vector_store(pair["question"], k=k)
+        latency = (time.perf_counter() - start) * 1000
+        latencies.append(latency)
+
+        rank = next((i for i, doc in enumerate(docs, 1) if is_relevant(doc, pair, answer_overlap)), None)
+        hits += rank is not None
+        reciprocal_ranks.append(1 / rank if rank else 0.0)
+        queries.append({
+            "question": pair["question"],
+            "rank": rank,
+            "latency_ms": round(latency, 3),
+            "retrieved": [doc.metadata.get("context", "") for doc in docs],
+        })
+
+    return {
+        f"recall@{k}": round(hits / len(qa_pairs), 4) if qa_pairs else 0.0,
+        "mrr": round(statistics.fmean(reciprocal_ranks), 4) if qa_pairs else 0.0,
+        "latency_ms": percentiles(latencies),
+        "queries": queries,
+    }
+
+
+def run_end_to_end(engine, qa_pairs: List[Dict[str, str]]) -> Dict:
+    user_email = "benchmark@edvisor.local"
+    stage_latencies: Dict[str, List[float]] = {}
+    for pair in qa_pairs:
+        # A fresh chat per question keeps conversation memory out of the measurement
+        chat_id = engine.chat_manager.create_new_chat()
+        try:
+            engine.generate_response(chat_id, user_email, pair["question"])
+        finally:
+            engine.chat_manager.del_conversation(chat_id, user_email)
+        for stage, value in engine.last_timings.items():
+            stage_latencies.setdefault(stage, []).append(value)
+    return {
+        "stages": {stage: percentiles(values) for stage, values in stage_latencies.items()},
+        "response_cache": engine.response_cache.stats(),
+        "backend": engine.backend.metrics(),
+    }
+
+
+def main():
+    config = get_config()
+    parser = argparse.ArgumentParser(description="Benchmark Edvisor retrieval and generation.")
+    parser.add_argument("--qa-file", default=os.path.join(config.rag_dataset_path, "qa_pairs_eval.xlsx"))
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--limit", type=int, default=0, help="Only use the first N QA pairs.")
+    parser.add_argument("--answer-overlap", type=float, default=0.5)
+    parser.add_argument("--e2e", action="store_true", help="Also run Engine.generate_response.")
+    parser.add_argument("--llm", choices=["stub", "model"], default="stub",
+                        help="'model' uses the backend selected by Config.inference_backend.")
+    parser.add_argument("--stub-latency-ms", type=float, default=0.0)
+    parser.add_argument("--output", default="benchmark_report.json")
+    args = parser.parse_args()
+
+    qa_pairs = load_qa_pairs(args.qa_file)
+    if args.limit:
+        qa_pairs = qa_pairs[:args.limit]
+    print(f"Loaded {len(qa_pairs)} QA pairs from {args.qa_file}")
+
+    report = {
+        "run": {
+            "qa_file": os.path.basename(args.qa_file),
+            "qa_pairs": len(qa_pairs),
+            "k": args.k,
+            "relevance": "source" if any(pair.get("source") for pair in qa_pairs) else f"answer_overlap>={args.answer_overlap}",
+            "embedding_model": config.embedding_model,
+            "retrieval_mode": config.retrieval_mode,
+            "query_routing": config.query_routing,
+        }
+    }
+
+    if args.e2e:
+        from engine import Engine
+        from backends import StubBackend
+        engine = Engine(backend=StubBackend(latency_ms=args.stub_latency_ms) if args.llm == "stub" else None)
+        rag = engine.rag
+    else:
+        rag = RAG(get_chroma_client())
+
+    report["retrieval"] = run_retrieval(rag, qa_pairs, args.k, args.answer_overlap)
+    report["retrieval"]["retriever_stats"] = rag.get_retriever().stats()
+    if args.e2e:
+        # Start from cold retrieval caches so the retrieval stage is measured, not the LRU
+        rag.get_retriever().invalidate()
+        report["end_to_end"] = run_end_to_end(engine, qa_pairs)
+        report["run"]["llm"] = args.llm
+
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=2, sort_keys=True)
+
+    retrieval = report["retrieval"]
+    print(f"recall@{args.k}: {retrieval[f'recall@{args.k}']}  MRR: {retrieval['mrr']}  "
+          f"latency p50/p95/p99 (ms): {retrieval['latency_ms'].get('p50')}/"
+          f"{retrieval['latency_ms'].get('p95')}/{retrieval['latency_ms'].get('p99')}")
+    print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import json
+import math
+import os
+import re
+from collections import Counter
+from typing import Dict, List, Tuple
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "for", "from", "how", "i",
+    "in", "is", "it", "me", "my", "of", "on", "or", "the", "to", "what", "when", "where",
+    "which", "who", "with", "you",
+}
+
+
+class BM25Index:
+    """
+    Compact in-memory inverted index scoring documents with Okapi BM25.
+
+    Postings are stored per term as parallel lists of document positions and term
+    frequencies, which keeps the JSON file written next to the Chroma store small
+    and quick to load.
+    """
+
+    def __init__(self, doc_ids: List[str], doc_lengths: List[int], postings: Dict[str, List[List[int]]],
+                 k1: float = 1.5, b: float = 0.75):
+        self.doc_ids = doc_ids
+        self.doc_lengths = doc_lengths
+        self.postings = postings
+        self.k1 = k1
+        self.b = b
+        self.avg_length = sum(doc_lengths) / len(doc_lengths) if doc_lengths else 0.0
+        doc_count = len(doc_ids)
+        self.idf = {
+            term: math.log(1 + (doc_count - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, (docs, _) in postings.items()
+        }
+
+    @staticmethod
+    def tokenize(text: str) -> List[str]:
+        return [token for token in re.findall(r"[a-z0-9]+", text.lower()) if token not in STOPWORDS]
+
+    @classmethod
+    def build(cls, doc_ids: List[str], texts: List[str]) -> "BM25Index":
+        doc_lengths = []
+        postings: Dict[str, List[List[int]]] = {}
+        for position, text in enumerate(texts):
+            tokens = cls.tokenize(text)
+            doc_lengths.append(len(tokens))
+            for term, frequency in Counter(tokens).items():
+                docs, frequencies = postings.setdefault(term, [[], []])
+                docs.append(position)
+                frequencies.append(frequency)
+        return cls(list(doc_ids), doc_lengths, postings)
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[str, float]]:
+        """Return up to k (document id, BM25 score) pairs, best first."""
+        scores: Dict[int, float] = {}
+        for term in set(self.tokenize(query)):
+            if term not in self.postings:
+                continue
+            idf = self.idf[term]
+            docs, frequencies = self.postings[term]
+            for position, frequency in zip(docs, frequencies):
+                length_norm = 1 - self.b + self.b * self.doc_lengths[position] / (self.avg_length or 1)
+                score = idf * frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+                scores[position] = scores.get(position, 0.0) + score
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.doc_ids[position], score) for position, score in ranked]
+
+    def save(self, path: str) -> None:
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump({
+                "k1": self.k1,
+                "b": self.b,
+                "doc_ids": self.doc_ids,
+                "doc_lengths": self.doc_lengths,
+                "postings": self.postings,
+            }, file, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with open(path, 'r', encoding='utf-8') as file:
+            data = json.load(file)
+        return cls(data["doc_ids"], data["doc_lengths"], data["postings"], k1=data["k1"], b=data["b"])
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
@@ -1,135 +1,199 @@
 import uuid
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 from dataclasses import dataclass, field
 from datetime import datetime, timezone
-import chromadb
-from chromadb.config import Settings
-from chromadb.utils import embedding_functions
-from config import Config
-from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from resources import get_config, get_embedding_function
+from chat_persister import WriteBehindPersister
+from chat_store import ChromaChatStore, conversation_title, create_chat_store
+from conversation_search import ConversationSearch, DateLike
+from session_cache import SessionCache
 
 @dataclass
 class ChatData:
+    """
+    The latest messages of a chat, at most `window` of them (0 keeps all).
+
+    `older_cursor` is the paging cursor of the oldest message held when the chat has
+    older messages in the store, to be loaded page by page with ChatManager.get_chat_page.
+    Messages loaded from the store carry their cursor; messages added in this process
+    only have their created_at, which is unique within a chat in practice.
+    """
     messages: List[Dict[str, str]] = field(default_factory=list)
     created_at: str = field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
+    older_cursor: Optional[str] = None
+    window: int = 0
 
-    def add_message(self, role: str, content: str) -> None:
-        self.messages.append({"role": role, "content": content})
+    def add_message(self, role: str, content: str, created_at: Optional[str] = None) -> None:
+        created_at = created_at or datetime.now(timezone.utc).isoformat()
+        self.messages.append({"role": role, "content": content, "created_at": created_at})
+        if self.window and len(self.messages) > self.window:
+            del self.messages[:len(self.messages) - self.window]
+            self.older_cursor = self.messages[0].get('cursor') or self.messages[0]['created_at']
 
     def get_recent_messages(self, limit: int) -> List[Dict[str, str]]:
-        return self.messages[-limit:]
+        return [dict(msg) for msg in self.messages[-limit:]]
+
+    def size_bytes(self) -> int:
+        """Approximate memory held by the messages, used to bound the active chats cache."""
+        return sum(len(msg['content']) + 64 for msg in self.messages)
 
     @property
     def title(self) -> str:
         if self.messages:
             first_user_message = next((msg['content'] for msg in self.messages if msg['role'] == 'user'), "New Chat")
-            return first_user_message[:30] + "..." if len(first_user_message) > 30 else first_user_message
+            return conversation_title(first_user_message)
         return "New Chat"
 
 class ChatManager:
     def __init__(self,chroma_client):
-        self.config = Config()
+        self.config = get_config()
         self.chroma_client = chroma_client
         
-        self.embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(
-            model_name=self.config.embedding_model
+        self.embedding_function = get_embedding_function()
+        self.store = create_chat_store(self.config, chroma_client, self.embedding_function)
+        # Messages are written in batches on a background thread, off the request path
+        self.persister = None
+        if self.config.chat_write_behind:
+            self.persister = WriteBehindPersister(
+                self.store,
+                max_batch_size=self.config.chat_write_batch_size,
+                max_delay_ms=self.config.chat_write_max_delay_ms
+            )
+        # Optional embeddings of the messages, written off the request path
+        self.embedding_index = None
+        self.embedding_executor = None
+        if self.config.chat_embeddings and not isinstance(self.store, ChromaChatStore):
+            self.embedding_index = ChromaChatStore(chroma_client, self.embedding_function)
+            self.embedding_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-embeddings")
+        self.active_chats = SessionCache(
+            "active_chats",
+            max_entries=self.config.session_cache_max_entries,
+            idle_ttl=self.config.session_cache_idle_ttl,
+            max_bytes=self.config.session_cache_max_bytes,
+            sizeof=lambda chat: chat.size_bytes()
         )
-        self.user_collection = {}
-        self.active_chats: Dict[str,Dict[str, ChatData] ] = {}
-
-    def get_user_collection(self, user_email: str):
-        if user_email not in self.user_collection:
-            collection_name = f"chat_history_{user_email.replace('@', '_at_')}"
-            self.user_collection[user_email] = self.chroma_client.get_or_create_collection(
-                name=collection_name,
-                embedding_function=self.embedding_function
+        # Semantic search over the stored message embeddings, served by Chroma's index of each user's collection
+        self.vector_store = self.store if isinstance(self.store, ChromaChatStore) else self.embedding_index
+        self.conversation_search = None
+        if self.vector_store is not None:
+            self.conversation_search = ConversationSearch(
+                get_collection=self.vector_store.get_user_collection,
+                embed_query=lambda query: self.embedding_function([query])[0]
             )
-        return self.user_collection[user_email]
 
     def create_new_chat(self) -> str:
         chat_id = str(uuid.uuid4())
-        self.active_chats[chat_id] = ChatData()
+        self.active_chats.put(chat_id, ChatData(window=self.config.chat_history_window))
         return chat_id
 
     def add_message(self, chat_id: str, role: str, content: str, user_email:str):
-        collection = self.get_user_collection(user_email)
-        message_id = str(uuid.uuid4())
-        metadata = {
-            "chat_id": chat_id,
-            "role": role,
-            "created_at": datetime.now(timezone.utc).isoformat()
-        }
-        collection.add(
-            documents=[content],
-            metadatas=[metadata],
-            ids=[f"{chat_id}_{message_id}"]
-            )
+        created_at = datetime.now(timezone.utc).isoformat()
+        if self.persister is not None:
+            self.persister.enqueue({
+                "user_email": user_email, "chat_id": chat_id, "role": role, "content": content, "created_at": created_at
+            })
+        else:
+            self.store.add_message(user_email, chat_id, role, content, created_at)
+        if self.embedding_index is not None:
+            self.embedding_executor.submit(self._index_message, user_email, chat_id, role, content, created_at)
         
-        self.active_chats[chat_id].add_message(role, content)
+        # A chat that is not cached is loaded from the store on its next read
+        chat = self.active_chats.get(chat_id)
+        if chat is not None:
+            chat.add_message(role, content, created_at)
+            self.active_chats.resize(chat_id)
+
+    def _index_message(self, user_email: str, chat_id: str, role: str, content: str, created_at: str):
+        try:
+            self.embedding_index.add_message(user_email, chat_id, role, content, created_at)
+        except Exception as e:
+            print(f"Error embedding chat message: {str(e)}")
         
         
+    def get_chat_window(self, chat_id: str, user_email: str) -> Tuple[List[Dict[str, str]], Optional[str]]:
+        """
+        The latest Config.chat_history_window messages of a chat, oldest first.
+
+        Returns:
+            tuple: The messages and the cursor for get_chat_page, or None when there are no older messages.
+        """
+        # Fetch the latest messages from the store if not in active chats
+        def load_chat() -> ChatData:
+            self.flush()
+            messages, older_cursor = self.store.get_messages_page(
+                user_email, chat_id, limit=self.config.chat_history_window)
+            return ChatData(messages=messages, older_cursor=older_cursor, window=self.config.chat_history_window)
+
+        chat = self.active_chats.get_or_load(chat_id, load_chat)
+        # Copies, so that callers can extend their list without touching the cache
+        return chat.get_recent_messages(len(chat.messages)), chat.older_cursor
+
     def get_chat_history(self, chat_id: str,user_email:str) -> List[Dict[str, str]]:
-        if chat_id  not in self.active_chats:
-            
-            # Fetch chat history from Chroma if not in active chats
-            collection = self.get_user_collection(user_email)
-            results = collection.get(
-                where={"chat_id": chat_id},
-                include=['metadatas', 'documents']
-                )
-            messages = [
-                {"role": meta['role'], "content": doc,"created_at": meta['created_at']}
-                for meta, doc in zip(results['metadatas'], results['documents'])
-                ]
-            sorted_messages = sorted(messages, key=lambda x: x['created_at'])
+        """The latest Config.chat_history_window messages of a chat, oldest first."""
+        return self.get_chat_window(chat_id, user_email)[0]
+
+    def get_chat_page(self, chat_id: str, user_email: str, before: str,
+                      limit: Optional[int] = None) -> Tuple[List[Dict[str, str]], Optional[str]]:
+        """
+        The page of messages created before the cursor `before`, oldest first. Older pages are not cached.
+
+        Returns:
+            tuple: The messages and the cursor of the next older page, or None at the start of the chat.
+        """
+        self.flush()
+        return self.store.get_messages_page(
+            user_email, chat_id, limit=limit or self.config.chat_history_window, before=before)
 
-            self.active_chats[chat_id] = ChatData(messages=sorted_messages)
 
-        return self.active_chats[chat_id].messages
+    def flush(self):
+        """
+        Wait for queued message writes, so that reads from the store see them.
 
+        The wait is bounded by Config.chat_write_flush_timeout_s: while the store is
+        failing, reads go ahead without the queued messages instead of hanging the UI.
+        """
+        if self.persister is not None and not self.persister.flush(timeout=self.config.chat_write_flush_timeout_s):
+            print(f"Chat store flush timed out after {self.config.chat_write_flush_timeout_s} s, "
+                  f"reading without {self.persister.stats()['pending']} queued messages")
 
     def del_conversation(self, chat_id: str,user_email:str):
-        collection = self.get_user_collection(user_email)
-        collection.delete(where={"chat_id": chat_id})
-        if chat_id in self.active_chats:
-            del self.active_chats[chat_id]
+        self.flush()
+        self.store.delete_chat(user_email, chat_id)
+        if self.embedding_index is not None:
+            self.embedding_executor.submit(self.embedding_index.delete_chat, user_email, chat_id)
+        self.active_chats.pop(chat_id)
 
+    def search_conversations(self, user_email: str, query: str, k: Optional[int] = None, start: DateLike = None,
+                             end: DateLike = None, chat_ids: Optional[List[str]] = None) -> List[Dict]:
+        """
+        The past messages of the user that best match `query`, best first.
 
-    def get_all_conversations(self, user_email: str) -> List[Dict]:
-        collection = self.get_user_collection(user_email)
-        results = collection.get(
-            where={},  # Get all documents for this user
-            include=['metadatas', 'documents']
-        )
-        
-        # Group messages by chat_id
-        chat_messages = defaultdict(list)
-        for meta, doc in zip(results['metadatas'], results['documents']):
-            chat_messages[meta['chat_id']].append({
-                "role": meta['role'],
-                "content": doc,
-                "created_at": meta['created_at']
-            })
-        
-        conversations = []
-        for chat_id, messages in chat_messages.items():
-            # Sort messages by timestamp
-            sorted_messages = sorted(messages, key=lambda x: x['created_at'])
-            
-            # Create ChatData object
-            chat_data = ChatData(messages=[
-                {"role": msg['role'], "content": msg['content']}
-                for msg in sorted_messages
-            ])
-            
-            # Get the first message's timestamp as the creation time
-            created_at = sorted_messages[0]['created_at'] if sorted_messages else None
-            
-            conversations.append({
-                "id": chat_id,
-                "title": chat_data.title,
-                "created_at": created_at
-            })
-        
-        # Sort conversations by creation time, most recent first
-        return sorted(conversations, key=lambda x: x['created_at'], reverse=True)
\ No newline at end of file
+        Args:
+            k: Number of results, Config.chat_search_results by default.
+            start, end: Only messages created in this range (datetimes or ISO strings, inclusive).
+            chat_ids: Only messages of these chats.
+
+        Returns:
+            list: Dicts with "chat_id", "role", "content", "created_at" and "score" (cosine similarity).
+                  Empty when message embeddings are disabled.
+        """
+        if self.conversation_search is None or not query.strip():
+            return []
+        return self.conversation_search.search(
+            user_email, query, k=k or self.config.chat_search_results, start=start, end=end, chat_ids=chat_ids)
+
+
+    def get_all_conversations(self, user_email: str, limit: Optional[int] = None, offset: int = 0) -> List[Dict]:
+        """
+        List the user's conversations, most recent first.
+
+        Returns:
+            list: Dicts with "id", "title", "created_at", "last_activity" and "message_count".
+        """
+        self.flush()
+        return self.store.list_conversations(user_email, limit=limit, offset=offset)
+
+    def count_conversations(self, user_email: str) -> int:
+        self.flush()
+        return self.store.count_conversations(user_email)
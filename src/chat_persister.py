@@ -0,0 +1,136 @@
+import atexit
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+from chat_store import ChatStore
+
+
+class WriteBehindPersister:
+    """
+    Asynchronous, batched writes of chat messages to a ChatStore.
+
+    enqueue() only appends the message to an in-memory queue, so saving a turn never
+    waits on storage. A background thread writes the queue to the store with
+    add_messages(), in batches of up to `max_batch_size` messages. A batch is written
+    as soon as it is full, or once its oldest message has waited `max_delay_ms`.
+
+    Durability:
+      - A message is durable once the batch holding it has been written: flush()
+        returns after everything enqueued before the call is in the store.
+      - Messages are written in the order they were enqueued. A failed batch is retried,
+        first in line, every `retry_delay_s` seconds, so later messages never overtake
+        it.
+      - On a normal interpreter exit, close() runs through atexit and writes
+        everything still queued. If the store keeps failing during close(), the
+        remaining messages are reported and dropped.
+      - A hard crash (SIGKILL, power loss) loses everything still queued. While the
+        store is healthy, that is at most the messages of the last `max_delay_ms`
+        plus the batch being written.
+      - Readers that go to the store call flush() first (see ChatManager), so a chat
+        always reads back its own queued messages.
+    """
+
+    def __init__(self, store: ChatStore, max_batch_size: int = 64, max_delay_ms: float = 50,
+                 retry_delay_s: float = 1.0):
+        self.store = store
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay_ms / 1000
+        self.retry_delay = retry_delay_s
+        self.condition = threading.Condition()
+        # (enqueue time, message)
+        self.pending: "deque[Tuple[float, Dict[str, str]]]" = deque()
+        self.enqueued = 0
+        self.written = 0
+        self.closed = False
+        # Number of flush() calls waiting; the writer skips the batch delay while any are
+        self.flushing = 0
+        self.counters = {"messages": 0, "batches": 0, "failures": 0, "dropped": 0, "max_pending": 0, "write_ms": 0.0}
+        self.thread = threading.Thread(target=self._run, name="chat-persister", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def enqueue(self, message: Dict[str, str]):
+        """Queue a message dict ("user_email", "chat_id", "role", "content", "created_at") for writing."""
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("The chat persister is closed")
+            self.pending.append((time.perf_counter(), message))
+            self.enqueued += 1
+            self.counters["max_pending"] = max(self.counters["max_pending"], len(self.pending))
+            self.condition.notify_all()
+
+    def _take_batch(self) -> Optional[List[Dict[str, str]]]:
+        with self.condition:
+            while not self.pending:
+                if self.closed:
+                    return None
+                self.condition.wait()
+            while len(self.pending) < self.max_batch_size and not self.closed and not self.flushing:
+                remaining = self.pending[0][0] + self.max_delay - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self.condition.wait(timeout=remaining)
+            return [message for _, message in list(self.pending)[:self.max_batch_size]]
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+            start = time.perf_counter()
+            try:
+                self.store.add_messages(batch)
+            except Exception as e:
+                print(f"Error writing {len(batch)} chat messages: {str(e)}")
+                with self.condition:
+                    self.counters["failures"] += 1
+                    if self.closed:
+                        # Shutting down: do not block the exit on a failing store
+                        self.counters["dropped"] += len(self.pending)
+                        print(f"Dropping {len(self.pending)} unwritten chat messages")
+                        self.written += len(self.pending)
+                        self.pending.clear()
+                        self.condition.notify_all()
+                        continue
+                time.sleep(self.retry_delay)
+                continue
+            with self.condition:
+                # The batch stays queued until written, so a failure retries it in order
+                for _ in batch:
+                    self.pending.popleft()
+                self.written += len(batch)
+                self.counters["messages"] += len(batch)
+                self.counters["batches"] += 1
+                self.counters["write_ms"] += (time.perf_counter() - start) * 1000
+                self.condition.notify_all()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every message enqueued so far is written. Returns False on timeout."""
+        with self.condition:
+            target = self.enqueued
+            if self.written >= target:
+                return True
+            # Write now instead of waiting for the batch delay
+            self.flushing += 1
+            self.condition.notify_all()
+            try:
+                return self.condition.wait_for(lambda: self.written >= target, timeout=timeout)
+            finally:
+                self.flushing -= 1
+
+    def close(self, timeout: Optional[float] = 10):
+        """Write everything still queued and stop the background thread."""
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join(timeout)
+
+    def stats(self) -> Dict[str, float]:
+        with self.condition:
+            stats = dict(self.counters)
+            stats["pending"] = len(self.pending)
+        stats["avg_batch_size"] = stats["messages"] / stats["batches"] if stats["batches"] else 0.0
+        return stats
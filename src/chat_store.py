@@ -0,0 +1,439 @@
+import os
+import sqlite3
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+from conversation_search import created_at_epoch
+
+
+def conversation_title(first_user_message: str) -> str:
+    """Sidebar title of a conversation: its first user message, cut to 30 characters."""
+    return first_user_message[:30] + "..." if len(first_user_message) > 30 else first_user_message
+
+
+class ChatStore(ABC):
+    """
+    Storage for chat messages.
+
+    Messages are only ever read back per chat or per user, in creation order, so a
+    store needs no embeddings. Each message is returned as a dict with "role",
+    "content", "created_at" and "chat_id". Conversations are listed as dicts with
+    "id", "title", "created_at", "last_activity" and "message_count", newest first.
+
+    Paging cursors are opaque strings "<created_at>|<position>", where the position
+    orders messages with the same timestamp. A bare created_at is accepted as a cursor
+    too and selects the messages strictly older than it.
+    """
+
+    @staticmethod
+    def parse_cursor(cursor: str) -> Tuple[str, Optional[int]]:
+        created_at, separator, position = cursor.rpartition("|")
+        if not separator:
+            return cursor, None
+        return created_at, int(position)
+
+    @abstractmethod
+    def add_message(self, user_email: str, chat_id: str, role: str, content: str, created_at: str) -> str:
+        """Store one message and return its id."""
+
+    def add_messages(self, messages: List[Dict[str, str]]) -> List[str]:
+        """
+        Store several messages, each a dict with "user_email", "chat_id", "role", "content"
+        and "created_at". Stores that can write them in one transaction override this.
+        """
+        return [
+            self.add_message(m["user_email"], m["chat_id"], m["role"], m["content"], m["created_at"])
+            for m in messages
+        ]
+
+    @abstractmethod
+    def get_messages(self, user_email: str, chat_id: str) -> List[Dict[str, str]]:
+        """The messages of one chat, oldest first."""
+
+    def get_messages_page(self, user_email: str, chat_id: str, limit: int,
+                          before: Optional[str] = None) -> Tuple[List[Dict[str, str]], Optional[str]]:
+        """
+        The latest `limit` messages of a chat before the cursor `before`, oldest first.
+        Each message also has its own "cursor".
+
+        Returns:
+            tuple: The messages and the cursor of the next older page (the cursor of the
+                   oldest message returned), or None when there are no older messages.
+        """
+        messages = self.get_messages(user_email, chat_id)
+        for position, message in enumerate(messages):
+            message['cursor'] = f"{message['created_at']}|{position}"
+        if before is not None:
+            created_at, position = self.parse_cursor(before)
+            messages = messages[:position] if position is not None else [
+                message for message in messages if message['created_at'] < created_at]
+        page = messages[-limit:]
+        return page, (page[0]['cursor'] if len(messages) > len(page) else None)
+
+    @abstractmethod
+    def get_user_messages(self, user_email: str) -> List[Dict[str, str]]:
+        """All messages of a user, grouped by chat and oldest first within each chat."""
+
+    @abstractmethod
+    def delete_chat(self, user_email: str, chat_id: str):
+        """Delete every message of a chat."""
+
+    def list_conversations(self, user_email: str, limit: Optional[int] = None, offset: int = 0) -> List[Dict]:
+        """One page of the user's conversations. Derived from all messages unless a store keeps an index."""
+        chat_messages = defaultdict(list)
+        for message in self.get_user_messages(user_email):
+            chat_messages[message['chat_id']].append(message)
+        conversations = []
+        for chat_id, messages in chat_messages.items():
+            first_user_message = next((msg['content'] for msg in messages if msg['role'] == 'user'), None)
+            conversations.append({
+                "id": chat_id,
+                "title": conversation_title(first_user_message) if first_user_message is not None else "New Chat",
+                "created_at": messages[0]['created_at'],
+                "last_activity": messages[-1]['created_at'],
+                "message_count": len(messages),
+            })
+        conversations.sort(key=lambda x: x['created_at'], reverse=True)
+        return conversations[offset:offset + limit if limit is not None else None]
+
+    def count_conversations(self, user_email: str) -> int:
+        return len(self.list_conversations(user_email))
+
+    def close(self):
+        pass
+
+
+class SQLiteChatStore(ChatStore):
+    """
+    Chat messages in a SQLite database in write-ahead-log mode.
+
+    The (user_email, chat_id, created_at) index serves every read in order straight
+    from the index. WAL lets several app replicas share the database file. The store
+    keeps one connection and serializes its use with a lock, because a sqlite3
+    connection must not be used from two threads at once, and Streamlit runs most
+    reruns on a new thread, so a connection per thread would leak with every rerun.
+
+    The conversations table keeps one row per chat (title, first and last message
+    time, message count). It is updated in the same transaction as each message
+    write, so listing conversations reads only the rows of the requested page.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS messages (
+            id TEXT PRIMARY KEY,
+            user_email TEXT NOT NULL,
+            chat_id TEXT NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_messages_user_chat_created
+            ON messages (user_email, chat_id, created_at);
+        CREATE TABLE IF NOT EXISTS conversations (
+            user_email TEXT NOT NULL,
+            chat_id TEXT NOT NULL,
+            title TEXT,
+            created_at TEXT NOT NULL,
+            last_activity TEXT NOT NULL,
+            message_count INTEGER NOT NULL,
+            PRIMARY KEY (user_email, chat_id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_conversations_user_created
+            ON conversations (user_email, created_at);
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Reentrant, so that a method holding it can call another one
+        self.lock = threading.RLock()
+        self.connection: Optional[sqlite3.Connection] = None
+        with self.lock:
+            connection = self._connection()
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(self.SCHEMA)
+            self._backfill_conversations()
+
+    def _connection(self) -> sqlite3.Connection:
+        """The shared connection, opened on first use. Callers must hold self.lock."""
+        if self.connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            connection.row_factory = sqlite3.Row
+            # Safe with WAL: a power loss can only lose the last transactions, never corrupt the database
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection = connection
+        return self.connection
+
+    def _fetchall(self, sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+        with self.lock:
+            return self._connection().execute(sql, params).fetchall()
+
+    @staticmethod
+    def _to_message(row: sqlite3.Row) -> Dict[str, str]:
+        return {"role": row["role"], "content": row["content"], "created_at": row["created_at"], "chat_id": row["chat_id"]}
+
+    def add_message(self, user_email: str, chat_id: str, role: str, content: str, created_at: str) -> str:
+        return self.add_messages([{
+            "user_email": user_email, "chat_id": chat_id, "role": role, "content": content, "created_at": created_at
+        }])[0]
+
+    def add_messages(self, messages: List[Dict[str, str]]) -> List[str]:
+        # All messages and their conversation updates are committed in one transaction
+        message_ids = [f"{m['chat_id']}_{uuid.uuid4()}" for m in messages]
+        with self.lock, self._connection() as connection:
+            connection.executemany(
+                "INSERT INTO messages (id, user_email, chat_id, role, content, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (message_id, m["user_email"], m["chat_id"], m["role"], m["content"], m["created_at"])
+                    for message_id, m in zip(message_ids, messages)
+                ]
+            )
+            connection.executemany(
+                "INSERT INTO conversations (user_email, chat_id, title, created_at, last_activity, message_count) "
+                "VALUES (?, ?, ?, ?, ?, 1) "
+                "ON CONFLICT (user_email, chat_id) DO UPDATE SET "
+                "title = COALESCE(conversations.title, excluded.title), "
+                "created_at = MIN(conversations.created_at, excluded.created_at), "
+                "last_activity = MAX(conversations.last_activity, excluded.last_activity), "
+                "message_count = conversations.message_count + 1",
+                [
+                    (m["user_email"], m["chat_id"], conversation_title(m["content"]) if m["role"] == "user" else None,
+                     m["created_at"], m["created_at"])
+                    for m in messages
+                ]
+            )
+        return message_ids
+
+    def _backfill_conversations(self):
+        """Build the conversations rows of databases written before the table existed."""
+        connection = self._connection()
+        missing = connection.execute(
+            "SELECT DISTINCT user_email, chat_id FROM messages m WHERE NOT EXISTS "
+            "(SELECT 1 FROM conversations c WHERE c.user_email = m.user_email AND c.chat_id = m.chat_id)"
+        ).fetchall()
+        if not missing:
+            return
+        with connection:
+            for row in missing:
+                messages = self.get_messages(row["user_email"], row["chat_id"])
+                first_user_message = next((msg['content'] for msg in messages if msg['role'] == 'user'), None)
+                connection.execute(
+                    "INSERT INTO conversations (user_email, chat_id, title, created_at, last_activity, message_count) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (row["user_email"], row["chat_id"],
+                     conversation_title(first_user_message) if first_user_message is not None else None,
+                     messages[0]['created_at'], messages[-1]['created_at'], len(messages))
+                )
+        print(f"Indexed {len(missing)} conversations in {self.path}")
+
+    def get_messages(self, user_email: str, chat_id: str) -> List[Dict[str, str]]:
+        rows = self._fetchall(
+            "SELECT chat_id, role, content, created_at FROM messages "
+            "WHERE user_email = ? AND chat_id = ? ORDER BY created_at, rowid",
+            (user_email, chat_id)
+        )
+        return [self._to_message(row) for row in rows]
+
+    def get_messages_page(self, user_email: str, chat_id: str, limit: int,
+                          before: Optional[str] = None) -> Tuple[List[Dict[str, str]], Optional[str]]:
+        # Walks the (user_email, chat_id, created_at) index backwards; one extra row tells if there is more.
+        # The cursor position is the rowid, so messages with the same created_at are never skipped at a page boundary.
+        before_clause, params = "", ()
+        if before is not None:
+            created_at, rowid = self.parse_cursor(before)
+            if rowid is None:
+                before_clause, params = "AND created_at < ? ", (created_at,)
+            else:
+                before_clause, params = "AND (created_at < ? OR (created_at = ? AND rowid < ?)) ", (created_at, created_at, rowid)
+        rows = self._fetchall(
+            "SELECT rowid, chat_id, role, content, created_at FROM messages "
+            f"WHERE user_email = ? AND chat_id = ? {before_clause}"
+            "ORDER BY created_at DESC, rowid DESC LIMIT ?",
+            (user_email, chat_id, *params, limit + 1)
+        )
+        page = [
+            {**self._to_message(row), "cursor": f"{row['created_at']}|{row['rowid']}"}
+            for row in reversed(rows[:limit])
+        ]
+        return page, (page[0]['cursor'] if len(rows) > limit else None)
+
+    def get_user_messages(self, user_email: str) -> List[Dict[str, str]]:
+        rows = self._fetchall(
+            "SELECT chat_id, role, content, created_at FROM messages "
+            "WHERE user_email = ? ORDER BY chat_id, created_at, rowid",
+            (user_email,)
+        )
+        return [self._to_message(row) for row in rows]
+
+    def delete_chat(self, user_email: str, chat_id: str):
+        with self.lock, self._connection() as connection:
+            connection.execute("DELETE FROM messages WHERE user_email = ? AND chat_id = ?", (user_email, chat_id))
+            connection.execute("DELETE FROM conversations WHERE user_email = ? AND chat_id = ?", (user_email, chat_id))
+
+    def list_conversations(self, user_email: str, limit: Optional[int] = None, offset: int = 0) -> List[Dict]:
+        rows = self._fetchall(
+            "SELECT chat_id, title, created_at, last_activity, message_count FROM conversations "
+            "WHERE user_email = ? ORDER BY created_at DESC LIMIT ? OFFSET ?",
+            (user_email, -1 if limit is None else limit, offset)
+        )
+        return [
+            {
+                "id": row["chat_id"],
+                "title": row["title"] or "New Chat",
+                "created_at": row["created_at"],
+                "last_activity": row["last_activity"],
+                "message_count": row["message_count"],
+            }
+            for row in rows
+        ]
+
+    def list_users(self) -> List[str]:
+        rows = self._fetchall("SELECT DISTINCT user_email FROM conversations ORDER BY user_email")
+        return [row["user_email"] for row in rows]
+
+    def count_conversations(self, user_email: str) -> int:
+        return self._fetchall(
+            "SELECT COUNT(*) FROM conversations WHERE user_email = ?", (user_email,)
+        )[0][0]
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+
+class ChromaChatStore(ChatStore):
+    """
+    Chat messages in one Chroma collection per user, as before the SQLite store.
+
+    Every write embeds the message, so this is only worth it when the message
+    embeddings are needed. Each message also stores its created_at as epoch seconds
+    ("created_at_ts"), which Chroma can filter by range.
+    """
+
+    @staticmethod
+    def metadata(chat_id: str, role: str, created_at: str) -> Dict:
+        return {"chat_id": chat_id, "role": role, "created_at": created_at, "created_at_ts": created_at_epoch(created_at)}
+
+    def __init__(self, chroma_client, embedding_function):
+        self.chroma_client = chroma_client
+        self.embedding_function = embedding_function
+        self.user_collection = {}
+
+    @staticmethod
+    def collection_name(user_email: str) -> str:
+        return f"chat_history_{user_email.replace('@', '_at_')}"
+
+    def get_user_collection(self, user_email: str):
+        if user_email not in self.user_collection:
+            self.user_collection[user_email] = self.chroma_client.get_or_create_collection(
+                name=self.collection_name(user_email),
+                embedding_function=self.embedding_function
+            )
+        return self.user_collection[user_email]
+
+    def add_message(self, user_email: str, chat_id: str, role: str, content: str, created_at: str) -> str:
+        message_id = f"{chat_id}_{uuid.uuid4()}"
+        self.get_user_collection(user_email).add(
+            documents=[content],
+            metadatas=[self.metadata(chat_id, role, created_at)],
+            ids=[message_id]
+        )
+        return message_id
+
+    def _get(self, user_email: str, where: Dict) -> List[Dict[str, str]]:
+        results = self.get_user_collection(user_email).get(where=where, include=['metadatas', 'documents'])
+        return [
+            {"role": meta['role'], "content": doc, "created_at": meta['created_at'], "chat_id": meta['chat_id']}
+            for meta, doc in zip(results['metadatas'], results['documents'])
+        ]
+
+    def get_messages(self, user_email: str, chat_id: str) -> List[Dict[str, str]]:
+        return sorted(self._get(user_email, {"chat_id": chat_id}), key=lambda x: x['created_at'])
+
+    def get_user_messages(self, user_email: str) -> List[Dict[str, str]]:
+        return sorted(self._get(user_email, {}), key=lambda x: (x['chat_id'], x['created_at']))
+
+    def delete_chat(self, user_email: str, chat_id: str):
+        self.get_user_collection(user_email).delete(where={"chat_id": chat_id})
+
+
+def create_chat_store(config, chroma_client, embedding_function) -> ChatStore:
+    """Create the store selected by Config.chat_store."""
+    if config.chat_store == "sqlite":
+        return SQLiteChatStore(config.chat_store_path)
+    if config.chat_store == "chroma":
+        return ChromaChatStore(chroma_client, embedding_function)
+    raise ValueError(f"Unknown chat store: {config.chat_store}")
+
+
+def backfill_chat_embeddings(store: SQLiteChatStore, vector_store: ChromaChatStore, batch_size: int = 64) -> int:
+    """
+    Embed the messages of `store` that are missing from `vector_store`, such as those
+    written while Config.chat_embeddings was off, so that conversation search finds them.
+    Messages are matched by (chat_id, created_at, role). Messages embedded before the
+    "created_at_ts" metadata existed get it added, so date-filtered searches find them.
+
+    Returns:
+        int: The number of messages embedded.
+    """
+    embedded = 0
+    for user_email in store.list_users():
+        collection = vector_store.get_user_collection(user_email)
+        stored = collection.get(include=['metadatas'])
+        existing = {(meta['chat_id'], meta['created_at'], meta['role']) for meta in stored['metadatas']}
+        untimed = [(message_id, meta) for message_id, meta in zip(stored['ids'], stored['metadatas'])
+                   if 'created_at_ts' not in meta]
+        for start in range(0, len(untimed), batch_size):
+            batch = untimed[start:start + batch_size]
+            collection.update(
+                ids=[message_id for message_id, _ in batch],
+                metadatas=[vector_store.metadata(meta['chat_id'], meta['role'], meta['created_at']) for _, meta in batch]
+            )
+        missing = [
+            message for message in store.get_user_messages(user_email)
+            if (message['chat_id'], message['created_at'], message['role']) not in existing
+        ]
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start:start + batch_size]
+            collection.add(
+                documents=[message['content'] for message in batch],
+                metadatas=[
+                    vector_store.metadata(message['chat_id'], message['role'], message['created_at'])
+                    for message in batch
+                ],
+                ids=[f"{message['chat_id']}_{uuid.uuid4()}" for message in batch]
+            )
+        embedded += len(missing)
+        print(f"Embedded {len(missing)} chat messages of {user_email}")
+    return embedded
+
+
+def import_chroma_history(chroma_client, store: ChatStore) -> int:
+    """
+    Copy the chat histories kept in Chroma ("chat_history_<user>" collections) into `store`.
+
+    Returns:
+        int: The number of messages copied.
+    """
+    copied = 0
+    for collection in chroma_client.list_collections():
+        name = getattr(collection, "name", collection)
+        if not name.startswith("chat_history_"):
+            continue
+        user_email = name[len("chat_history_"):].replace("_at_", "@")
+        results = chroma_client.get_collection(name).get(include=['metadatas', 'documents'])
+        existing = {
+            (message["chat_id"], message["created_at"], message["role"])
+            for message in store.get_user_messages(user_email)
+        }
+        for meta, doc in sorted(zip(results['metadatas'], results['documents']), key=lambda x: x[0]['created_at']):
+            if (meta['chat_id'], meta['created_at'], meta['role']) in existing:
+                continue
+            store.add_message(user_email, meta['chat_id'], meta['role'], doc, meta['created_at'])
+            copied += 1
+        print(f"Imported chat history of {user_email}")
+    return copied
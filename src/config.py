@@ -1,8 +1,6 @@
 import os
 import json
 from dataclasses import dataclass, field
-from transformers import BitsAndBytesConfig
-import torch
 
 @dataclass
 class Config:
@@ -20,27 +18,102 @@ class Config:
     scopes:list = field(default="",init=False)
     redirect_uris: list = field(default="",init=False)
 
-    #Quantization Configurations
-    quant_config: BitsAndBytesConfig = field(default_factory=lambda: BitsAndBytesConfig(
-        load_in_4bit=True,
-        bnb_4bit_use_double_quant=True,
-        bnb_4bit_quant_type="nf4",
-        bnb_4bit_compute_dtype=torch.bfloat16,
-    ))
+    #Quantization Configurations (turned into a BitsAndBytesConfig by the quant_config property)
+    load_in_4bit: bool = True
+    bnb_4bit_use_double_quant: bool = True
+    bnb_4bit_quant_type: str = "nf4"
+    bnb_4bit_compute_dtype: str = "bfloat16"
 
     #Model Configurations
     base_model: str = "Dpngtm/llama-3-8b-Instruct-finetuned-edvisor-thesis"
     embedding_model: str = "sentence-transformers/multi-qa-mpnet-base-cos-v1"
+    # Inference backend: "cuda" (4-bit, bitsandbytes), "cpu" (int8 dynamic quantization),
+    # "gguf" (llama.cpp, gguf_model_path) or "stub" (deterministic, no model)
+    inference_backend: str = "cuda"
+    gguf_model_path: str = ""
+    cpu_threads: int = 0  # 0 lets the runtime decide
+    stub_latency_ms: float = 0.0
+    # Optional small model for speculative (assisted) decoding, e.g. "meta-llama/Llama-3.2-1B-Instruct".
+    # Its proposals are verified by base_model, so answers follow the same distribution.
+    draft_model: str = ""
+    num_assistant_tokens: int = 5
 
     #Name of the API keys file
     api_keys_file: str = "api_keys.json"
 
     chroma_persist_directory: str = field(default="",init=False)
+    rag_manifest_path: str = field(default="",init=False)
+    bm25_index_path: str = field(default="",init=False)
+    query_aliases_path: str = field(default="",init=False)
+    embedding_cache_dir: str = field(default="",init=False)
+    chat_store_path: str = field(default="",init=False)
+    embedding_cache_size: int = 100000
     max_context_length: int = 4096
-    chat_history_limit: int = 20
+    max_new_tokens: int = 1024
+
+    #Generation scheduler configurations
+    generation_max_batch_size: int = 4
+    generation_max_wait_ms: int = 20
+    generation_length_bucket: int = 256  # max prompt length difference (tokens) within a batch
+    prefix_cache_enabled: bool = True
+
+    #Context packing configurations
+    retrieval_candidates: int = 8
+    context_token_budget: int = 2048
+    memory_token_budget: int = 1024  # conversation memory in the prompt, trimmed to its most recent part
+    similarity_floor: float = 0.0  # 1 - squared L2 distance; 0.0 is a cosine similarity of 0.5
+
+    #RAG ingestion configurations
+    ingest_workers: int = 4  # parser processes; above 1 they are spawned, which re-imports the calling script,
+                             # so scripts building the RAG store must guard their code with if __name__ == "__main__":
+    ingest_batch_size: int = 100
+    ingest_batch_tokens: int = 16384
+    embedding_max_tokens: int = 512
+
+    #Retrieval configurations
+    retrieval_cache_size: int = 256
+    retrieval_mode: str = "hybrid"  # "vector" or "hybrid" (BM25 + vector, fused with reciprocal rank fusion)
+    hybrid_candidates: int = 20
+    rrf_k: int = 60
+    query_routing: bool = True
+
+    #Intent routing configurations (small talk is answered from templates, without the LLM)
+    intent_routing: bool = True
+    intent_similarity_threshold: float = 0.75
+    intent_max_words: int = 6
+
+    #Semantic response cache configurations
+    response_cache_threshold: float = 0.95
+    response_cache_ttl: int = 86400  # seconds
+    response_cache_size: int = 1000
+    chat_history_limit: int = 20  # conversation turns kept verbatim in the memory window
+    memory_window_tokens: int = 768  # token cap of the verbatim window; older turns are summarized
+    memory_summarizer: str = "extractive"  # "extractive" or "llm" (local model)
+    memory_summary_max_chars: int = 1200
+
+    #Chat history storage configurations
+    chat_store: str = "sqlite"  # "sqlite" (chat_store_path) or "chroma" (embeds every message)
+    chat_embeddings: bool = True  # also embed messages into Chroma, in the background (needed for conversation search;
+                                  # Utils.backfill_chat_embeddings() embeds messages stored while it was off)
+    conversation_page_size: int = 20  # conversations per page in the sidebar
+    chat_history_window: int = 40  # messages loaded when a chat is opened, and per page of older messages
+    chat_write_behind: bool = True  # queue message writes and store them in batches on a background thread
+    chat_write_batch_size: int = 64
+    chat_write_max_delay_ms: int = 50
+    chat_write_flush_timeout_s: float = 5.0  # longest a read waits for queued writes before reading without them
+    chat_search_results: int = 10  # messages returned by a conversation search
+
+    #Session cache configurations (Engine.chat_memories and ChatManager.active_chats)
+    session_cache_max_entries: int = 500
+    session_cache_idle_ttl: int = 3600  # seconds
+    session_cache_max_bytes: int = 64 * 1024 * 1024
 
     oauth_credentials_file: str = "oauth_credentials.json"
 
+    #Startup configurations
+    startup_mode: str = "background"  # "background" (serve the login page while models load) or "eager"
+    warmup_on_start: bool = True  # run one embedding, retrieval and short generation before reporting ready
+
 
     def __post_init__(self):
         """
@@ -54,6 +127,22 @@ class Config:
         self.load_oauth_credentials()
         print(self)  # This will call __repr__ and print the configuration
     
+    @property
+    def quant_config(self):
+        """
+        The bitsandbytes quantization settings for the model.
+
+        Built on access so that importing the configuration does not import torch and transformers.
+        """
+        import torch
+        from transformers import BitsAndBytesConfig
+        return BitsAndBytesConfig(
+            load_in_4bit=self.load_in_4bit,
+            bnb_4bit_use_double_quant=self.bnb_4bit_use_double_quant,
+            bnb_4bit_quant_type=self.bnb_4bit_quant_type,
+            bnb_4bit_compute_dtype=getattr(torch, self.bnb_4bit_compute_dtype),
+        )
+
     def __repr__(self) -> str:
         """
         Return a string representation of the configuration.
@@ -77,10 +166,16 @@ class Config:
 
        
         self.chroma_persist_directory = os.path.join(self.base_path, "chromadb")
+        self.rag_manifest_path = os.path.join(self.chroma_persist_directory, "rag_manifest.json")
+        self.bm25_index_path = os.path.join(self.chroma_persist_directory, "bm25_index.json")
+        self.query_aliases_path = os.path.join(self.chroma_persist_directory, "query_aliases.json")
+        self.embedding_cache_dir = os.path.join(self.base_path, "cache", "embeddings")
+        self.chat_store_path = os.path.join(self.base_path, "chat_history", "chat_history.db")
 
 
         # Ensure the directories exist
         os.makedirs(self.chroma_persist_directory, exist_ok=True)
+        os.makedirs(self.embedding_cache_dir, exist_ok=True)
             
 
         os.makedirs(self.rag_dataset_path, exist_ok=True)
@@ -193,10 +288,31 @@ Edvisor Configuration:
 Base Path: {self.base_path}
 Rag Dataset Path: {self.rag_dataset_path}
 Chroma DB Path: {self.chroma_persist_directory}
+RAG Manifest Path: {self.rag_manifest_path}
+Embedding Cache Path: {self.embedding_cache_dir} ({self.embedding_cache_size} entries)
 Base Model: {self.base_model}
 Embedding Model: {self.embedding_model}
 Max Context Length: {self.max_context_length}
-Chat History Limit: {self.chat_history_limit}
+Max New Tokens: {self.max_new_tokens}
+Generation Batching: up to {self.generation_max_batch_size} requests, {self.generation_max_wait_ms} ms wait
+Prefix KV Cache: {'Enabled' if self.prefix_cache_enabled else 'Disabled'}
+Inference Backend: {self.inference_backend}
+Draft Model: {self.draft_model or 'None'} ({self.num_assistant_tokens} assistant tokens)
+Context Token Budget: {self.context_token_budget}, memory: {self.memory_token_budget} (candidates: {self.retrieval_candidates}, similarity floor: {self.similarity_floor})
+Retrieval Mode: {self.retrieval_mode}
+Query Routing: {self.query_routing}
+Intent Routing: {self.intent_routing}
+Response Cache: threshold {self.response_cache_threshold}, TTL {self.response_cache_ttl}s, {self.response_cache_size} entries
+Ingestion Workers: {self.ingest_workers}
+Ingestion Batch Size: {self.ingest_batch_size} documents / {self.ingest_batch_tokens} tokens
+Chat History Limit: {self.chat_history_limit} turns / {self.memory_window_tokens} tokens
+Memory Summarizer: {self.memory_summarizer}
+Startup Mode: {self.startup_mode} (warm-up: {self.warmup_on_start})
+Chat History Window: {self.chat_history_window} messages
+Chat Store: {self.chat_store} ({self.chat_store_path}), embeddings: {self.chat_embeddings}
+Chat Write-Behind: {self.chat_write_behind} (batches of {self.chat_write_batch_size}, {self.chat_write_max_delay_ms} ms delay, {self.chat_write_flush_timeout_s} s flush timeout)
+Conversation Search: {self.chat_search_results} results
+Session Cache: {self.session_cache_max_entries} entries, {self.session_cache_idle_ttl}s idle TTL, {self.session_cache_max_bytes} bytes
 API Keys File: {self.api_keys_file}
 OAuth Credentials File: {self.oauth_credentials_file}
 
@@ -212,9 +328,9 @@ Auth URI present: {'Yes' if self.auth_uri else 'No'}
 Token URI present: {'Yes' if self.token_uri else 'No'}
 
 Quantization Config:
-Load in 4-bit: {self.quant_config.load_in_4bit}
-Use double quantization: {self.quant_config.bnb_4bit_use_double_quant}
-Quantization type: {self.quant_config.bnb_4bit_quant_type}
-Compute dtype: {self.quant_config.bnb_4bit_compute_dtype}
+Load in 4-bit: {self.load_in_4bit}
+Use double quantization: {self.bnb_4bit_use_double_quant}
+Quantization type: {self.bnb_4bit_quant_type}
+Compute dtype: {self.bnb_4bit_compute_dtype}
 """
     
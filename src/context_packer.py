@@ -0,0 +1,101 @@
+from typing import List, Tuple
+from langchain.docstore.document import Document
+
+
+class ContextPacker:
+    """
+    Token-budgeted assembly of the conversation memory and retrieved documents for the prompt.
+
+    Documents are taken in retrieval order (best first) and added while they fit in
+    the budget left after the fixed part of the prompt and the generation allowance.
+    Documents below the similarity floor are skipped; with hybrid retrieval the order
+    is the fused rank, not the similarity, so better documents can follow. If even the best
+    document does not fit, it is truncated to the remaining budget instead of letting
+    the prompt overflow the model context.
+
+    The conversation memory is fitted first (fit_memory), to at most
+    `memory_token_budget` tokens, so a long conversation cannot take the room of the
+    documents.
+    """
+
+    def __init__(self, tokenizer, max_context_length: int, max_new_tokens: int,
+                 context_token_budget: int, similarity_floor: float, separator: str = "\n",
+                 memory_token_budget: int = 1024):
+        self.tokenizer = tokenizer
+        self.max_context_length = max_context_length
+        self.max_new_tokens = max_new_tokens
+        self.context_token_budget = context_token_budget
+        self.memory_token_budget = memory_token_budget
+        self.similarity_floor = similarity_floor
+        self.separator = separator
+
+    def count_tokens(self, text: str) -> int:
+        if self.tokenizer is None:
+            # No tokenizer (e.g. a stub LLM): estimate about 4 characters per token
+            return len(text) // 4 + 1
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        if self.tokenizer is None:
+            return text[:max_tokens * 4]
+        token_ids = self.tokenizer.encode(text, add_special_tokens=False)[:max_tokens]
+        return self.tokenizer.decode(token_ids)
+
+    def truncate_start(self, text: str, max_tokens: int) -> str:
+        """Keep the last `max_tokens` tokens of `text`."""
+        if max_tokens <= 0:
+            return ""
+        if self.tokenizer is None:
+            return text[-max_tokens * 4:]
+        token_ids = self.tokenizer.encode(text, add_special_tokens=False)[-max_tokens:]
+        return self.tokenizer.decode(token_ids)
+
+    def fit_memory(self, memory: str, fixed_prompt: str) -> str:
+        """
+        Trim the conversation memory to its most recent part so that it fits in
+        `memory_token_budget` and in the context left by `fixed_prompt` (the prompt
+        rendered without memory and documents) and the generation allowance.
+        """
+        available = self.max_context_length - self.max_new_tokens - self.count_tokens(fixed_prompt)
+        limit = max(0, min(self.memory_token_budget, available))
+        tokens = self.count_tokens(memory)
+        if tokens <= limit:
+            return memory
+        print(f"Trimming the conversation memory from {tokens} to {limit} tokens to fit the context")
+        return self.truncate_start(memory, limit)
+
+    def budget(self, fixed_prompt: str) -> int:
+        available = self.max_context_length - self.max_new_tokens - self.count_tokens(fixed_prompt)
+        return max(0, min(self.context_token_budget, available))
+
+    def pack(self, docs: List[Document], fixed_prompt: str) -> Tuple[List[Document], str]:
+        """
+        Select documents for the prompt.
+
+        Args:
+            docs: Retrieved documents, best first, with a `similarity_score` in their metadata.
+            fixed_prompt: The prompt rendered without any documents.
+
+        Returns:
+            tuple: The selected documents and their joined text.
+        """
+        remaining = self.budget(fixed_prompt)
+        if docs and remaining == 0:
+            print(f"No token budget left for retrieved documents: the prompt without them takes "
+                  f"{self.count_tokens(fixed_prompt)} of {self.max_context_length - self.max_new_tokens} tokens")
+        separator_tokens = self.count_tokens(self.separator)
+        packed, texts = [], []
+        for doc in docs:
+            if doc.metadata.get("similarity_score", 1.0) < self.similarity_floor:
+                continue
+            cost = self.count_tokens(doc.page_content) + (separator_tokens if texts else 0)
+            if cost <= remaining:
+                packed.append(doc)
+                texts.append(doc.page_content)
+                remaining -= cost
+            elif not packed and remaining > 0:
+                print(f"Truncating document '{doc.metadata.get('context')}' to {remaining} tokens to fit the context budget")
+                packed.append(doc)
+                texts.append(self.truncate(doc.page_content, remaining))
+                remaining = 0
+        return packed, self.separator.join(texts)
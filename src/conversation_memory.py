@@ -0,0 +1,166 @@
+import re
+import threading
+from collections import Counter, deque
+from concurrent.futures import Executor
+from typing import Callable, Dict, List, Optional, Tuple
+from bm25 import STOPWORDS
+
+Turn = Tuple[str, str]  # (user message, assistant response)
+
+
+class ExtractiveSummarizer:
+    """
+    Summarizes a conversation by keeping its most informative sentences.
+
+    Sentences are scored by the average frequency of their content words across the
+    previous summary and the new turns, and the best ones are kept in their original
+    order until `max_chars` is reached. Needs no model at all.
+    """
+
+    def __init__(self, max_chars: int = 1200):
+        self.max_chars = max_chars
+
+    @staticmethod
+    def _sentences(text: str) -> List[str]:
+        return [sentence.strip() for sentence in re.split(r"(?<=[.!?])\s+|\n+", text) if sentence.strip()]
+
+    def summarize(self, previous_summary: str, turns: List[Turn]) -> str:
+        sentences = self._sentences(previous_summary)
+        for user_message, assistant_response in turns:
+            sentences.extend(f"User asked: {sentence}" for sentence in self._sentences(user_message))
+            sentences.extend(self._sentences(assistant_response))
+
+        def words(sentence: str) -> List[str]:
+            return [word for word in re.findall(r"[a-z0-9]+", sentence.lower()) if word not in STOPWORDS]
+
+        frequencies = Counter(word for sentence in sentences for word in words(sentence))
+        scores = [
+            sum(frequencies[word] for word in words(sentence)) / (len(words(sentence)) or 1)
+            for sentence in sentences
+        ]
+        selected, length = set(), 0
+        for i in sorted(range(len(sentences)), key=lambda i: scores[i], reverse=True):
+            if length + len(sentences[i]) + 1 > self.max_chars:
+                continue
+            selected.add(i)
+            length += len(sentences[i]) + 1
+        return " ".join(sentences[i] for i in sorted(selected))
+
+
+class LLMSummarizer:
+    """Summarizes a conversation with the local model through a `generate(prompt) -> str` callable."""
+
+    def __init__(self, generate: Callable[[str], str]):
+        self.generate = generate
+
+    def summarize(self, previous_summary: str, turns: List[Turn]) -> str:
+        conversation = "\n".join(f"User: {user}\nAssistant: {assistant}" for user, assistant in turns)
+        prompt = (
+            "<|begin_of_text|><|start_header_id|>system<|end_header_id|>"
+            "Progressively summarize the conversation between a student and Edvisor, an assistant for "
+            "Finland study and visa services. Extend the current summary with the new lines and return "
+            "only the new summary, in a few sentences.<|eot_id|><|start_header_id|>user<|end_header_id|>"
+            f"Current summary:\n{previous_summary or '(none)'}\n\nNew lines:\n{conversation}"
+            "<|eot_id|><|start_header_id|>assistant<|end_header_id|>"
+        )
+        return self.generate(prompt).strip()
+
+
+class ConversationMemory:
+    """
+    Memory of one conversation: the last turns verbatim plus a summary of everything
+    older. The window holds at most `window_turns` turns and at most `window_tokens`
+    tokens (counted with `count_tokens`), but always the latest turn, so a few long
+    answers cannot fill the prompt.
+
+    Turns that fall out of the window are summarized on a background executor, so
+    save_context() returns immediately and the user's response never waits for
+    summarization. Until a summary is ready, the buffer holds the previous summary
+    and the window.
+    """
+
+    def __init__(self, window_turns: int, summarizer, executor: Executor, window_tokens: int = 768,
+                 count_tokens: Optional[Callable[[str], int]] = None):
+        self.window_turns = window_turns
+        self.window_tokens = window_tokens
+        # Without a tokenizer, estimate about 4 characters per token
+        self.count_tokens = count_tokens or (lambda text: len(text) // 4 + 1)
+        self.summarizer = summarizer
+        self.executor = executor
+        self.lock = threading.Lock()
+        self.turns: "deque[Turn]" = deque()
+        # Token count of each turn in the window, and their total
+        self.turn_tokens: "deque[int]" = deque()
+        self.window_token_count = 0
+        self.unsummarized: List[Turn] = []
+        self.summary = ""
+        self.summarizing = False
+
+    def load(self, messages: List[Dict[str, str]]):
+        """Rebuild the memory from stored chat messages, oldest first."""
+        pending_user = None
+        for message in messages:
+            if message["role"] == "user":
+                pending_user = message["content"]
+            elif message["role"] == "assistant" and pending_user is not None:
+                self._append((pending_user, message["content"]))
+                pending_user = None
+        self._schedule()
+
+    def _append(self, turn: Turn):
+        tokens = self.count_tokens(f"User: {turn[0]}\nAssistant: {turn[1]}")
+        with self.lock:
+            self.turns.append(turn)
+            self.turn_tokens.append(tokens)
+            self.window_token_count += tokens
+            while len(self.turns) > 1 and (
+                    len(self.turns) > self.window_turns or self.window_token_count > self.window_tokens):
+                self.unsummarized.append(self.turns.popleft())
+                self.window_token_count -= self.turn_tokens.popleft()
+
+    def save_context(self, inputs: Dict[str, str], outputs: Dict[str, str]):
+        self._append((inputs["input"], outputs["output"]))
+        self._schedule()
+
+    def _schedule(self):
+        with self.lock:
+            if self.summarizing or not self.unsummarized:
+                return
+            self.summarizing = True
+        self.executor.submit(self._summarize)
+
+    def _summarize(self):
+        while True:
+            with self.lock:
+                turns, self.unsummarized = self.unsummarized, []
+                previous_summary = self.summary
+                if not turns:
+                    self.summarizing = False
+                    return
+            try:
+                summary = self.summarizer.summarize(previous_summary, turns)
+            except Exception as e:
+                print(f"Error summarizing conversation: {str(e)}")
+                with self.lock:
+                    # Keep the turns for the next attempt
+                    self.unsummarized = turns + self.unsummarized
+                    self.summarizing = False
+                return
+            with self.lock:
+                self.summary = summary
+
+    def size_bytes(self) -> int:
+        """Approximate memory held by the summary and the window."""
+        with self.lock:
+            turns = list(self.turns) + self.unsummarized
+            return len(self.summary) + sum(len(user) + len(assistant) + 64 for user, assistant in turns)
+
+    @property
+    def buffer(self) -> str:
+        with self.lock:
+            summary, turns = self.summary, list(self.turns)
+        parts = []
+        if summary:
+            parts.append(f"Summary of earlier conversation: {summary}")
+        parts.extend(f"User: {user}\nAssistant: {assistant}" for user, assistant in turns)
+        return "\n".join(parts)
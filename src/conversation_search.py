@@ -0,0 +1,107 @@
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Optional, Union
+
+DateLike = Union[str, datetime, None]
+
+
+def created_at_epoch(created_at: DateLike) -> Optional[float]:
+    """
+    A message time as seconds since the epoch. Chroma only compares numbers in range
+    filters, so messages carry their created_at in this form as "created_at_ts" too.
+    Times without a timezone are taken as UTC.
+    """
+    if created_at is None:
+        return None
+    if isinstance(created_at, str):
+        created_at = datetime.fromisoformat(created_at)
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return created_at.timestamp()
+
+
+class ConversationSearch:
+    """
+    Semantic search over a user's past conversations.
+
+    A search is one Chroma query on the user's chat-history collection, so it is served
+    by the HNSW index Chroma keeps current as messages are embedded; nothing is loaded
+    on the request path. The date range and chat filters are applied by Chroma as a
+    `where` filter on the "created_at_ts" and "chat_id" metadata. Messages embedded
+    before "created_at_ts" existed only match searches without a date range until
+    Utils.backfill_chat_embeddings() adds it. The target is 50 ms per search for users
+    with up to 50,000 messages; stats() reports the average and maximum search time to
+    check it.
+    """
+
+    def __init__(self, get_collection: Callable[[str], object], embed_query: Callable[[str], List[float]]):
+        """
+        Args:
+            get_collection: Returns the Chroma collection holding a user's message embeddings.
+            embed_query: Embeds a search query.
+        """
+        self.get_collection = get_collection
+        self.embed_query = embed_query
+        self.lock = threading.Lock()
+        self.counters = {"searches": 0, "search_ms": 0.0, "max_search_ms": 0.0}
+
+    @staticmethod
+    def _where(start: DateLike = None, end: DateLike = None, chat_ids: Optional[List[str]] = None) -> Optional[Dict]:
+        conditions = []
+        if start is not None:
+            conditions.append({"created_at_ts": {"$gte": created_at_epoch(start)}})
+        if end is not None:
+            conditions.append({"created_at_ts": {"$lte": created_at_epoch(end)}})
+        if chat_ids is not None:
+            conditions.append({"chat_id": {"$in": chat_ids}})
+        if not conditions:
+            return None
+        return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+    @staticmethod
+    def _similarity(distance: float, space: str) -> float:
+        # Collections use Chroma's default squared L2 distance unless created with another
+        # space; for the normalized sentence embeddings, cosine similarity is 1 - d / 2
+        if space == "cosine":
+            return 1 - distance
+        if space == "ip":
+            return -distance
+        return 1 - distance / 2
+
+    def search(self, user_email: str, query: str, k: int = 10, start: DateLike = None, end: DateLike = None,
+               chat_ids: Optional[Iterable[str]] = None) -> List[Dict]:
+        search_start = time.perf_counter()
+        chat_ids = list(chat_ids) if chat_ids is not None else None
+        if chat_ids == []:
+            return []
+        collection = self.get_collection(user_email)
+        results = collection.query(
+            query_embeddings=[self.embed_query(query)],
+            n_results=k,
+            where=self._where(start, end, chat_ids),
+            include=["documents", "metadatas", "distances"]
+        )
+        space = (collection.metadata or {}).get("hnsw:space", "l2")
+        matches = [
+            {
+                "chat_id": meta["chat_id"],
+                "role": meta["role"],
+                "content": doc,
+                "created_at": meta["created_at"],
+                "score": self._similarity(dist, space),
+            }
+            for doc, meta, dist in zip(results["documents"][0], results["metadatas"][0], results["distances"][0])
+        ]
+        elapsed = (time.perf_counter() - search_start) * 1000
+        with self.lock:
+            self.counters["searches"] += 1
+            self.counters["search_ms"] += elapsed
+            self.counters["max_search_ms"] = max(self.counters["max_search_ms"], elapsed)
+        return matches
+
+    def stats(self) -> Dict[str, float]:
+        with self.lock:
+            stats = dict(self.counters)
+        stats["avg_search_ms"] = stats["search_ms"] / stats["searches"] if stats["searches"] else 0.0
+        return stats
@@ -0,0 +1,243 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from typing import Dict, List, Optional
+import numpy as np
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+from chromadb.utils import embedding_functions
+
+
+class EmbeddingCache:
+    """
+    Persistent cache of text embeddings keyed by (embedding model name, normalized text hash).
+
+    Vectors are stored in a memory-mapped float32 array with `capacity` rows. A second
+    memory-mapped array holds the key of every row, and a JSON index file maps each key
+    to its row and last-use tick. When the cache is full the least recently used tenth
+    of the rows is evicted and reused.
+
+    Several processes may share the directory (the app and Utils.build_rag_database), each
+    with its own index and free rows, so one process can overwrite a row another still
+    lists. Writers therefore clear a row's key before replacing its vector, and readers
+    check the key both before and after copying the vector: a row replaced during the
+    read is a miss. This relies on the page cache showing the writes to the shared
+    mapping in program order, which holds on x86; a stale index otherwise only causes
+    misses.
+
+    The JSON index is rewritten every `flush_every` new entries on a background thread,
+    so the request path only takes a shallow copy of the index. Use EmbeddingCache.open()
+    to share one instance per directory and model in a process. Whoever creates the
+    cache calls flush() before exiting; in the app that is the resource registry.
+    """
+
+    _instances: Dict[tuple, "EmbeddingCache"] = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, directory: str, model_name: str, capacity: int, flush_every: int = 256):
+        self.model_name = model_name
+        self.capacity = capacity
+        self.flush_every = flush_every
+        self.directory = os.path.join(directory, re.sub(r'[^A-Za-z0-9_.-]', '_', model_name))
+        self.index_path = os.path.join(self.directory, "index.json")
+        self.vectors_path = os.path.join(self.directory, "vectors.f32")
+        self.keys_path = os.path.join(self.directory, "keys.bin")
+        os.makedirs(self.directory, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.dim: Optional[int] = None
+        self.vectors = None
+        self.keys = None
+        self.entries: Dict[str, List[int]] = {}  # key -> [row, last use tick]
+        self.free_rows: List[int] = []
+        self.tick = 0
+        self.dirty = 0
+        # Index snapshots are numbered so that an older one never replaces a newer one on disk
+        self.flush_lock = threading.Lock()
+        self.snapshot_seq = 0
+        self.written_seq = 0
+        self.flush_pending = False
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._load()
+
+    @classmethod
+    def open(cls, directory: str, model_name: str, capacity: int) -> "EmbeddingCache":
+        key = (os.path.abspath(directory), model_name)
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls(directory, model_name, capacity)
+            return cls._instances[key]
+
+    def _load(self):
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as file:
+                index = json.load(file)
+            if index.get("model") != self.model_name or index.get("capacity") != self.capacity:
+                print(f"Embedding cache at {self.directory} was created with other settings, starting empty.")
+                return
+            self._open_arrays(index["dim"], mode="r+")
+            self.entries = index.get("entries", {})
+            self.tick = index.get("tick", 0)
+            used_rows = {row for row, _ in self.entries.values()}
+            self.free_rows = [row for row in range(self.capacity - 1, -1, -1) if row not in used_rows]
+            print(f"Loaded embedding cache with {len(self.entries)} entries from {self.directory}")
+        except Exception as e:
+            print(f"Error loading embedding cache from {self.directory}: {str(e)}")
+            self.entries = {}
+            self.dim = None
+
+    def _open_arrays(self, dim: int, mode: str):
+        self.dim = dim
+        self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode=mode, shape=(self.capacity, dim))
+        self.keys = np.memmap(self.keys_path, dtype='S20', mode=mode, shape=(self.capacity,))
+        if mode == "w+":
+            self.free_rows = list(range(self.capacity - 1, -1, -1))
+
+    def key(self, text: str) -> str:
+        normalized = " ".join(text.split())
+        return hashlib.sha1(f"{self.model_name}\x00{normalized}".encode("utf-8")).hexdigest()
+
+    def get_many(self, texts: List[str]) -> List[Optional[List[float]]]:
+        results = []
+        with self.lock:
+            for text in texts:
+                key = self.key(text)
+                key_bytes = bytes.fromhex(key)
+                entry = self.entries.get(key)
+                vector = None
+                if entry is not None and self.keys[entry[0]] == key_bytes:
+                    vector = np.array(self.vectors[entry[0]])
+                    # Another process may have replaced the row while it was copied
+                    if self.keys[entry[0]] != key_bytes:
+                        vector = None
+                if vector is None:
+                    self.misses += 1
+                    results.append(None)
+                    continue
+                self.tick += 1
+                entry[1] = self.tick
+                self.hits += 1
+                results.append(vector.tolist())
+        return results
+
+    def put_many(self, texts: List[str], embeddings: Embeddings):
+        flush = False
+        with self.lock:
+            for text, embedding in zip(texts, embeddings):
+                vector = np.asarray(embedding, dtype=np.float32)
+                if self.vectors is None:
+                    self._open_arrays(vector.shape[0], mode="w+")
+                if vector.shape[0] != self.dim:
+                    continue
+                key = self.key(text)
+                if key in self.entries:
+                    continue
+                if not self.free_rows:
+                    self._evict()
+                row = self.free_rows.pop()
+                # Readers in other processes see either the old key or no key while the vector changes
+                self.keys[row] = b""
+                self.vectors[row] = vector
+                self.keys[row] = bytes.fromhex(key)
+                self.tick += 1
+                self.entries[key] = [row, self.tick]
+                self.dirty += 1
+            if self.dirty >= self.flush_every and not self.flush_pending:
+                self.flush_pending = True
+                flush = True
+        if flush:
+            threading.Thread(target=self._background_flush, name="embedding-cache-flush", daemon=True).start()
+
+    def _evict(self):
+        """Free the least recently used tenth of the rows."""
+        count = max(1, self.capacity // 10)
+        oldest = sorted(self.entries.items(), key=lambda item: item[1][1])[:count]
+        for key, (row, _) in oldest:
+            del self.entries[key]
+            self.free_rows.append(row)
+        self.evictions += len(oldest)
+        # Persist the index before the freed rows are overwritten (once per capacity / 10 new entries)
+        self._write_index(self._snapshot_locked())
+
+    def _snapshot_locked(self) -> Optional[tuple]:
+        """Numbered shallow copy of the index; taken under the lock, written without it."""
+        if self.vectors is None:
+            return None
+        self.snapshot_seq += 1
+        self.dirty = 0
+        return self.snapshot_seq, {
+            "model": self.model_name,
+            "capacity": self.capacity,
+            "dim": self.dim,
+            "tick": self.tick,
+            "entries": dict(self.entries),
+        }
+
+    def _write_index(self, snapshot: Optional[tuple]):
+        if snapshot is None:
+            return
+        seq, index = snapshot
+        with self.flush_lock:
+            if seq <= self.written_seq:
+                return
+            self.vectors.flush()
+            self.keys.flush()
+            tmp_path = self.index_path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as file:
+                json.dump(index, file)
+            os.replace(tmp_path, self.index_path)
+            self.written_seq = seq
+
+    def _background_flush(self):
+        with self.lock:
+            snapshot = self._snapshot_locked()
+            self.flush_pending = False
+        try:
+            self._write_index(snapshot)
+        except Exception as e:
+            print(f"Error writing embedding cache index to {self.directory}: {str(e)}")
+
+    def flush(self):
+        with self.lock:
+            snapshot = self._snapshot_locked()
+        self._write_index(snapshot)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self.entries),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class CachedEmbeddingFunction(EmbeddingFunction[Documents]):
+    """Chroma embedding function that serves embeddings from an EmbeddingCache and only embeds misses."""
+
+    def __init__(self, embedding_function: EmbeddingFunction, cache: EmbeddingCache):
+        self.embedding_function = embedding_function
+        self.cache = cache
+
+    def __call__(self, input: Documents) -> Embeddings:
+        embeddings = self.cache.get_many(list(input))
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            computed = self.embedding_function([input[i] for i in missing])
+            self.cache.put_many([input[i] for i in missing], computed)
+            for i, embedding in zip(missing, computed):
+                embeddings[i] = np.asarray(embedding, dtype=np.float32).tolist()
+        return embeddings
+
+
+def create_embedding_function(config) -> CachedEmbeddingFunction:
+    """Build the sentence-transformer embedding function for config.embedding_model behind the shared on-disk cache."""
+    return CachedEmbeddingFunction(
+        embedding_functions.SentenceTransformerEmbeddingFunction(model_name=config.embedding_model),
+        EmbeddingCache.open(config.embedding_cache_dir, config.embedding_model, config.embedding_cache_size)
+    )
@@ -1,48 +1,116 @@
-from langchain_huggingface import HuggingFacePipeline
 from langchain.prompts import PromptTemplate
-from langchain.memory import ConversationSummaryMemory
-from langchain_community.chat_message_histories import ChatMessageHistory
-from model import Model
 from chat_manager import ChatManager
 from rag import RAG
-from transformers import pipeline
-from typing import List, Dict
-from langchain.docstore.document import Document
-import chromadb
-from config import Config   
-import re
-from langchain_openai import OpenAI
+from typing import Dict, Iterator, List, Optional
+from resources import get_config, get_chroma_client
+import time
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+from session_cache import SessionCache
+from conversation_memory import ConversationMemory, ExtractiveSummarizer, LLMSummarizer
+from intent_router import IntentRouter, QUESTION
+from response_cache import SemanticResponseCache
+from context_packer import ContextPacker
+from backends import InferenceBackend, StubBackend, create_backend
 
 class Engine:
-    def __init__(self):
-        self.model = Model()
-        self.config = Config()
-       # Create a single Chroma client
-        self.chroma_client = chromadb.PersistentClient(path=self.config.chroma_persist_directory)
+    def __init__(self, backend: Optional[InferenceBackend] = None):
+        """
+        Args:
+            backend: Optional inference backend, e.g. a StubBackend in benchmarks. Defaults to
+                     the backend selected by Config.inference_backend.
+        """
+        self.config = get_config()
+        # The process-wide Chroma client, shared by ChatManager and RAG
+        self.chroma_client = get_chroma_client()
 
         # Initialize ChatManager and RAG with the same Chroma client
         self.chat_manager = ChatManager(self.chroma_client)
         self.rag = RAG(self.chroma_client)
+        # Open and validate the 'rag' collection once at startup
+        self.retriever = self.rag.get_retriever()
         
-        self._setup_llm()
-        self.chat_memories = {}
-    
-    def _setup_llm(self):
-        model, tokenizer = self.model.get_model_tokenizer()
-        self.tokenizer = tokenizer
-        hf_pipeline = pipeline(
-            "text-generation",
-            model=model,
-            tokenizer=tokenizer,
-            max_new_tokens=1024,
-            temperature=0.7,
-            top_p=0.9,
-            do_sample=True,
-            eos_token_id=tokenizer.eos_token_id
+        self._setup_llm(backend)
+        self.context_packer = ContextPacker(
+            self.tokenizer,
+            max_context_length=self.config.max_context_length,
+            max_new_tokens=self.config.max_new_tokens,
+            context_token_budget=self.config.context_token_budget,
+            similarity_floor=self.config.similarity_floor,
+            memory_token_budget=self.config.memory_token_budget
+        )
+        self.chat_memories = SessionCache(
+            "chat_memories",
+            max_entries=self.config.session_cache_max_entries,
+            idle_ttl=self.config.session_cache_idle_ttl,
+            max_bytes=self.config.session_cache_max_bytes,
+            sizeof=lambda memory: memory.size_bytes()
+        )
+        # Conversation summaries are updated here, off the request path
+        self.memory_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory-summarizer")
+        # Per-stage latencies of the last generate_response call, in milliseconds
+        self.last_timings: Dict[str, float] = {}
+        self.intent_router = None
+        if self.config.intent_routing:
+            self.intent_router = IntentRouter(
+                lambda texts: self.retriever.embed_queries([self.rag.preprocess_text(text) for text in texts]),
+                similarity_threshold=self.config.intent_similarity_threshold,
+                max_words=self.config.intent_max_words
+            )
+        self.response_cache = SemanticResponseCache(
+            threshold=self.config.response_cache_threshold,
+            ttl=self.config.response_cache_ttl,
+            max_entries=self.config.response_cache_size
         )
-        self.llm = HuggingFacePipeline(pipeline=hf_pipeline)
-        
     
+    def _setup_llm(self, backend: Optional[InferenceBackend] = None):
+        self.backend = backend or create_backend(self.config)
+        self.tokenizer = self.backend.tokenizer
+        self._register_prompt_prefixes()
+        print(f"Using the {self.backend.name} inference backend")
+
+    def warm_up(self):
+        """
+        Exercise every model once before the first user request: the embedding model,
+        the retrieval indexes, the intent classifier and a short generation.
+        """
+        stage_start = time.perf_counter()
+        query = "What are the requirements for a student residence permit in Finland?"
+        self.rag.query_vector_store(query, k=self.config.retrieval_candidates)
+        if self.intent_router is not None:
+            # classify() rather than route(): "hello" matches a pattern, which would skip the centroids
+            self.intent_router.classify("hello")
+        embedding_ms = (time.perf_counter() - stage_start) * 1000
+        stage_start = time.perf_counter()
+        self.backend.warm_up()
+        generation_ms = (time.perf_counter() - stage_start) * 1000
+        print(f"Warm-up done: retrieval {embedding_ms:.0f} ms, generation {generation_ms:.0f} ms")
+
+    def _register_prompt_prefixes(self):
+        """
+        Register the fixed leading part of each prompt (everything before the first
+        per-request variable) with the backend's prefix cache. Unchanged prefixes are not recomputed.
+        """
+        marker = "\x00"
+        rag_prefix = self._rag_prompt().format(
+            system_prompt=self._system_prompt(),
+            previous_conversation_summary=marker,
+            retrieved_docs=marker,
+            user_query=marker
+        ).split(marker)[0]
+        self.backend.register_prefix("rag", rag_prefix)
+
+    def _rag_prompt(self) -> PromptTemplate:
+        return PromptTemplate.from_template (
+            """<|begin_of_text|><|start_header_id|>system<|end_header_id|>{system_prompt}
+                Use the following previous conversation summary to maintain context in your responses 
+                (if available): {previous_conversation_summary}
+                Use the following retrieved information to provide accurate and up-to-date responses 
+                (if available): {retrieved_docs}<|eot_id|>
+                <|start_header_id|>user<|end_header_id|>
+                {user_query}<|eot_id|><|start_header_id|>assistant<|end_header_id|>
+            """ )
+
     def _system_prompt(self):
         return """
             You are an AI assistant named Edvisor, a chatbot specializing in Finland Study and Visa Services. 
@@ -50,127 +118,193 @@ class Engine:
             For off-topic queries, politely inform the user that you specialize in Finland study and visa services, but still attempt to provide a helpful response.
             """
         
-    def _is_greeting(self, message: str) -> bool:
-  
-        greeting_patterns = [
-            r'\b(hello|hi|hey|greetings)\b',         # Simple greetings
-            r'\b(good\s(morning|afternoon|evening))\b',  # Time-specific greetings
-            r'\bhow\s(are\syou|is\sit\sgoing)\b',    # Common follow-up questions
-            r'\bwhat\'s\sup\b',
-            r'\bnice\sto\smeet\syou\b'
-        ]
-    
-        message_lower = message.lower()
-        return any(re.search(pattern, message_lower) for pattern in greeting_patterns)
-    
-    def _greeting_chain(self):
-        greeting_prompt = PromptTemplate.from_template(
+    def _prepare_turn(self, chat_id: str, user_email: str, user_message: str) -> Dict:
         """
-        <|begin_of_text|><|start_header_id|>system<|end_header_id|>
-        You are an AI assistant named Edvisor, a chatbot specializing in Finland Study and Visa Services. 
-        Provide accurate, helpful, and up-to-date information on studying in Finland, the Finnish education system, student visas, and living in Finland as a student.. The user has just greeted you. 
-        Respond with a friendly and polite greeting message, offering your assistance in a helpful manner.
-        <|eot_id|><|start_header_id|>user<|end_header_id|>
-        {user_query}<|eot_id|><|start_header_id|>assistant<|end_header_id|>
+        Run everything that precedes generation for one user message: memory lookup,
+        retrieval, context packing and the semantic cache lookup.
+
+        Returns:
+            dict: The turn state, including the rendered `prompt` and, on a cache hit
+                  or for small talk, the `cached_response`.
         """
-    )
-        chain = greeting_prompt | self.llm
-        return chain
-    
-    def _handle_greeting(self, user_message: str)-> str:
-        chain = self._greeting_chain()
-        response = chain.invoke({
+        print(f"User message: {user_message}")
+        self._register_prompt_prefixes()
+        turn = {
+            "chat_id": chat_id,
+            "user_email": user_email,
+            "user_message": user_message,
+            "start": time.perf_counter(),
+            "timings": {},
+            "query_embedding": None,
+            "doc_ids": [],
+            "cached_response": None,
+        }
+        timings = self.last_timings = turn["timings"]
+
+        memory = turn["memory"] = self._get_or_create_memory(chat_id,user_email)
+
+        # Small talk is answered from a template, with no retrieval or generation
+        stage_start = time.perf_counter()
+        intent = self.intent_router.route(user_message) if self.intent_router is not None else QUESTION
+        timings["routing_ms"] = (time.perf_counter() - stage_start) * 1000
+        turn["intent"] = intent
+        if intent != QUESTION:
+            print(f"Answered {intent} message from a template")
+            turn["prompt"] = None
+            turn["cached_response"] = self.intent_router.respond(intent)
+            return turn
+
+        # Load chat history and update memory
+        prev_conversation_summary = memory.buffer
+
+        stage_start = time.perf_counter()
+        candidate_docs = self.rag.query_vector_store(user_message, k=self.config.retrieval_candidates)
+        timings["retrieval_ms"] = (time.perf_counter() - stage_start) * 1000
+
+        prompt = self._rag_prompt()
+        prompt_inputs = {
+            "system_prompt": self._system_prompt(),
+            "previous_conversation_summary": "",
+            "retrieved_docs": "",
             "user_query": user_message
-        })
-        assistant_response = self._extract_assistant_response(response)
-        return assistant_response
-       
-        
-    
+        }
+        # Fit the most recent memory into its token budget, then as many of the best documents as the rest allows
+        stage_start = time.perf_counter()
+        prompt_inputs["previous_conversation_summary"] = self.context_packer.fit_memory(
+            prev_conversation_summary, prompt.format(**prompt_inputs))
+        retrieved_docs, retrieved_docs_content = self.context_packer.pack(
+            candidate_docs, prompt.format(**prompt_inputs))
+        prompt_inputs["retrieved_docs"] = retrieved_docs_content
+        turn["prompt"] = prompt.format(**prompt_inputs)
+        timings["packing_ms"] = (time.perf_counter() - stage_start) * 1000
+
+        print(f"Previous conversation summary: {prompt_inputs['previous_conversation_summary']}")
+        print(f"Retrieved documents: {len(retrieved_docs)} of {len(candidate_docs)} candidates packed")
+
+        # Answer repeated questions over the same documents from the semantic cache. Only
+        # turns without conversation context are cached: an answer generated with a chat's
+        # history in the prompt depends on (and may quote) that history, so it must not be
+        # served to another conversation or user. query_embedding stays None to skip the store.
+        # Small-talk turns are kept out of the memory, so a chat opening with "hi" still qualifies.
+        if prev_conversation_summary:
+            return turn
+        turn["query_embedding"] = self.retriever.embed_query(self.rag.preprocess_text(user_message))
+        turn["doc_ids"] = [doc.metadata.get("doc_id", "") for doc in retrieved_docs]
+        turn["cached_response"] = self.response_cache.lookup(
+            turn["query_embedding"], turn["doc_ids"], self.retriever.build_id)
+        if turn["cached_response"] is not None:
+            print("Answered from the semantic response cache")
+        return turn
 
     def generate_response(self, chat_id: str, user_email: str, user_message: str):
-            
-            print(f"User message: {user_message}")
-
-            memory = self._get_or_create_memory(chat_id,user_email)
-            
-            # Check if the message is a greeting
-            if self._is_greeting(user_message):
-                assistant_response = self._handle_greeting(user_message)
-                self._save_message(chat_id, user_email, user_message, assistant_response)
-                # Update the memory with the new interaction
-                memory.save_context({"input": user_message}, {"output": assistant_response})
-                print(f"assistant response: {assistant_response}")
-                return assistant_response
-            
-            # Load chat history and update memory
-            prev_conversation_summary = memory.buffer
-
-            retrieved_docs = self.rag.query_vector_store(user_message, k=1)
-            retrieved_docs_content = self._prepare_retrieved_docs(retrieved_docs)
-
-            print(f"Previous conversation summary: {prev_conversation_summary}")
-            print(f"Retrieved documents: {retrieved_docs_content}")
-
-            
-            prompt = PromptTemplate.from_template (
-                """<|begin_of_text|><|start_header_id|>system<|end_header_id|>{system_prompt}
-                    Use the following previous conversation summary to maintain context in your responses 
-                    (if available): {previous_conversation_summary}
-                    Use the following retrieved information to provide accurate and up-to-date responses 
-                    (if available): {retrieved_docs}<|eot_id|>
-                    <|start_header_id|>user<|end_header_id|>
-                    {user_query}<|eot_id|><|start_header_id|>assistant<|end_header_id|>
-                """ )
-            
-            chain = prompt | self.llm
-            # Log the complete prompt for debugging
-            print(f"Prompt sent to model: {prompt}")
-
-            full_response = chain.invoke({
-                "system_prompt": self._system_prompt(),
-                "previous_conversation_summary": prev_conversation_summary,
-                "retrieved_docs": retrieved_docs_content,
-                "user_query": user_message
-            })
-            print(f"full response: {full_response}")
-
-            # Extract only the assistant's response
-            assistant_response = self._extract_assistant_response(full_response)
-
-            # Save the new message to chat manager
-            self._save_message(chat_id, user_email, user_message, assistant_response)
-            memory.save_context({"input": user_message}, {"output": assistant_response})
-
-            print(f"assistant response: {assistant_response}")
-
-            return assistant_response
+        turn = self._prepare_turn(chat_id, user_email, user_message)
+
+        stage_start = time.perf_counter()
+        assistant_response = turn["cached_response"]
+        if assistant_response is None:
+            assistant_response = "".join(self._stream_generate(turn["prompt"])).strip()
+        turn["timings"]["generation_ms"] = (time.perf_counter() - stage_start) * 1000
+
+        self._finish_turn(turn, assistant_response)
+        return assistant_response
+
+    def stream_response(self, chat_id: str, user_email: str, user_message: str) -> Iterator[str]:
+        """
+        Generate a response as a stream of text deltas.
+
+        The turn is saved to the chat history and the conversation memory when the
+        stream ends. If the consumer stops early (Streamlit closes the generator when
+        the user clicks anything), generation is stopped and the text streamed so far
+        is saved instead. If generation fails, the error propagates and nothing is saved.
+        """
+        turn = self._prepare_turn(chat_id, user_email, user_message)
+        timings = turn["timings"]
+
+        stage_start = time.perf_counter()
+        deltas = []
+        try:
+            if turn["cached_response"] is not None:
+                deltas.append(turn["cached_response"])
+                yield turn["cached_response"]
+            else:
+                with closing(self._stream_generate(turn["prompt"])) as stream:
+                    for delta in stream:
+                        if not deltas:
+                            timings["first_token_ms"] = (time.perf_counter() - turn["start"]) * 1000
+                        deltas.append(delta)
+                        yield delta
+        except GeneratorExit:
+            timings["generation_ms"] = (time.perf_counter() - stage_start) * 1000
+            # A partial answer must not be served to others from the response cache
+            turn["query_embedding"] = None
+            print("Response stream interrupted, saving the partial response")
+            try:
+                self._finish_turn(turn, "".join(deltas).strip())
+            except Exception as e:
+                print(f"Error saving the interrupted turn: {str(e)}")
+            raise
+        # A failed generation raises above and is not saved
+        timings["generation_ms"] = (time.perf_counter() - stage_start) * 1000
+        self._finish_turn(turn, "".join(deltas).strip())
+
+    def _stream_generate(self, prompt: str) -> Iterator[str]:
+        yield from self.backend.stream(prompt)
+
+    def _finish_turn(self, turn: Dict, assistant_response: str):
+        timings = turn["timings"]
+        if turn["query_embedding"] is not None and turn["cached_response"] is None:
+            self.response_cache.store(
+                turn["query_embedding"], turn["doc_ids"], assistant_response, self.retriever.build_id)
+
+        # Save the new message to chat manager
+        stage_start = time.perf_counter()
+        self._save_message(turn["chat_id"], turn["user_email"], turn["user_message"], assistant_response)
+        timings["persist_ms"] = (time.perf_counter() - stage_start) * 1000
+
+        # Update the memory with the new interaction. Small talk adds no context to later answers.
+        stage_start = time.perf_counter()
+        if turn["intent"] == QUESTION:
+            turn["memory"].save_context({"input": turn["user_message"]}, {"output": assistant_response})
+            self.chat_memories.resize(turn["chat_id"])
+        timings["memory_ms"] = (time.perf_counter() - stage_start) * 1000
+        timings["total_ms"] = (time.perf_counter() - turn["start"]) * 1000
+
+        print(f"assistant response: {assistant_response}")
 
     
-    def _get_or_create_memory(self,chat_id:str,user_email:str)->ConversationSummaryMemory:
-        if chat_id not in self.chat_memories:
-           chat_history = self.chat_manager.get_chat_history(chat_id, user_email)
-           history = ChatMessageHistory()
-           if chat_history:
-               for message in chat_history:
-                   if message["role"] == "user":
-                       history.add_user_message(message["content"])
-                   elif message["role"] == "assistant":
-                        history.add_assistant_message(message["content"])
-           self .chat_memories[chat_id] = ConversationSummaryMemory.from_messages(
-                llm=OpenAI(temperature=0),
-                chat_memory = history,
-                return_messages = True
+    def _get_or_create_memory(self,chat_id:str,user_email:str)->ConversationMemory:
+        def load_memory() -> ConversationMemory:
+            # Rehydrate from the latest messages of the chat (new chats and evicted memories)
+            chat_history = self.chat_manager.get_chat_history(chat_id, user_email)
+            memory = ConversationMemory(
+                window_turns=self.config.chat_history_limit,
+                summarizer=self._create_summarizer(),
+                executor=self.memory_executor,
+                window_tokens=self.config.memory_window_tokens,
+                count_tokens=self.backend.count_tokens
             )
-        return self.chat_memories[chat_id]
+            if chat_history:
+                memory.load(self._without_small_talk(chat_history))
+            return memory
 
-    def _prepare_retrieved_docs(self, docs: List[Document]) -> str:
-        return "\n".join([doc.page_content for doc in docs])
+        return self.chat_memories.get_or_load(chat_id, load_memory)
 
-    def _extract_assistant_response(self, full_response: str) -> str:
-        """Extracts the assistant's response from the full LLM output."""
-        return full_response.split("<|start_header_id|>assistant<|end_header_id|>")[-1].split("<|eot_id|>")[0].strip()
+    @staticmethod
+    def _without_small_talk(messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """Drop the small-talk turns of a chat history: template answers and the messages they answer."""
+        kept = []
+        for message in messages:
+            if message["role"] == "assistant" and IntentRouter.is_template(message["content"]):
+                if kept and kept[-1]["role"] == "user":
+                    kept.pop()
+                continue
+            kept.append(message)
+        return kept
 
+    def _create_summarizer(self):
+        if self.config.memory_summarizer == "llm" and not isinstance(self.backend, StubBackend):
+            return LLMSummarizer(self.backend.generate)
+        return ExtractiveSummarizer(max_chars=self.config.memory_summary_max_chars)
 
     def _save_message(self, chat_id: str, user_email: str, user_message: str, response: str):
         self.chat_manager.add_message(chat_id, "user", user_message, user_email)
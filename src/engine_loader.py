@@ -0,0 +1,69 @@
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+
+def _create_engine():
+    # Imported on the loader thread, so importing this module stays cheap
+    from engine import Engine
+    return Engine()
+
+
+class EngineLoader:
+    """
+    Builds the Engine on a background thread so the UI can be served while models load.
+
+    The loader moves through the states "starting", "loading", "warming_up" and then
+    "ready" or "failed". status() reports the state, the time spent so far and, on
+    failure, the error, which the UI shows instead of blocking the first page load.
+    """
+
+    def __init__(self, factory: Callable[[], Any] = _create_engine, warm_up: bool = True):
+        self.factory = factory
+        self.warm_up = warm_up
+        self.state = "starting"
+        self.error: Optional[str] = None
+        self.engine = None
+        self.started_at = time.perf_counter()
+        self.ready_at: Optional[float] = None
+        self.ready_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="engine-loader", daemon=True)
+
+    def start(self) -> "EngineLoader":
+        self.thread.start()
+        return self
+
+    def _run(self):
+        try:
+            self.state = "loading"
+            engine = self.factory()
+            if self.warm_up:
+                self.state = "warming_up"
+                engine.warm_up()
+            self.engine = engine
+            self.state = "ready"
+            self.ready_at = time.perf_counter()
+            print(f"Engine ready in {(self.ready_at - self.started_at):.1f} s")
+        except Exception as e:
+            print(f"Error loading the engine: {str(e)}")
+            self.error = str(e)
+            self.state = "failed"
+        finally:
+            self.ready_event.set()
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def wait(self, timeout: Optional[float] = None):
+        """Block until the engine is ready or failed, or `timeout` seconds pass. Returns the engine when ready."""
+        self.ready_event.wait(timeout)
+        return self.engine
+
+    def status(self) -> Dict[str, Any]:
+        end = self.ready_at or time.perf_counter()
+        return {
+            "state": self.state,
+            "elapsed_s": round(end - self.started_at, 1),
+            "error": self.error,
+        }
@@ -0,0 +1,300 @@
+import queue
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterator, List, Optional
+import torch
+from transformers.generation.stopping_criteria import StoppingCriteria, StoppingCriteriaList
+from transformers.generation.streamers import BaseStreamer
+from prefix_cache import PrefixCache
+
+
+class GenerationRequest:
+    """
+    One prompt waiting for, or going through, generation. Text deltas arrive on `deltas`;
+    None ends the stream. `cancelled` is set when the caller stops reading.
+    """
+
+    def __init__(self, prompt: str, input_ids: List[int]):
+        self.prompt = prompt
+        self.input_ids = input_ids
+        self.deltas: "queue.Queue[Optional[str]]" = queue.Queue()
+        self.enqueued_at = time.perf_counter()
+        self.error: Optional[BaseException] = None
+        self.cancelled = False
+
+
+class BatchStreamer(BaseStreamer):
+    """
+    Streamer for a batched `generate` call that routes each row's new tokens to its request.
+
+    transformers' TextStreamer only supports a batch size of one, so this keeps one token
+    buffer per row, decodes it incrementally and stops a row at its first end-of-sequence
+    token (later positions of that row are padding).
+    """
+
+    def __init__(self, tokenizer, requests: List[GenerationRequest], eos_token_ids: List[int]):
+        self.tokenizer = tokenizer
+        self.requests = requests
+        self.eos_token_ids = set(eos_token_ids)
+        self.tokens: List[List[int]] = [[] for _ in requests]
+        self.emitted: List[int] = [0 for _ in requests]
+        self.finished: List[bool] = [False for _ in requests]
+        self.prompt_seen = False
+
+    def put(self, value):
+        if not self.prompt_seen:
+            # The first call carries the prompt ids
+            self.prompt_seen = True
+            return
+        rows = value.reshape(len(self.requests), -1).tolist()
+        for i, new_tokens in enumerate(rows):
+            if self.finished[i] or self.requests[i].cancelled:
+                continue
+            for token in new_tokens:
+                if token in self.eos_token_ids:
+                    self.finished[i] = True
+                    break
+                self.tokens[i].append(token)
+            text = self.tokenizer.decode(self.tokens[i], skip_special_tokens=True)
+            # Hold back incomplete multi-byte characters until the next token completes them
+            if len(text) > self.emitted[i] and not text.endswith("\ufffd"):
+                self.requests[i].deltas.put(text[self.emitted[i]:])
+                self.emitted[i] = len(text)
+
+    def end(self):
+        for i, request in enumerate(self.requests):
+            text = self.tokenizer.decode(self.tokens[i], skip_special_tokens=True)
+            if len(text) > self.emitted[i]:
+                request.deltas.put(text[self.emitted[i]:])
+            request.deltas.put(None)
+
+
+class CancelledStoppingCriteria(StoppingCriteria):
+    """Stops the rows of a batch whose request was cancelled; `generate` returns once every row has stopped."""
+
+    def __init__(self, requests: List[GenerationRequest]):
+        self.requests = requests
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        return torch.tensor([request.cancelled for request in self.requests], device=input_ids.device)
+
+
+class GenerationScheduler:
+    """
+    Dynamic batching of generation requests from concurrent chat sessions.
+
+    Requests are queued and a single worker thread groups them into batches of up to
+    `max_batch_size`, waiting at most `max_wait_ms` after the oldest request for more
+    to arrive. Only requests whose prompt length is within `length_bucket` tokens of the
+    oldest request join its batch, which keeps left-padding waste low; the others wait
+    for the next batch. Each batch runs as one `generate` call and every caller receives
+    its own stream of text deltas.
+
+    With a PrefixCache, a request that runs alone starts from the precomputed key/values
+    of its prompt prefix. Batched requests are left-padded to different offsets, so they
+    are prefilled in full.
+
+    With an `assistant_model`, generation is speculative: the draft model proposes
+    tokens and the main model verifies them in one forward pass. transformers only
+    supports this for a batch size of one, so batching and the prefix cache are
+    disabled. Forward passes of both models are counted to report the acceptance rate.
+
+    A request is cancelled when its caller closes the stream: a queued request is
+    dropped, and a running one stops generating at its next token.
+    """
+
+    def __init__(self, model, tokenizer, generation_kwargs: Dict, max_batch_size: int = 4,
+                 max_wait_ms: float = 20, length_bucket: int = 256, prefix_cache: Optional[PrefixCache] = None,
+                 assistant_model=None, assistant_tokenizer=None):
+        self.model = model
+        self.prefix_cache = prefix_cache
+        self.tokenizer = tokenizer
+        self.generation_kwargs = dict(generation_kwargs)
+        self.max_batch_size = max_batch_size
+        self.assistant_model = assistant_model
+        if assistant_model is not None:
+            self.generation_kwargs["assistant_model"] = assistant_model
+            if assistant_tokenizer is not None and assistant_tokenizer.get_vocab() != tokenizer.get_vocab():
+                # Different vocabularies need universal assisted decoding, which re-tokenizes the proposals
+                self.generation_kwargs["tokenizer"] = tokenizer
+                self.generation_kwargs["assistant_tokenizer"] = assistant_tokenizer
+            self.max_batch_size = 1
+            self.prefix_cache = None
+        self.max_wait = max_wait_ms / 1000
+        self.length_bucket = length_bucket
+
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token_id is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        eos_token_id = generation_kwargs.get("eos_token_id", tokenizer.eos_token_id)
+        self.eos_token_ids = eos_token_id if isinstance(eos_token_id, list) else [eos_token_id]
+
+        self.pending: "deque[GenerationRequest]" = deque()
+        self.condition = threading.Condition()
+        self.counters = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "batches": 0,
+            "max_queue_depth": 0,
+            "queue_wait_ms": 0.0,
+            "generation_ms": 0.0,
+            "prompt_tokens": 0,
+            "padded_tokens": 0,
+            "generated_tokens": 0,
+            "cancelled": 0,
+            "target_forwards": 0,
+            "draft_forwards": 0,
+        }
+        self.worker = threading.Thread(target=self._run, name="generation-scheduler", daemon=True)
+        if assistant_model is not None:
+            model.register_forward_hook(self._count_forward("target_forwards"))
+            assistant_model.register_forward_hook(self._count_forward("draft_forwards"))
+        self.worker.start()
+
+    def _count_forward(self, counter: str):
+        def hook(module, inputs, outputs):
+            # Only count generation, not e.g. prefix registration on other threads
+            if threading.current_thread() is self.worker:
+                self.counters[counter] += 1
+        return hook
+
+    def submit(self, prompt: str) -> GenerationRequest:
+        # The prompts already start with <|begin_of_text|>
+        input_ids = self.tokenizer(prompt, add_special_tokens=False)["input_ids"]
+        request = GenerationRequest(prompt, input_ids)
+        with self.condition:
+            self.pending.append(request)
+            self.counters["submitted"] += 1
+            self.counters["max_queue_depth"] = max(self.counters["max_queue_depth"], len(self.pending))
+            self.condition.notify()
+        return request
+
+    def stream(self, prompt: str, poll_interval: float = 1.0) -> Iterator[str]:
+        request = self.submit(prompt)
+        try:
+            while True:
+                try:
+                    delta = request.deltas.get(timeout=poll_interval)
+                except queue.Empty:
+                    # Never wait forever on a worker that has died
+                    if not self.worker.is_alive():
+                        raise RuntimeError("The generation scheduler worker has stopped")
+                    continue
+                if delta is None:
+                    break
+                yield delta
+            if request.error is not None:
+                raise request.error
+        finally:
+            # Closing the stream early (the consumer went away) stops the generation for nobody
+            request.cancelled = True
+
+    def generate(self, prompt: str) -> str:
+        return "".join(self.stream(prompt))
+
+    def _take_batch(self) -> List[GenerationRequest]:
+        with self.condition:
+            while True:
+                self._drop_cancelled()
+                if self.pending:
+                    break
+                self.condition.wait()
+            first = self.pending[0]
+            deadline = first.enqueued_at + self.max_wait
+            while True:
+                compatible = [
+                    request for request in self.pending
+                    if abs(len(request.input_ids) - len(first.input_ids)) <= self.length_bucket
+                ][:self.max_batch_size]
+                remaining = deadline - time.perf_counter()
+                if len(compatible) >= self.max_batch_size or remaining <= 0:
+                    break
+                self.condition.wait(timeout=remaining)
+                self._drop_cancelled()
+                if first.cancelled:
+                    # Batch around the oldest request that is still wanted
+                    compatible = []
+                    break
+            for request in compatible:
+                self.pending.remove(request)
+            return compatible
+
+    def _drop_cancelled(self):
+        """Remove the queued requests nobody is waiting for. Callers hold self.condition."""
+        cancelled = [request for request in self.pending if request.cancelled]
+        for request in cancelled:
+            self.pending.remove(request)
+        self.counters["cancelled"] += len(cancelled)
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch:
+                self._generate_batch(batch)
+
+    def _generate_batch(self, batch: List[GenerationRequest]):
+        start = time.perf_counter()
+        longest = max(len(request.input_ids) for request in batch)
+        with self.condition:
+            self.counters["batches"] += 1
+            self.counters["queue_wait_ms"] += sum((start - request.enqueued_at) * 1000 for request in batch)
+            self.counters["prompt_tokens"] += sum(len(request.input_ids) for request in batch)
+            self.counters["padded_tokens"] += longest * len(batch)
+
+        streamer = BatchStreamer(self.tokenizer, batch, self.eos_token_ids)
+        try:
+            inputs = self.tokenizer.pad(
+                {"input_ids": [request.input_ids for request in batch]},
+                padding=True,
+                return_tensors="pt"
+            ).to(self.model.device)
+            if len(batch) == 1 and self.prefix_cache is not None:
+                cached = self.prefix_cache.lookup(batch[0].input_ids)
+                if cached is not None:
+                    inputs["past_key_values"] = cached[1]
+            with torch.no_grad():
+                self.model.generate(
+                    **inputs,
+                    streamer=streamer,
+                    stopping_criteria=StoppingCriteriaList([CancelledStoppingCriteria(batch)]),
+                    pad_token_id=self.tokenizer.pad_token_id,
+                    **self.generation_kwargs
+                )
+            failed = False
+        except Exception as e:
+            print(f"Error generating batch of {len(batch)} requests: {str(e)}")
+            for request in batch:
+                request.error = e
+            streamer.end()
+            failed = True
+
+        with self.condition:
+            self.counters["generation_ms"] += (time.perf_counter() - start) * 1000
+            self.counters["failed" if failed else "completed"] += len(batch)
+            self.counters["generated_tokens"] += sum(
+                len(tokens) + finished for tokens, finished in zip(streamer.tokens, streamer.finished))
+
+    def metrics(self) -> Dict[str, float]:
+        with self.condition:
+            metrics = dict(self.counters)
+            metrics["queue_depth"] = len(self.pending)
+        served = metrics["completed"] + metrics["failed"]
+        metrics["avg_batch_size"] = served / metrics["batches"] if metrics["batches"] else 0.0
+        metrics["avg_queue_wait_ms"] = metrics["queue_wait_ms"] / served if served else 0.0
+        metrics["padding_ratio"] = (
+            1 - metrics["prompt_tokens"] / metrics["padded_tokens"] if metrics["padded_tokens"] else 0.0
+        )
+        metrics["ms_per_token"] = (
+            metrics["generation_ms"] / metrics["generated_tokens"] if metrics["generated_tokens"] else 0.0
+        )
+        if self.assistant_model is not None:
+            # Every verification pass of the main model yields its accepted draft tokens plus one
+            # token of its own, and the draft model runs one forward pass per proposed token
+            accepted = max(0, metrics["generated_tokens"] - metrics["target_forwards"])
+            metrics["acceptance_rate"] = accepted / metrics["draft_forwards"] if metrics["draft_forwards"] else 0.0
+            metrics["tokens_per_target_forward"] = (
+                metrics["generated_tokens"] / metrics["target_forwards"] if metrics["target_forwards"] else 0.0
+            )
+        return metrics
@@ -0,0 +1,127 @@
+import re
+import threading
+from typing import Callable, List, Optional
+import numpy as np
+
+QUESTION = "question"
+
+
+class IntentRouter:
+    """
+    Decides whether a message needs the RAG pipeline or is plain small talk.
+
+    Small talk (greetings, thanks, goodbyes) is answered from a template without
+    retrieval or an LLM call. A message is small talk when the precompiled phrase
+    patterns cover all of it. Whatever is left after removing those phrases, if it is
+    short, goes to a nearest-centroid classifier over embeddings of a small labeled set,
+    which catches variants the patterns miss ("heyyy", "cheers mate"). Anything else,
+    including a greeting followed by a real question, is a question.
+    """
+
+    PATTERNS = {
+        "greeting": r"(?:hello|hi|hiya|hey|heya|greetings|howdy|good\s(?:morning|afternoon|evening|day))(?:\s(?:there|edvisor|everyone|all))?",
+        "wellbeing": r"how\s(?:are\syou(?:\sdoing)?|is\sit\sgoing|do\syou\sdo)|what'?s\sup|nice\sto\smeet\syou",
+        "thanks": r"(?:many\s)?thanks?(?:\syou)?(?:\s(?:so|very)\smuch)?(?:\sa\slot)?|thx|ty|much\sappreciated",
+        "goodbye": r"(?:good)?bye(?:\sbye)?|see\syou(?:\slater|\ssoon)?|have\sa\snice\sday|good\snight",
+    }
+
+    EXAMPLES = {
+        "greeting": ["hello", "hi there", "hey", "heyyy", "good morning", "yo", "greetings edvisor", "hey buddy"],
+        "wellbeing": ["how are you", "how's it going", "what's up", "how are you doing today", "nice to meet you"],
+        "thanks": ["thank you", "thanks a lot", "cheers mate", "great, thanks", "that was helpful, thank you"],
+        "goodbye": ["bye", "goodbye", "see you later", "have a nice day", "take care"],
+        QUESTION: [
+            "what are the tuition fees",
+            "how do i apply for a student residence permit",
+            "which universities offer a master in computer science",
+            "can i work while studying in finland",
+            "what documents do i need for the visa",
+            "when is the application deadline",
+            "tell me about scholarships",
+            "is ielts required",
+        ],
+    }
+
+    RESPONSES = {
+        "greeting": "Hello! I'm Edvisor, your assistant for studying in Finland. I can help with universities, "
+                    "degree programmes, admissions, student visas and student life in Finland. What would you like to know?",
+        "wellbeing": "I'm doing great, thanks for asking! I'm here to help with anything about studying in Finland, "
+                     "from choosing a programme to applying for your student residence permit. How can I help you today?",
+        "thanks": "You're welcome! If you have any other questions about studying or living in Finland, just ask.",
+        "goodbye": "Goodbye, and good luck with your studies in Finland! Come back any time you have more questions.",
+    }
+
+    def __init__(self, embed: Callable[[List[str]], List[List[float]]],
+                 similarity_threshold: float = 0.75, max_words: int = 6):
+        """
+        Args:
+            embed: Embeds a list of lowercased messages, e.g. Retriever.embed_queries.
+            similarity_threshold: Minimum cosine similarity to a small-talk centroid.
+            max_words: Longer leftovers are always treated as questions.
+        """
+        self.embed = embed
+        self.similarity_threshold = similarity_threshold
+        self.max_words = max_words
+        alternatives = "|".join(f"(?P<{intent}>{pattern})" for intent, pattern in self.PATTERNS.items())
+        self.small_talk_pattern = re.compile(rf"\b(?:{alternatives})\b")
+        self.lock = threading.Lock()
+        self.labels: List[str] = []
+        self.centroids: Optional[np.ndarray] = None
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        text = text.lower().replace("’", "'")
+        return " ".join(re.sub(r"[^a-z0-9'\s]+", " ", text).split())
+
+    def _unit(self, vectors) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+
+    def _get_centroids(self) -> np.ndarray:
+        # Built on first use, so the embedding model is not needed before the first message
+        with self.lock:
+            if self.centroids is None:
+                labels, centroids = [], []
+                for label, examples in self.EXAMPLES.items():
+                    labels.append(label)
+                    centroids.append(self._unit(self.embed(examples)).mean(axis=0))
+                self.labels, self.centroids = labels, self._unit(centroids)
+            return self.centroids
+
+    def classify(self, text: str) -> str:
+        """Nearest-centroid intent of a normalized message, or QUESTION below the similarity threshold."""
+        similarities = self._get_centroids() @ self._unit(self.embed([text])[0])
+        best = int(np.argmax(similarities))
+        if self.labels[best] == QUESTION or similarities[best] < self.similarity_threshold:
+            return QUESTION
+        return self.labels[best]
+
+    def route(self, message: str) -> str:
+        """
+        Returns:
+            str: "question" for the RAG path, otherwise the small-talk intent to answer from a template.
+        """
+        text = self.normalize(message)
+        if not text:
+            return QUESTION
+        intent = None
+        match = self.small_talk_pattern.search(text)
+        if match:
+            intent = match.lastgroup
+        leftover = " ".join(self.small_talk_pattern.sub(" ", text).split())
+        if not leftover:
+            return intent or QUESTION
+        if len(leftover.split()) > self.max_words:
+            return QUESTION
+        leftover_intent = self.classify(leftover)
+        if leftover_intent == QUESTION:
+            return QUESTION
+        return intent or leftover_intent
+
+    def respond(self, intent: str) -> str:
+        return self.RESPONSES[intent]
+
+    @classmethod
+    def is_template(cls, response: str) -> bool:
+        """Whether a stored assistant message is a small-talk template answer."""
+        return response in cls.RESPONSES.values()
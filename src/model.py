@@ -1,4 +1,5 @@
-from config import Config
+import torch
+from resources import get_config
 from transformers import AutoTokenizer, AutoModelForCausalLM
 
 class Model:
@@ -14,22 +15,32 @@ class Model:
         config (Config): Configuration object containing model settings.
         tokenizer (AutoTokenizer): The tokenizer for the language model.
         model (AutoModelForCausalLM): The main language model.
+        draft_model (AutoModelForCausalLM): Optional small model for speculative decoding.
+        draft_tokenizer (AutoTokenizer): Tokenizer of the draft model.
 
     Methods:
         set_tokenizer(): Initializes and returns the tokenizer.
         set_model(): Initializes and returns the language model.
+        set_draft_model(): Initializes and returns the draft model and its tokenizer.
         get_model_tokenizer(): Returns the model and tokenizer as a tuple.
     """
 
-    def __init__(self):
+    def __init__(self, device: str = "cuda"):
         """
         Initialize the Model instance.
 
         Sets up the configuration and initializes the tokenizer and model.
+
+        Args:
+            device: "cuda" for 4-bit weights on the first GPU, "cpu" for int8 weights on the CPU.
         """
-        self.config = Config()  # Load configuration
+        self.config = get_config()  # Shared configuration
+        self.device = device
         self.tokenizer = self.set_tokenizer()  # Initialize tokenizer
         self.model = self.set_model()  # Initialize model
+        self.draft_model, self.draft_tokenizer = None, None
+        if self.config.draft_model:
+            self.draft_model, self.draft_tokenizer = self.set_draft_model()
 
     def set_tokenizer(self):
         """
@@ -52,6 +63,17 @@ class Model:
         Returns:
             AutoModelForCausalLM: The initialized language model.
         """
+        if self.device == "cpu":
+            model = AutoModelForCausalLM.from_pretrained(
+                self.config.base_model,
+                torch_dtype=torch.float32,  # Dynamic quantization needs float32 weights
+                token=self.config.HF_token
+            )
+            if self.config.cpu_threads:
+                torch.set_num_threads(self.config.cpu_threads)
+            # Quantize the linear layers to int8; activations are quantized on the fly
+            return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
         # Load the model using configuration settings
         return AutoModelForCausalLM.from_pretrained(
             self.config.base_model,
@@ -60,6 +82,28 @@ class Model:
             token=self.config.HF_token  # Use the HuggingFace token for authentication
         )
 
+    def set_draft_model(self):
+        """
+        Initialize and return the draft model used for speculative decoding.
+
+        The draft model is small, so it is loaded unquantized on the main model's device.
+
+        Returns:
+            tuple: The draft model and its tokenizer.
+        """
+        draft_tokenizer = AutoTokenizer.from_pretrained(
+            self.config.draft_model,
+            token=self.config.HF_token
+        )
+        draft_model = AutoModelForCausalLM.from_pretrained(
+            self.config.draft_model,
+            device_map={"": self.model.device},
+            torch_dtype=self.model.dtype,
+            token=self.config.HF_token
+        )
+        print(f"Loaded draft model {self.config.draft_model} for speculative decoding")
+        return draft_model, draft_tokenizer
+
     def get_model_tokenizer(self):
         """
         Retrieve the model and tokenizer.
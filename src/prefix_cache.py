@@ -0,0 +1,75 @@
+import copy
+import hashlib
+import threading
+from typing import Dict, List, Optional, Tuple
+import torch
+from transformers import DynamicCache
+
+
+class PrefixCache:
+    """
+    Precomputed key/value cache for the fixed prefixes of the prompts.
+
+    Each prefix is registered under a name. Registering the same text again is a no-op,
+    while a changed text replaces the stored key/values, so the cache follows edits
+    to the prompt templates. lookup() finds the registered prefix sharing the
+    longest token prefix with a prompt and returns a private copy of its key/values,
+    cropped to the shared length. Generation then only has to prefill the rest of
+    the prompt.
+    """
+
+    def __init__(self, model, tokenizer, min_tokens: int = 16):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.min_tokens = min_tokens
+        self.lock = threading.Lock()
+        # name -> (text digest, prefix token ids, key/value cache)
+        self.entries: Dict[str, Tuple[str, List[int], DynamicCache]] = {}
+        self.counters = {"hits": 0, "misses": 0, "reused_tokens": 0, "registrations": 0}
+
+    def register(self, name: str, text: str):
+        digest = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        with self.lock:
+            if name in self.entries and self.entries[name][0] == digest:
+                return
+        input_ids = self.tokenizer(text, add_special_tokens=False, return_tensors="pt")["input_ids"].to(self.model.device)
+        with torch.no_grad():
+            past_key_values = self.model(input_ids, use_cache=True).past_key_values
+        if not isinstance(past_key_values, DynamicCache):
+            past_key_values = DynamicCache.from_legacy_cache(past_key_values)
+        with self.lock:
+            self.entries[name] = (digest, input_ids[0].tolist(), past_key_values)
+            self.counters["registrations"] += 1
+        print(f"Cached key/values for prompt prefix '{name}' ({input_ids.shape[1]} tokens)")
+
+    def lookup(self, input_ids: List[int]) -> Optional[Tuple[int, DynamicCache]]:
+        """
+        Returns:
+            tuple: (number of cached tokens, key/value cache to pass to generate) or None on a miss.
+        """
+        best_length, best_cache = 0, None
+        with self.lock:
+            for _, prefix_ids, cache in self.entries.values():
+                length = 0
+                for prefix_token, token in zip(prefix_ids, input_ids):
+                    if prefix_token != token:
+                        break
+                    length += 1
+                if length > best_length:
+                    best_length, best_cache = length, cache
+            # At least one prompt token must be left for generate to process
+            best_length = min(best_length, len(input_ids) - 1)
+            if best_cache is None or best_length < self.min_tokens:
+                self.counters["misses"] += 1
+                return None
+            self.counters["hits"] += 1
+            self.counters["reused_tokens"] += best_length
+
+        # generate() extends the cache in place, so each request works on its own copy
+        cache = copy.deepcopy(best_cache)
+        cache.crop(best_length)
+        return best_length, cache
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {**self.counters, "prefixes": len(self.entries)}
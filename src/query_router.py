@@ -0,0 +1,137 @@
+import json
+import os
+import re
+import unicodedata
+from typing import Dict, List, Optional
+
+
+class QueryRouter:
+    """
+    Derives a Chroma metadata filter from the user query.
+
+    University names and short names are matched against an alias table built from the
+    datasets at ingest time (alias -> "short name" metadata value). Degree levels are
+    only used to narrow a query that already names a university, since general topics
+    such as visas are not tied to a degree level.
+
+    Bare words such as "lab" or "turku" are common words or place names, so they are
+    only matched in a qualified form ("lab uas", "turku amk"). Upper-case acronyms
+    ("LAB") are kept in the table as written and matched case-sensitively against the
+    query, so "Is there a lab course?" is not routed.
+    """
+
+    QUALIFIERS = ("university", "uas", "amk")
+
+    DEGREE_PATTERNS = {
+        "bachelor": r"bachelors?|bachleors?|bba|undergraduate",
+        "master": r"masters?|mba|postgraduate",
+    }
+
+    def __init__(self, aliases: Dict[str, str]):
+        # Alias tables written before bare words were excluded may still contain them
+        self.aliases = {alias: short_name for alias, short_name in aliases.items() if self.is_specific(alias)}
+        self.university_pattern = self._compile([alias for alias in self.aliases if alias == alias.lower()])
+        self.acronym_pattern = self._compile([alias for alias in self.aliases if alias != alias.lower()])
+        self.degree_patterns = {
+            degree: re.compile(rf"\b(?:{pattern})\b") for degree, pattern in self.DEGREE_PATTERNS.items()
+        }
+
+    @staticmethod
+    def _compile(aliases: List[str]) -> Optional["re.Pattern"]:
+        if not aliases:
+            return None
+        alternatives = "|".join(re.escape(alias) for alias in sorted(aliases, key=len, reverse=True))
+        return re.compile(rf"\b(?:{alternatives})\b")
+
+    @staticmethod
+    def normalize(text: str, lower: bool = True) -> str:
+        text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+        if lower:
+            text = text.lower()
+        text = re.sub(r"['’]", "", text)
+        return " ".join(re.sub(r"[^A-Za-z0-9]+", " ", text).split())
+
+    @classmethod
+    def is_specific(cls, alias: str) -> bool:
+        """Whether an alias names a university on its own: an acronym, or a name with "university", "uas" or "amk"."""
+        if alias != alias.lower():
+            return True
+        words = alias.split()
+        return bool(words) and (any(word in cls.QUALIFIERS for word in words) or words[-1].endswith(("amk", "uas")))
+
+    @classmethod
+    def aliases_for(cls, university: str, short_name: str) -> Dict[str, str]:
+        """
+        Aliases that identify one university, e.g. "turku university of applied sciences",
+        "turkuamk", "turku uas", or "LAB" and "lab university" for an acronym short name.
+
+        `university` and `short_name` are the names as written in the dataset, since the
+        case tells acronyms apart. Every alias maps to the lowercased short name, which
+        is the "short name" metadata value DocumentParser stores.
+        """
+        full_name = cls.normalize(university)
+        short = cls.normalize(short_name)
+        if not full_name or not short:
+            return {}
+        names = {full_name, short}
+        stem = re.sub(r"\s*university of applied sciences$", "", full_name)
+        if stem and stem != full_name:
+            names.update({stem, f"{stem} uas", f"{stem} amk"})
+        base = re.sub(r"\s+(uas|amk)$", "", short)
+        if not cls.is_specific(base):
+            names.update({f"{base} uas", f"{base} amk"})
+        value = short_name.lower()
+        # Very short aliases would match unrelated words
+        aliases = {name: value for name in names if len(name) >= 3 and cls.is_specific(name)}
+        acronym = cls.normalize(short_name, lower=False)
+        if acronym.isalpha() and acronym.isupper():
+            aliases[acronym] = value
+            aliases[f"{short} university"] = value
+        return aliases
+
+    @classmethod
+    def load(cls, path: str) -> "QueryRouter":
+        if not os.path.exists(path):
+            return cls({})
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                return cls(json.load(file).get("universities", {}))
+        except Exception as e:
+            print(f"Error loading query aliases from {path}: {str(e)}")
+            return cls({})
+
+    @staticmethod
+    def save(path: str, aliases: Dict[str, str]) -> None:
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump({"universities": aliases}, file, indent=2, sort_keys=True)
+        os.replace(tmp_path, path)
+
+    def detect_universities(self, normalized_query: str, query: str = "") -> List[str]:
+        """The short names of the universities named in the query. Acronyms are matched in the original `query`."""
+        matches = set()
+        if self.university_pattern is not None:
+            matches.update(self.aliases[match] for match in self.university_pattern.findall(normalized_query))
+        if self.acronym_pattern is not None:
+            matches.update(self.aliases[match] for match in self.acronym_pattern.findall(self.normalize(query, lower=False)))
+        return sorted(matches)
+
+    def detect_degrees(self, normalized_query: str) -> List[str]:
+        return [degree for degree, pattern in self.degree_patterns.items() if pattern.search(normalized_query)]
+
+    def route(self, query: str) -> Optional[Dict]:
+        """Return a Chroma `where` filter for the query, or None when it names no university."""
+        normalized_query = self.normalize(query)
+        universities = self.detect_universities(normalized_query, query)
+        if not universities:
+            return None
+
+        if len(universities) == 1:
+            where = {"short name": universities[0]}
+        else:
+            where = {"short name": {"$in": universities}}
+
+        degrees = self.detect_degrees(normalized_query)
+        if len(degrees) == 1:
+            where = {"$and": [where, {"degree type": {"$in": [degrees[0], "all"]}}]}
+        return where
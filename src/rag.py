@@ -1,27 +1,32 @@
+import hashlib
 import json
+import multiprocessing
 import os
+import queue
 import re
-from typing import List, Dict, Any
-from config import Config
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Dict, Any, Iterator, Tuple, Union
 from langchain.docstore.document import Document
-from chromadb.utils import embedding_functions
-import chromadb
-from chromadb.config import Settings
+from resources import get_config, get_embedding_function
+from retriever import Retriever
+from bm25 import BM25Index
+from query_router import QueryRouter
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
-class RAG:
-    def __init__(self,chroma_client):
-        self.config = Config()
+class DocumentParser:
+    """
+    Turns the files under datasets/rag into Documents.
+
+    Kept free of the Chroma client and the embedding model so that it is cheap to
+    construct inside ingestion worker processes.
+    """
+    def __init__(self):
         self.text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=1000,
             chunk_overlap=200,
             separators=["\n\n", "\n", " ", ""]
         )
-        self.chroma_client = chroma_client
-
-        self.embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(
-            model_name=self.config.embedding_model
-        )
 
     def load_json_data(self, file_path: str) -> Dict:
         try:
@@ -41,19 +46,21 @@ class RAG:
         else:
             return str(data)
 
-    def preprocess_text(self, text: str) -> str:
-        # Remove extra whitespace
-        text = ' '.join(text.split())
-        # Convert to lowercase
-        text = text.lower()
-        # Remove special characters except periods and commas
-        text = re.sub(r'[^a-z0-9\s.,]', '', text)
-        return text
+    def section_degree_type(self, key: str) -> str:
+        """Degree level a JSON section applies to ("bachelor", "master" or "all"), tolerating misspelled keys."""
+        key = key.lower()
+        if re.search(r"bach", key):
+            return "bachelor"
+        if re.search(r"master", key):
+            return "master"
+        return "all"
 
     def process_json_data(self, data: Dict, file_name: str) -> List[Document]:
         documents = []
         university_name = data.get('university').lower()
         short_name = data.get('short name').lower()
+        # The names as written, for the query router: upper-case short names are acronyms
+        original_names = {"original university": data.get('university'), "original short name": data.get('short name')}
         print(f"Processing JSON data for {university_name} ({short_name})")
 
         # Process university info
@@ -70,6 +77,8 @@ class RAG:
             metadata={"context": f"bachelor's programs at {university_name}({short_name})",
                         "university": university_name,
                         "short name": short_name,
+                        **original_names,
+                        "degree type": "bachelor",
                         "source": file_name}
         ))
 
@@ -78,6 +87,8 @@ class RAG:
             metadata={"context": (f"master's programs  at {university_name} ({short_name})").lower(), 
                       "university": university_name,
                       "short name": short_name,
+                      **original_names,
+                      "degree type": "master",
                       "source": file_name}
         ))
         
@@ -90,6 +101,8 @@ class RAG:
                           "content_type": "about university",
                            "university": university_name,
                            "short name": short_name,
+                           **original_names,
+                           "degree type": "all",
                            "source": file_name}
             ))
             print(f"Created document for university information")
@@ -114,6 +127,9 @@ class RAG:
                                   "degree title": degree_title,
                                   "program": program_name,
                                   "degree type": degree_type.split("'")[0],
+                                  "university": university_name,
+                                  "short name": short_name,
+                                  **original_names,
                                   "source": file_name}
                     ))
 
@@ -127,7 +143,9 @@ class RAG:
                     metadata={"context": context,
                               "university": university_name,
                                "short name": short_name,
+                               **original_names,
                                "content_type": key,
+                               "degree type": self.section_degree_type(key),
                               "source": file_name}
                 ))
                 print(f"Created document for section: {key}")
@@ -164,94 +182,273 @@ class RAG:
         print(f"Total documents created from {file_path}: {len(documents)}")
         return documents
 
-    def create_vector_store(self, documents: List[Document]):
-        print(f"Creating vector store with {len(documents)} documents")
-        
-        batch_size = 100
-        for i in range(0, len(documents), batch_size):
-            batch = documents[i:i+batch_size]
-            
-            ids = [f"doc_{j}" for j in range(i, i+len(batch))]
-            contents = [doc.page_content for doc in batch]
-            metadatas = [doc.metadata for doc in batch]
-            
-            try:
-                self.rag_collection.add(
-                    ids=ids,
-                    documents=contents,
-                    metadatas=metadatas
-                )
-                print(f"Added batch of {len(batch)} documents to the vector store")
-            except Exception as e:
-                print(f"Error adding batch to vector store: {str(e)}")
-                print(f"First document in batch: {contents[0][:100]}...")
-                print(f"First metadata in batch: {metadatas[0]}")
-        
-        print("Vector store creation completed")
-        doc_count = self.rag_collection.count()
-        print(f"Total documents in collection: {doc_count}")
+    def parse_file(self, file_path: str) -> List[Document]:
+        filename = os.path.basename(file_path)
+        if filename.endswith('.json'):
+            print(f"Processing JSON file: {filename}")
+            json_data = self.load_json_data(file_path)
+            return self.process_json_data(json_data, filename)
+        elif filename.endswith('.txt'):
+            print(f"Processing text file: {filename}")
+            return self.process_text_file(file_path)
+        return []
 
-    def build_rag_store(self, directory_path: str):
-        print(f"Building RAG store from directory: {directory_path}")
+
+_worker_parser = None
+
+def _parse_file(file_path: str) -> Tuple[str, List[Document]]:
+    """Entry point of the ingestion worker processes."""
+    global _worker_parser
+    if _worker_parser is None:
+        _worker_parser = DocumentParser()
+    return os.path.basename(file_path), _worker_parser.parse_file(file_path)
+
+
+class RAG(DocumentParser):
+    def __init__(self,chroma_client):
+        super().__init__()
+        self.config = get_config()
+        self.chroma_client = chroma_client
+
+        self.embedding_function = get_embedding_function()
+        self.retriever = None
+
+    def preprocess_text(self, text: str) -> str:
+        # Remove extra whitespace
+        text = ' '.join(text.split())
+        # Convert to lowercase
+        text = text.lower()
+        # Remove special characters except periods and commas
+        text = re.sub(r'[^a-z0-9\s.,]', '', text)
+        return text
+
+    def document_id(self, doc: Document) -> str:
+        """
+        Build a stable id for a document from its source file, its context and
+        a hash of its content, so that unchanged documents keep their id across rebuilds.
+        """
+        source = doc.metadata.get("source", "")
+        context = doc.metadata.get("context", "")
+        location = hashlib.sha1(f"{source}\x00{context}".encode("utf-8")).hexdigest()[:16]
+        content = json.dumps({"content": doc.page_content, "metadata": doc.metadata}, sort_keys=True)
+        content_hash = hashlib.sha1(content.encode("utf-8")).hexdigest()[:16]
+        return f"{location}_{content_hash}"
+
+    def load_manifest(self) -> Dict[str, str]:
+        """
+        Load the manifest of indexed documents (document id -> source file).
+
+        Returns an empty dict when no manifest exists or it cannot be read.
+        """
+        manifest_path = self.config.rag_manifest_path
+        if not os.path.exists(manifest_path):
+            return {}
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as file:
+                manifest = json.load(file)
+            return manifest.get("documents", {})
+        except Exception as e:
+            print(f"Error loading RAG manifest from {manifest_path}: {str(e)}")
+            return {}
+
+    def save_manifest(self, documents: Dict[str, str]) -> None:
+        manifest = {
+            "collection": "rag",
+            "documents": documents
+        }
+        tmp_path = self.config.rag_manifest_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(manifest, file, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.config.rag_manifest_path)
+        print(f"Saved RAG manifest with {len(documents)} documents to {self.config.rag_manifest_path}")
+
+    def count_tokens(self, text: str) -> int:
+        """
+        Estimate the number of embedding-model tokens in text (about 4 characters per
+        token), capped at the sequence length the embedding model truncates to.
+        """
+        return min(len(text) // 4 + 1, self.config.embedding_max_tokens)
+
+    def iter_documents(self, directory_path: str, workers: int = 0) -> Iterator[Tuple[str, List[Document]]]:
+        """
+        Parse the dataset files and yield (filename, documents) per file as soon as it is parsed.
+
+        With workers > 1 the files are parsed in a process pool and yielded in completion order.
+        The workers are spawned, so they re-import the __main__ module: scripts that get
+        here must keep their top-level code under `if __name__ == "__main__":`.
+        """
+        file_paths = [
+            os.path.join(directory_path, filename)
+            for filename in sorted(os.listdir(directory_path))
+            if filename.endswith(('.json', '.txt'))
+        ]
+        if workers <= 1 or len(file_paths) <= 1:
+            for file_path in file_paths:
+                yield os.path.basename(file_path), self.parse_file(file_path)
+            return
+
+        # Spawned, not forked: this process already runs the batch writer and embedding model threads,
+        # and forking a threaded process holding torch or tokenizers state can deadlock
+        with ProcessPoolExecutor(max_workers=min(workers, len(file_paths)),
+                                 mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = [executor.submit(_parse_file, file_path) for file_path in file_paths]
+            for future in as_completed(futures):
+                yield future.result()
+
+    def create_vector_store(self, documents: Dict[str, Document]):
+        """
+        Embed and upsert a batch of documents (document id -> Document) into the 'rag' collection.
+        """
+        ids = list(documents)
+        contents = [doc.page_content for doc in documents.values()]
+        metadatas = [doc.metadata for doc in documents.values()]
+
+        try:
+            embeddings = self.embedding_function(contents)
+            self.rag_collection.upsert(
+                ids=ids,
+                embeddings=embeddings,
+                documents=contents,
+                metadatas=metadatas
+            )
+            print(f"Added batch of {len(ids)} documents to the vector store")
+        except Exception as e:
+            print(f"Error adding batch to vector store: {str(e)}")
+            print(f"First document in batch: {contents[0][:100]}...")
+            print(f"First metadata in batch: {metadatas[0]}")
+
+    def _write_batches(self, batches: queue.Queue):
+        while True:
+            batch = batches.get()
+            if batch is None:
+                return
+            self.create_vector_store(batch)
+
+    def build_rag_store(self, directory_path: str, incremental: bool = False,
+                        workers: int = None, batch_tokens: int = None, batch_size: int = None):
+        """
+        Build the 'rag' collection from the files in directory_path.
+
+        Ingestion is pipelined: files are parsed in a pool of `workers` processes, the
+        resulting documents are grouped into embedding batches of at most `batch_tokens`
+        padded tokens (and `batch_size` documents), and a writer thread embeds and writes
+        each batch to Chroma while later files are still being parsed.
+
+        With incremental=True an existing collection is kept: only documents whose
+        id (source + context + content hash) is not yet indexed are embedded, and
+        documents that no longer exist in the datasets are deleted.
+        """
+        workers = self.config.ingest_workers if workers is None else workers
+        batch_tokens = self.config.ingest_batch_tokens if batch_tokens is None else batch_tokens
+        batch_size = self.config.ingest_batch_size if batch_size is None else batch_size
+        print(f"Building RAG store from directory: {directory_path} "
+              f"(incremental={incremental}, workers={workers}, batch_tokens={batch_tokens}, batch_size={batch_size})")
 
         existing_collections = self.chroma_client.list_collections()
-        if any(collection.name == "rag" for collection in existing_collections):
-            self.chroma_client.delete_collection("rag")
-            print("Deleted existing 'rag' collection.")
+        collection_exists = any(collection.name == "rag" for collection in existing_collections)
 
-        self.rag_collection = self.chroma_client.create_collection(
-            name="rag",
-            embedding_function=self.embedding_function
-        )
-        print("Created new 'rag' collection.")
+        indexed_ids = set()
+        if incremental and collection_exists:
+            self.rag_collection = self.chroma_client.get_collection(
+                name="rag",
+                embedding_function=self.embedding_function
+            )
+            indexed_ids = set(self.load_manifest())
+            if not indexed_ids or len(indexed_ids) != self.rag_collection.count():
+                # Manifest is missing or out of sync, fall back to the ids stored in the collection
+                print("RAG manifest is missing or out of sync, reading ids from the 'rag' collection.")
+                indexed_ids = set(self.rag_collection.get(include=[])['ids'])
+        else:
+            if collection_exists:
+                self.chroma_client.delete_collection("rag")
+                print("Deleted existing 'rag' collection.")
 
-        all_documents = []
+            self.rag_collection = self.chroma_client.create_collection(
+                name="rag",
+                embedding_function=self.embedding_function
+            )
+            print("Created new 'rag' collection.")
 
-        for filename in os.listdir(directory_path):
-            file_path = os.path.join(directory_path, filename)
-            if filename.endswith('.json'):
-                print(f"Processing JSON file: {filename}")
-                json_data = self.load_json_data(file_path)
-                processed_docs = self.process_json_data(json_data, filename)
-                all_documents.extend(processed_docs)
-                print(f"Processed {filename}: {len(processed_docs)} documents created")
-            elif filename.endswith('.txt'):
-                print(f"Processing text file: {filename}")
-                processed_docs = self.process_text_file(file_path)
-                all_documents.extend(processed_docs)
+        batches = queue.Queue(maxsize=4)
+        writer = threading.Thread(target=self._write_batches, args=(batches,), daemon=True)
+        writer.start()
+
+        manifest = {}
+        aliases = {}
+        batch = {}
+        batch_max_tokens = 0
+        changed_count = 0
+        try:
+            for filename, processed_docs in self.iter_documents(directory_path, workers):
                 print(f"Processed {filename}: {len(processed_docs)} documents created")
+                for doc in processed_docs:
+                    doc_id = self.document_id(doc)
+                    if doc_id in manifest:
+                        print(f"Skipping duplicate document: {doc.metadata.get('context')} ({doc.metadata.get('source')})")
+                        continue
+                    manifest[doc_id] = doc.metadata.get("source", "")
+                    if "original university" in doc.metadata and "original short name" in doc.metadata:
+                        aliases.update(QueryRouter.aliases_for(
+                            doc.metadata["original university"], doc.metadata["original short name"]))
+                    if doc_id in indexed_ids:
+                        continue
+
+                    # Batches are padded to their longest document, so budget on that
+                    tokens = self.count_tokens(doc.page_content)
+                    padded_tokens = (len(batch) + 1) * max(batch_max_tokens, tokens)
+                    if batch and (padded_tokens > batch_tokens or len(batch) >= batch_size):
+                        batches.put(batch)
+                        batch, batch_max_tokens = {}, 0
+                    batch[doc_id] = doc
+                    batch_max_tokens = max(batch_max_tokens, tokens)
+                    changed_count += 1
+            if batch:
+                batches.put(batch)
+        finally:
+            batches.put(None)
+            writer.join()
+
+        removed_ids = sorted(indexed_ids - set(manifest))
+        for i in range(0, len(removed_ids), batch_size):
+            self.rag_collection.delete(ids=removed_ids[i:i+batch_size])
+
+        print(f"Total documents created: {len(manifest)}")
+        if incremental:
+            print(f"Incremental build: {changed_count} new or changed documents, "
+                  f"{len(removed_ids)} removed documents, "
+                  f"{len(manifest) - changed_count} unchanged documents")
 
-        print(f"Total documents created: {len(all_documents)}")
-        self.create_vector_store(all_documents)
+        QueryRouter.save(self.config.query_aliases_path, aliases)
+        print(f"Saved {len(aliases)} query aliases to {self.config.query_aliases_path}")
+        self.build_lexical_index()
+        self.save_manifest(manifest)
+        if self.retriever is not None:
+            self.retriever.invalidate()
 
         print(f"RAG vector store creation completed.")
         print(f"Total documents in collection: {self.rag_collection.count()}")
 
-    def query_vector_store(self, query: str, k: int = 5):
-        collection_name = "rag"
-        self.rag_collection = self.chroma_client.get_collection(name=collection_name,embedding_function=self.embedding_function)
-        print(f"Querying vector store with: '{query}'")
-        processed_query = self.preprocess_text(query)
-        
-        results = self.rag_collection.query(
-            query_texts=[processed_query],
-            n_results=k,
-            include=["documents", "metadatas", "distances"]
-        )
-        
-        documents = [
-            Document(
-                page_content=doc, 
-                metadata={
-                    **meta, 
-                    "similarity_score": 1 - dist  
-                    # Convert distance to similarity score
-                }
-            )
-            for doc, meta, dist in zip(results['documents'][0], results['metadatas'][0], results['distances'][0])
-        ]
-        print(f"Retrieved {len(documents)} documents from vector store")
-        return documents
+    def build_lexical_index(self) -> BM25Index:
+        """Build the BM25 index over the documents in the 'rag' collection and persist it next to the Chroma store."""
+        stored = self.rag_collection.get(include=["documents"])
+        index = BM25Index.build(stored['ids'], stored['documents'])
+        index.save(self.config.bm25_index_path)
+        print(f"Saved BM25 index with {len(index)} documents to {self.config.bm25_index_path}")
+        return index
+
+    def get_retriever(self) -> Retriever:
+        """Return the long-lived Retriever for the 'rag' collection, opening it on first use."""
+        if self.retriever is None:
+            self.retriever = Retriever(self, cache_size=self.config.retrieval_cache_size)
+        return self.retriever
+
+    def query_vector_store(self, query: str, k: int = 5, where: Dict = None):
+        return self.get_retriever().query(query, k, where)
+
+    def query_batch(self, queries: List[str], k: Union[int, List[int]] = 5,
+                    where: Union[None, Dict, List[Dict]] = None) -> List[List[Document]]:
+        """Retrieve documents for several queries with one embedding pass; k and where may be per query."""
+        return self.get_retriever().query_batch(queries, k, where)
 
     def search(self, query: str, k: int = 5):
         results = self.query_vector_store(query, k)
@@ -0,0 +1,113 @@
+import atexit
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+
+class ResourceRegistry:
+    """
+    Process-wide registry of shared, expensive objects (configuration, embedding model,
+    Chroma client).
+
+    Each resource is registered with a factory and built on first use, exactly once per
+    process, no matter how many components ask for it. Resources are built under their
+    own lock, so loading one does not block access to the others. close() releases
+    resources in reverse load order; the module-level registry is closed at interpreter
+    exit.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.factories: Dict[str, Callable[[], Any]] = {}
+        self.closers: Dict[str, Callable[[Any], None]] = {}
+        self.resource_locks: Dict[str, threading.Lock] = {}
+        self.instances: Dict[str, Any] = {}
+        self.load_order: List[str] = []
+        self.load_ms: Dict[str, float] = {}
+
+    def register(self, name: str, factory: Callable[[], Any], close: Optional[Callable[[Any], None]] = None):
+        with self.lock:
+            self.factories[name] = factory
+            self.resource_locks.setdefault(name, threading.Lock())
+            if close is not None:
+                self.closers[name] = close
+
+    def get(self, name: str) -> Any:
+        if name in self.instances:
+            return self.instances[name]
+        if name not in self.factories:
+            raise KeyError(f"Unknown resource: {name}")
+        with self.resource_locks[name]:
+            if name not in self.instances:
+                start = time.perf_counter()
+                instance = self.factories[name]()
+                with self.lock:
+                    self.load_ms[name] = (time.perf_counter() - start) * 1000
+                    self.instances[name] = instance
+                    self.load_order.append(name)
+                print(f"Loaded shared resource '{name}' in {self.load_ms[name]:.0f} ms")
+        return self.instances[name]
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self.instances
+
+    def close(self):
+        """Release all loaded resources, most recently loaded first. They are rebuilt on the next get()."""
+        with self.lock:
+            names, self.load_order = self.load_order[::-1], []
+            instances = [(name, self.instances.pop(name)) for name in names]
+        for name, instance in instances:
+            if name in self.closers:
+                try:
+                    self.closers[name](instance)
+                except Exception as e:
+                    print(f"Error closing resource '{name}': {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "registered": sorted(self.factories),
+                "loaded": list(self.load_order),
+                "load_ms": dict(self.load_ms),
+            }
+
+
+registry = ResourceRegistry()
+# Registered on import, before any resource is loaded, so it runs after the exit hooks of the
+# components using the resources (e.g. the chat persister draining its queue)
+atexit.register(registry.close)
+
+
+def _create_config():
+    from config import Config
+    return Config()
+
+
+def _create_embedding_function():
+    from embedding_cache import create_embedding_function
+    return create_embedding_function(get_config())
+
+
+def _create_chroma_client():
+    import chromadb
+    return chromadb.PersistentClient(path=get_config().chroma_persist_directory)
+
+
+registry.register("config", _create_config)
+registry.register("embedding_function", _create_embedding_function, close=lambda function: function.cache.flush())
+registry.register("chroma_client", _create_chroma_client)
+
+
+def get_config():
+    """The shared Config, so the API key files are read and the configuration printed once per process."""
+    return registry.get("config")
+
+
+def get_embedding_function():
+    """The shared cached embedding function, so the embedding model is loaded once per process."""
+    return registry.get("embedding_function")
+
+
+def get_chroma_client():
+    """The shared persistent Chroma client for Config.chroma_persist_directory."""
+    return registry.get("chroma_client")
@@ -0,0 +1,94 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import numpy as np
+
+
+class SemanticResponseCache:
+    """
+    Cache of generated answers keyed by query embedding and retrieved documents.
+
+    A stored answer is returned when a new query retrieved the same documents and its
+    embedding has a cosine similarity of at least `threshold` with the stored query.
+    Entries expire after `ttl` seconds, the least recently used entry is evicted beyond
+    `max_entries`, and everything is dropped when the RAG collection build changes.
+    """
+
+    def __init__(self, threshold: float = 0.95, ttl: float = 86400, max_entries: int = 1000):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.build_id = None
+        self.next_id = 0
+        # entry id -> (normalized query embedding, document key, response, created at)
+        self.entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self.by_documents: Dict[tuple, List[int]] = {}
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _check_build(self, build_id):
+        if build_id != self.build_id:
+            if self.entries:
+                self.counters["invalidations"] += 1
+            self.entries.clear()
+            self.by_documents.clear()
+            self.build_id = build_id
+
+    def _remove(self, entry_id: int):
+        _, documents_key, _, _ = self.entries.pop(entry_id)
+        ids = self.by_documents[documents_key]
+        ids.remove(entry_id)
+        if not ids:
+            del self.by_documents[documents_key]
+
+    def lookup(self, embedding, doc_ids: List[str], build_id=None) -> Optional[str]:
+        documents_key = tuple(sorted(doc_ids))
+        query_vector = self._normalize(embedding)
+        now = time.time()
+        with self.lock:
+            self._check_build(build_id)
+            best_id, best_similarity = None, self.threshold
+            for entry_id in list(self.by_documents.get(documents_key, [])):
+                vector, _, _, created_at = self.entries[entry_id]
+                if now - created_at > self.ttl:
+                    self._remove(entry_id)
+                    self.counters["expirations"] += 1
+                    continue
+                similarity = float(np.dot(vector, query_vector))
+                if similarity >= best_similarity:
+                    best_id, best_similarity = entry_id, similarity
+            if best_id is None:
+                self.counters["misses"] += 1
+                return None
+            self.entries.move_to_end(best_id)
+            self.counters["hits"] += 1
+            return self.entries[best_id][2]
+
+    def store(self, embedding, doc_ids: List[str], response: str, build_id=None):
+        documents_key = tuple(sorted(doc_ids))
+        with self.lock:
+            self._check_build(build_id)
+            entry_id = self.next_id
+            self.next_id += 1
+            self.entries[entry_id] = (self._normalize(embedding), documents_key, response, time.time())
+            self.by_documents.setdefault(documents_key, []).append(entry_id)
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+                self.counters["evictions"] += 1
+
+    def invalidate(self):
+        with self.lock:
+            self.entries.clear()
+            self.by_documents.clear()
+            self.counters["invalidations"] += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {**self.counters, "entries": len(self.entries)}
@@ -0,0 +1,360 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Union
+import numpy as np
+from langchain.docstore.document import Document
+from bm25 import BM25Index
+from query_router import QueryRouter
+
+
+def is_missing_collection_error(error: Exception) -> bool:
+    """
+    Whether Chroma raised `error` because the collection no longer exists. Recent versions
+    raise NotFoundError or InvalidCollectionException; older ones a ValueError saying so.
+    """
+    from chromadb import errors
+    not_found = tuple(
+        getattr(errors, name) for name in ("NotFoundError", "InvalidCollectionException") if hasattr(errors, name))
+    if isinstance(error, not_found):
+        return True
+    return isinstance(error, ValueError) and "does not exist" in str(error)
+
+
+class Retriever:
+    """
+    Long-lived query-side handle on the 'rag' collection.
+
+    In hybrid mode a BM25 index over the same documents is queried alongside Chroma and
+    the two rankings are merged with reciprocal rank fusion, so that exact names such as
+    "LAB" or a program title are not lost to embedding similarity. When query routing is
+    enabled, queries naming a university are restricted to that university's documents
+    with a Chroma metadata filter.
+
+    The collection is opened and validated once. Recent query embeddings and query
+    results are kept in LRU caches, which are dropped whenever the collection is rebuilt
+    (detected through the RAG manifest, which every build rewrites). A full rebuild
+    deletes the collection before the manifest is rewritten, so a query that finds its
+    collection gone reopens it and retries once. Latency counters are available through
+    stats().
+    """
+
+    def __init__(self, rag, cache_size: int = 256):
+        self.rag = rag
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+        self.collection = None
+        self.lexical_index: Optional[BM25Index] = None
+        self.router: Optional[QueryRouter] = None
+        self.build_id = None
+        self.query_embeddings: "OrderedDict[str, List[float]]" = OrderedDict()
+        self.results: "OrderedDict[tuple, List[Document]]" = OrderedDict()
+        self.filtered_ids: "OrderedDict[str, set]" = OrderedDict()
+        self.counters = {
+            "queries": 0,
+            "result_cache_hits": 0,
+            "embedding_cache_hits": 0,
+            "reloads": 0,
+            "routed_queries": 0,
+            "routing_fallbacks": 0,
+            "embed_ms": 0.0,
+            "search_ms": 0.0,
+            "lexical_ms": 0.0,
+            "total_ms": 0.0,
+        }
+        self.open()
+
+    def _current_build_id(self) -> Optional[int]:
+        try:
+            return os.stat(self.rag.config.rag_manifest_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def open(self):
+        """Open the 'rag' collection and check that it is ready to serve queries."""
+        try:
+            collection = self.rag.chroma_client.get_collection(
+                name="rag",
+                embedding_function=self.rag.embedding_function
+            )
+        except Exception as e:
+            raise ValueError(f"The 'rag' collection is not available, build it with Utils.build_rag_database(): {str(e)}")
+
+        doc_count = collection.count()
+        if doc_count == 0:
+            raise ValueError("The 'rag' collection is empty, build it with Utils.build_rag_database().")
+        indexed_count = len(self.rag.load_manifest())
+        if indexed_count and indexed_count != doc_count:
+            print(f"Warning: 'rag' collection has {doc_count} documents but the manifest lists {indexed_count}.")
+
+        lexical_index = None
+        if self.rag.config.retrieval_mode == "hybrid":
+            lexical_index = self._load_lexical_index(collection)
+
+        router = None
+        if self.rag.config.query_routing:
+            router = QueryRouter.load(self.rag.config.query_aliases_path)
+
+        with self.lock:
+            self.collection = collection
+            self.lexical_index = lexical_index
+            self.router = router
+            self.build_id = self._current_build_id()
+            self.query_embeddings.clear()
+            self.results.clear()
+            self.filtered_ids.clear()
+            self.counters["reloads"] += 1
+
+    def _load_lexical_index(self, collection) -> BM25Index:
+        index_path = self.rag.config.bm25_index_path
+        if os.path.exists(index_path):
+            try:
+                return BM25Index.load(index_path)
+            except Exception as e:
+                print(f"Error loading BM25 index from {index_path}: {str(e)}")
+        # Collections built before hybrid retrieval existed have no index yet
+        stored = collection.get(include=["documents"])
+        index = BM25Index.build(stored['ids'], stored['documents'])
+        index.save(index_path)
+        return index
+
+    def invalidate(self):
+        """Force the collection to be reopened and the caches to be dropped on the next query."""
+        with self.lock:
+            self.collection = None
+
+    def _ensure_current(self):
+        with self.lock:
+            stale = self.collection is None or self._current_build_id() != self.build_id
+        if stale:
+            self.open()
+
+    def _collection(self):
+        with self.lock:
+            return self.collection
+
+    def _cache_get(self, cache: OrderedDict, key):
+        with self.lock:
+            value = cache.get(key)
+            if value is not None:
+                cache.move_to_end(key)
+            return value
+
+    def _cache_put(self, cache: OrderedDict, key, value):
+        with self.lock:
+            cache[key] = value
+            cache.move_to_end(key)
+            while len(cache) > self.cache_size:
+                cache.popitem(last=False)
+
+    def _count(self, name: str, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def embed_queries(self, processed_queries: List[str]) -> List[List[float]]:
+        """Embed queries, serving repeats from the LRU and embedding the rest in one forward pass."""
+        embeddings = [self._cache_get(self.query_embeddings, query) for query in processed_queries]
+        self._count("embedding_cache_hits", sum(embedding is not None for embedding in embeddings))
+        missing = list(dict.fromkeys(
+            query for query, embedding in zip(processed_queries, embeddings) if embedding is None))
+        if missing:
+            start = time.perf_counter()
+            computed = dict(zip(missing, self.rag.embedding_function(missing)))
+            self._count("embed_ms", (time.perf_counter() - start) * 1000)
+            for query, embedding in computed.items():
+                self._cache_put(self.query_embeddings, query, embedding)
+            embeddings = [computed[query] if embedding is None else embedding
+                          for query, embedding in zip(processed_queries, embeddings)]
+        return embeddings
+
+    def embed_query(self, processed_query: str) -> List[float]:
+        return self.embed_queries([processed_query])[0]
+
+    def _ids_matching(self, where: Dict) -> set:
+        """Ids of the documents matching a metadata filter, used to filter the BM25 hits."""
+        key = json.dumps(where, sort_keys=True)
+        ids = self._cache_get(self.filtered_ids, key)
+        if ids is None:
+            ids = set(self._collection().get(where=where, include=[])['ids'])
+            self._cache_put(self.filtered_ids, key, ids)
+        return ids
+
+    def _vector_search(self, embeddings: List[List[float]], k: int, where: Optional[Dict] = None) -> List[List[Document]]:
+        start = time.perf_counter()
+        query = {
+            "query_embeddings": embeddings,
+            "n_results": k,
+            "where": where,
+            "include": ["documents", "metadatas", "distances"],
+        }
+        try:
+            results = self._collection().query(**query)
+        except Exception as e:
+            if not is_missing_collection_error(e):
+                raise
+            # The collection was deleted by a rebuild that has not rewritten the manifest yet
+            print(f"The 'rag' collection went away, reopening it: {str(e)}")
+            self.open()
+            results = self._collection().query(**query)
+        self._count("search_ms", (time.perf_counter() - start) * 1000)
+        return [
+            [
+                Document(
+                    page_content=doc,
+                    metadata={
+                        **meta,
+                        "doc_id": doc_id,
+                        "similarity_score": 1 - dist
+                        # Convert distance to similarity score
+                    }
+                )
+                for doc_id, doc, meta, dist in zip(ids, docs, metas, dists)
+            ]
+            for ids, docs, metas, dists in zip(
+                results['ids'], results['documents'], results['metadatas'], results['distances'])
+        ]
+
+    def _fuse(self, processed_query: str, embedding: List[float], vector_docs: List[Document], k: int,
+              where: Optional[Dict] = None) -> List[Document]:
+        """Merge the vector ranking with the BM25 ranking of processed_query using reciprocal rank fusion."""
+        candidates = max(k, self.rag.config.hybrid_candidates)
+        start = time.perf_counter()
+        lexical_hits = self.lexical_index.search(processed_query, candidates if where is None else len(self.lexical_index))
+        if where is not None:
+            allowed_ids = self._ids_matching(where)
+            lexical_hits = [(doc_id, score) for doc_id, score in lexical_hits if doc_id in allowed_ids][:candidates]
+        self._count("lexical_ms", (time.perf_counter() - start) * 1000)
+
+        rrf_k = self.rag.config.rrf_k
+        fused: Dict[str, float] = {}
+        for rank, doc in enumerate(vector_docs):
+            fused[doc.metadata["doc_id"]] = fused.get(doc.metadata["doc_id"], 0.0) + 1 / (rrf_k + rank + 1)
+        for rank, (doc_id, _) in enumerate(lexical_hits):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1 / (rrf_k + rank + 1)
+        top_ids = sorted(fused, key=fused.get, reverse=True)[:k]
+
+        documents = {doc.metadata["doc_id"]: doc for doc in vector_docs}
+        missing_ids = [doc_id for doc_id in top_ids if doc_id not in documents]
+        if missing_ids:
+            # Lexical-only hits: fetch them and score them the same way Chroma does (squared L2)
+            stored = self._collection().get(ids=missing_ids, include=["documents", "metadatas", "embeddings"])
+            query_vector = np.asarray(embedding, dtype=np.float32)
+            for doc_id, doc, meta, doc_embedding in zip(
+                    stored['ids'], stored['documents'], stored['metadatas'], stored['embeddings']):
+                dist = float(np.sum((np.asarray(doc_embedding, dtype=np.float32) - query_vector) ** 2))
+                documents[doc_id] = Document(
+                    page_content=doc,
+                    metadata={**meta, "doc_id": doc_id, "similarity_score": 1 - dist}
+                )
+
+        bm25_scores = dict(lexical_hits)
+        fused_docs = []
+        for doc_id in top_ids:
+            if doc_id not in documents:
+                continue
+            doc = documents[doc_id]
+            doc.metadata["fusion_score"] = fused[doc_id]
+            doc.metadata["bm25_score"] = bm25_scores.get(doc_id, 0.0)
+            fused_docs.append(doc)
+        return fused_docs
+
+    def _search(self, processed_queries: List[str], embeddings: List[List[float]], ks: List[int],
+                where: Optional[Dict]) -> List[List[Document]]:
+        """Search several queries sharing one metadata filter with a single Chroma query."""
+        hybrid = self.lexical_index is not None
+        n_results = max(ks)
+        if hybrid:
+            n_results = max(n_results, self.rag.config.hybrid_candidates)
+        vector_results = self._vector_search(embeddings, n_results, where)
+        if not hybrid:
+            return [docs[:k] for docs, k in zip(vector_results, ks)]
+        return [
+            self._fuse(processed_query, embedding, vector_docs, k, where)
+            for processed_query, embedding, vector_docs, k in zip(processed_queries, embeddings, vector_results, ks)
+        ]
+
+    def query_batch(self, queries: List[str], k: Union[int, List[int]] = 5,
+                    where: Union[None, Dict, List[Optional[Dict]]] = None) -> List[List[Document]]:
+        """
+        Retrieve documents for several queries at once.
+
+        All uncached queries are embedded in one forward pass, and queries sharing the same
+        metadata filter are sent to Chroma as one query. `k` and `where` may be given once
+        for all queries or as one value per query. A query without a filter is routed by
+        the university and degree names it contains, when query routing is enabled.
+        """
+        start = time.perf_counter()
+        self._ensure_current()
+        self._count("queries", len(queries))
+        ks = list(k) if isinstance(k, (list, tuple)) else [k] * len(queries)
+        wheres = list(where) if isinstance(where, (list, tuple)) else [where] * len(queries)
+        if len(ks) != len(queries) or len(wheres) != len(queries):
+            raise ValueError("k and where must be given once or once per query.")
+
+        processed_queries = [self.rag.preprocess_text(query) for query in queries]
+        routed = [False] * len(queries)
+        if self.router is not None:
+            for i, query in enumerate(queries):
+                if wheres[i] is None:
+                    wheres[i] = self.router.route(query)
+                    routed[i] = wheres[i] is not None
+            self._count("routed_queries", sum(routed))
+
+        keys = [
+            (processed_query, query_k, self.lexical_index is not None, json.dumps(query_where, sort_keys=True))
+            for processed_query, query_k, query_where in zip(processed_queries, ks, wheres)
+        ]
+        results: List[Optional[List[Document]]] = [self._cache_get(self.results, key) for key in keys]
+        self._count("result_cache_hits", sum(documents is not None for documents in results))
+
+        pending = [i for i, documents in enumerate(results) if documents is None]
+        if pending:
+            embeddings = dict(zip(pending, self.embed_queries([processed_queries[i] for i in pending])))
+            fallbacks = []
+            while pending:
+                # One Chroma query per distinct filter
+                groups: Dict[str, List[int]] = {}
+                for i in pending:
+                    groups.setdefault(json.dumps(wheres[i], sort_keys=True), []).append(i)
+                for group in groups.values():
+                    group_results = self._search(
+                        [processed_queries[i] for i in group], [embeddings[i] for i in group],
+                        [ks[i] for i in group], wheres[group[0]])
+                    for i, documents in zip(group, group_results):
+                        if not documents and routed[i]:
+                            fallbacks.append(i)
+                        else:
+                            results[i] = documents
+                            self._cache_put(self.results, keys[i], documents)
+                # The routing filter matched nothing, search the whole collection instead
+                for i in fallbacks:
+                    wheres[i] = None
+                    routed[i] = False
+                self._count("routing_fallbacks", len(fallbacks))
+                pending, fallbacks = fallbacks, []
+
+        self._count("total_ms", (time.perf_counter() - start) * 1000)
+        # Hand out copies so callers cannot modify the cached documents
+        return [
+            [Document(page_content=doc.page_content, metadata=dict(doc.metadata)) for doc in documents]
+            for documents in results
+        ]
+
+    def query(self, query: str, k: int = 5, where: Optional[Dict] = None) -> List[Document]:
+        """
+        Retrieve the k best documents for query.
+
+        `where` is a Chroma metadata filter; when it is not given and query routing is
+        enabled, it is derived from the university and degree names in the query.
+        """
+        return self.query_batch([query], k, [where])[0]
+
+    def stats(self) -> Dict[str, float]:
+        with self.lock:
+            counters = dict(self.counters)
+        queries = counters["queries"] or 1
+        counters["avg_total_ms"] = counters["total_ms"] / queries
+        counters["cached_queries"] = len(self.results)
+        return counters
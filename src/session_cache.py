@@ -0,0 +1,116 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class SessionCache:
+    """
+    Bounded in-process cache for per-chat state (chat messages, conversation memories).
+
+    Entries are evicted when they have been idle for longer than `idle_ttl` seconds, and
+    least recently used entries are evicted while the cache holds more than
+    `max_entries` entries or more than `max_bytes` as measured by `sizeof`. Evicted
+    entries are not lost: callers rehydrate them from storage through get_or_load().
+    """
+
+    def __init__(self, name: str, max_entries: int, idle_ttl: float, max_bytes: int,
+                 sizeof: Callable[[Any], int] = lambda value: 0):
+        self.name = name
+        self.max_entries = max_entries
+        self.idle_ttl = idle_ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.lock = threading.RLock()
+        # key -> [value, size, last access]
+        self.entries: "OrderedDict[Hashable, list]" = OrderedDict()
+        self.total_bytes = 0
+        self.counters = {"hits": 0, "misses": 0, "loads": 0, "evictions": 0, "expirations": 0}
+
+    def _remove(self, key: Hashable):
+        _, size, _ = self.entries.pop(key)
+        self.total_bytes -= size
+
+    def _evict(self):
+        now = time.monotonic()
+        # Entries are ordered by last access, so idle ones are at the front
+        while self.entries:
+            key, (_, _, last_access) = next(iter(self.entries.items()))
+            if now - last_access <= self.idle_ttl:
+                break
+            self._remove(key)
+            self.counters["expirations"] += 1
+        while self.entries and (len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes):
+            self._remove(next(iter(self.entries)))
+            self.counters["evictions"] += 1
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self.lock:
+            self._evict()
+            entry = self.entries.get(key)
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+            entry[2] = time.monotonic()
+            self.entries.move_to_end(key)
+            self.counters["hits"] += 1
+            return entry[0]
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        value = self.get(key)
+        if value is not None:
+            return value
+        # Load outside the lock so slow storage does not block other sessions
+        value = loader()
+        with self.lock:
+            self.counters["loads"] += 1
+            if key in self.entries:
+                # Another session loaded it meanwhile
+                return self.entries[key][0]
+            self.put(key, value)
+        return value
+
+    def put(self, key: Hashable, value: Any):
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            size = self.sizeof(value)
+            self.entries[key] = [value, size, time.monotonic()]
+            self.total_bytes += size
+            self._evict()
+
+    def resize(self, key: Hashable):
+        """Re-measure an entry after its value was modified in place."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return
+            size = self.sizeof(entry[0])
+            self.total_bytes += size - entry[1]
+            entry[1] = size
+            self._evict()
+
+    def pop(self, key: Hashable) -> Optional[Any]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self._remove(key)
+            return entry[0]
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self.lock:
+            self._evict()
+            return key in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                **self.counters,
+                "name": self.name,
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+            }
@@ -1,10 +1,7 @@
 from dateutil import parser
 from dateutil.relativedelta import relativedelta
 from datetime import datetime, timezone
-import chromadb
-from chromadb.config import Settings
-from rag import RAG
-from config import Config
+from resources import get_config, get_chroma_client, get_embedding_function
 import os
 import shutil
 
@@ -35,31 +32,35 @@ class Utils:
         return relative_time
     
     @staticmethod
-    def build_rag_database():
-        
-        config = Config()
+    def build_rag_database(incremental: bool = False):
+        """
+        Build the 'rag' collection from Config.rag_dataset_path.
+
+        With Config.ingest_workers > 1 the files are parsed in spawned processes, which
+        re-import the calling script: call this under `if __name__ == "__main__":`, or
+        every worker re-runs the script's top-level code.
+        """
+        # Imported here so the UI can use Utils without loading the RAG stack
+        from rag import RAG
+        config = get_config()
         
         
-        chroma_client = chromadb.PersistentClient(path=config.chroma_persist_directory)
+        chroma_client = get_chroma_client()
 
         try:
             # Initialize RAG
             rag = RAG(chroma_client)
             
             # Build the RAG store
-            rag.build_rag_store(config.rag_dataset_path)
+            rag.build_rag_store(config.rag_dataset_path, incremental=incremental)
             
             print(f"RAG database built successfully.")
             print(f"Vector store saved to {config.chroma_persist_directory}")
 
-            del chroma_client
-
             
         finally:
 
-            config = Config()
-
-            chroma_client = chromadb.PersistentClient(path=config.chroma_persist_directory)
+            chroma_client = get_chroma_client()
             
             rag = RAG(chroma_client)
            
@@ -73,9 +74,9 @@ class Utils:
             ]
 
             print("\nTesting RAG database with sample queries:")
-            for query in test_queries:
+            batch_results = rag.query_batch(test_queries, k=2)
+            for query, results in zip(test_queries, batch_results):
                 print(f"\nQuery: {query}")
-                results = rag.search(query, k=2)
                 for i, doc in enumerate(results, 1):
                     print(f"Result {i}:")
                     print(f"Context: {doc.metadata['context']}")
@@ -86,4 +87,27 @@ class Utils:
             
             del chroma_client
 
-            
\ No newline at end of file
+            
+    @staticmethod
+    def migrate_chat_history():
+        """Copy chat histories stored in Chroma into the SQLite chat store. Already copied messages are skipped."""
+        from chat_store import SQLiteChatStore, import_chroma_history
+        config = get_config()
+        store = SQLiteChatStore(config.chat_store_path)
+        try:
+            copied = import_chroma_history(get_chroma_client(), store)
+            print(f"Copied {copied} messages to {config.chat_store_path}")
+        finally:
+            store.close()
+
+    @staticmethod
+    def backfill_chat_embeddings():
+        """Embed the messages of the SQLite chat store that have no embedding yet, and add the search timestamps missing from older ones."""
+        from chat_store import ChromaChatStore, SQLiteChatStore, backfill_chat_embeddings
+        config = get_config()
+        store = SQLiteChatStore(config.chat_store_path)
+        try:
+            embedded = backfill_chat_embeddings(store, ChromaChatStore(get_chroma_client(), get_embedding_function()))
+            print(f"Embedded {embedded} chat messages from {config.chat_store_path}")
+        finally:
+            store.close()
@@ -0,0 +1,23 @@
+import pytest
+
+# benchmark imports the RAG pipeline
+pytest.importorskip("openpyxl")
+pytest.importorskip("chromadb")
+pytest.importorskip("langchain")
+
+from benchmark import percentiles
+
+
+def test_percentiles_use_the_nearest_rank():
+    values = [float(v) for v in range(100, 0, -1)]
+    assert percentiles(values) == {"mean": 50.5, "p50": 50.0, "p95": 95.0, "p99": 99.0, "max": 100.0}
+
+
+def test_percentiles_of_few_values_are_observed_values():
+    # No interpolation: every percentile is one of the measured latencies
+    assert percentiles([10.0, 30.0, 20.0]) == {"mean": 20.0, "p50": 20.0, "p95": 30.0, "p99": 30.0, "max": 30.0}
+    assert percentiles([7.0]) == {"mean": 7.0, "p50": 7.0, "p95": 7.0, "p99": 7.0, "max": 7.0}
+
+
+def test_percentiles_of_no_values_are_empty():
+    assert percentiles([]) == {}
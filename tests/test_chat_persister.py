@@ -0,0 +1,113 @@
+import threading
+
+import pytest
+
+from chat_persister import WriteBehindPersister
+from chat_store import SQLiteChatStore
+
+
+class FlakyStore(SQLiteChatStore):
+    """A SQLite store whose first `failures` batch writes raise."""
+
+    def __init__(self, path, failures=0):
+        super().__init__(path)
+        self.failures = failures
+        self.batches = []
+
+    def add_messages(self, messages):
+        if self.failures:
+            self.failures -= 1
+            raise IOError("store unavailable")
+        self.batches.append([m["content"] for m in messages])
+        return super().add_messages(messages)
+
+
+def message(i, chat_id="chat"):
+    return {
+        "user_email": "user@example.com",
+        "chat_id": chat_id,
+        "role": "user" if i % 2 == 0 else "assistant",
+        "content": f"message {i}",
+        "created_at": f"2024-01-01T00:00:{i:02d}+00:00",
+    }
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = FlakyStore(str(tmp_path / "chat.db"))
+    yield store
+    store.close()
+
+
+def contents(store, chat_id="chat"):
+    return [m["content"] for m in store.get_messages("user@example.com", chat_id)]
+
+
+def test_messages_are_written_in_enqueue_order(store):
+    persister = WriteBehindPersister(store, max_batch_size=3, max_delay_ms=1000)
+    for i in range(10):
+        persister.enqueue(message(i))
+    assert persister.flush(timeout=5)
+    assert contents(store) == [f"message {i}" for i in range(10)]
+    # Batches are written in order and never exceed max_batch_size
+    assert [c for batch in store.batches for c in batch] == [f"message {i}" for i in range(10)]
+    assert all(len(batch) <= 3 for batch in store.batches)
+    persister.close()
+
+
+def test_failed_batch_is_retried_first_in_line(store):
+    store.failures = 2
+    persister = WriteBehindPersister(store, max_batch_size=2, max_delay_ms=1, retry_delay_s=0.01)
+    for i in range(5):
+        persister.enqueue(message(i))
+    assert persister.flush(timeout=5)
+    assert contents(store) == [f"message {i}" for i in range(5)]
+    assert store.batches[0] == ["message 0", "message 1"]
+    stats = persister.stats()
+    assert stats["failures"] == 2
+    assert stats["messages"] == 5
+    assert stats["dropped"] == 0
+    persister.close()
+
+
+def test_flush_waits_for_earlier_messages(store):
+    release = threading.Event()
+    original = store.add_messages
+
+    def slow_add_messages(messages):
+        release.wait(5)
+        return original(messages)
+
+    store.add_messages = slow_add_messages
+    persister = WriteBehindPersister(store, max_batch_size=64, max_delay_ms=10000)
+    for i in range(3):
+        persister.enqueue(message(i))
+    # The write is held back, so the flush times out instead of returning early
+    assert not persister.flush(timeout=0.1)
+    release.set()
+    # flush() skips the batch delay and returns once everything enqueued before it is stored
+    assert persister.flush(timeout=5)
+    assert contents(store) == ["message 0", "message 1", "message 2"]
+    persister.close()
+
+
+def test_close_drains_the_queue(store):
+    persister = WriteBehindPersister(store, max_batch_size=64, max_delay_ms=60000)
+    for i in range(4):
+        persister.enqueue(message(i))
+    persister.close()
+    assert not persister.thread.is_alive()
+    assert contents(store) == [f"message {i}" for i in range(4)]
+    with pytest.raises(RuntimeError):
+        persister.enqueue(message(4))
+
+
+def test_close_drops_messages_when_the_store_keeps_failing(store):
+    store.failures = 10 ** 6
+    persister = WriteBehindPersister(store, max_batch_size=2, max_delay_ms=60000, retry_delay_s=0.01)
+    for i in range(3):
+        persister.enqueue(message(i))
+    persister.close(timeout=5)
+    assert not persister.thread.is_alive()
+    assert persister.stats()["dropped"] == 3
+    assert contents(store) == []
@@ -0,0 +1,113 @@
+import pytest
+
+from chat_store import SQLiteChatStore
+
+USER = "user@example.com"
+
+
+def message(chat_id, role, content, second):
+    return {
+        "user_email": USER,
+        "chat_id": chat_id,
+        "role": role,
+        "content": content,
+        "created_at": f"2024-01-01T00:00:{second:02d}+00:00",
+    }
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "chat.db")
+
+
+@pytest.fixture
+def store(path):
+    store = SQLiteChatStore(path)
+    yield store
+    store.close()
+
+
+def test_conversation_row_tracks_every_message(store):
+    # The assistant greeting comes first, so the title waits for the first user message
+    store.add_messages([message("a", "assistant", "Hello!", 1)])
+    assert store.list_conversations(USER)[0]["title"] == "New Chat"
+    store.add_messages([
+        message("a", "user", "How do I apply for a residence permit in Finland?", 2),
+        message("a", "assistant", "You apply through Enter Finland.", 3),
+    ])
+    store.add_message(USER, "a", "user", "Thanks", "2024-01-01T00:00:04+00:00")
+    assert store.list_conversations(USER) == [{
+        "id": "a",
+        "title": "How do I apply for a residence...",
+        "created_at": "2024-01-01T00:00:01+00:00",
+        "last_activity": "2024-01-01T00:00:04+00:00",
+        "message_count": 4,
+    }]
+
+
+def test_conversations_are_paged_newest_first(store):
+    for i, chat_id in enumerate(["a", "b", "c"]):
+        store.add_messages([message(chat_id, "user", f"question {chat_id}", i)])
+    assert [c["id"] for c in store.list_conversations(USER)] == ["c", "b", "a"]
+    assert [c["id"] for c in store.list_conversations(USER, limit=2)] == ["c", "b"]
+    assert [c["id"] for c in store.list_conversations(USER, limit=2, offset=2)] == ["a"]
+    assert store.count_conversations(USER) == 3
+    assert store.list_conversations("other@example.com") == []
+
+
+def test_delete_chat_removes_its_messages_and_conversation(store):
+    store.add_messages([message("a", "user", "first", 1), message("b", "user", "second", 2)])
+    store.delete_chat(USER, "a")
+    assert store.get_messages(USER, "a") == []
+    assert [c["id"] for c in store.list_conversations(USER)] == ["b"]
+    assert store.count_conversations(USER) == 1
+    # A deleted chat that gets a new message starts a new conversation row
+    store.add_messages([message("a", "user", "again", 3)])
+    assert store.list_conversations(USER)[0]["message_count"] == 1
+
+
+def test_pages_do_not_skip_messages_with_the_same_created_at(store):
+    # Both messages of every turn share a timestamp, so page boundaries fall between equal created_at values
+    store.add_messages([
+        message("chat", "user" if i % 2 == 0 else "assistant", f"message {i}", i // 2) for i in range(7)
+    ])
+    pages, cursor = [], None
+    while True:
+        page, cursor = store.get_messages_page(USER, "chat", limit=2, before=cursor)
+        pages.append([m["content"] for m in page])
+        if cursor is None:
+            break
+    assert pages == [["message 5", "message 6"], ["message 3", "message 4"], ["message 1", "message 2"], ["message 0"]]
+
+
+def test_last_page_has_no_cursor(store):
+    store.add_messages([message("chat", "user", f"message {i}", i) for i in range(4)])
+    page, cursor = store.get_messages_page(USER, "chat", limit=4)
+    assert [m["content"] for m in page] == [f"message {i}" for i in range(4)]
+    assert cursor is None
+    # A cursor at the oldest message returns an empty page
+    page, cursor = store.get_messages_page(USER, "chat", limit=4, before=page[0]["cursor"])
+    assert page == []
+    assert cursor is None
+    assert store.get_messages_page(USER, "missing", limit=4) == ([], None)
+
+
+def test_conversations_of_older_databases_are_backfilled(path):
+    store = SQLiteChatStore(path)
+    store.add_messages([
+        message("a", "assistant", "Hello!", 1),
+        message("a", "user", "Where is LAB?", 2),
+        message("b", "user", "Tuition fees", 3),
+    ])
+    expected = store.list_conversations(USER)
+    # As written before the conversations table existed
+    with store.lock, store._connection() as connection:
+        connection.execute("DELETE FROM conversations")
+    assert store.list_conversations(USER) == []
+    store.close()
+
+    store = SQLiteChatStore(path)
+    assert store.list_conversations(USER) == expected
+    assert expected[1]["title"] == "Where is LAB?"
+    assert expected[1]["message_count"] == 2
+    store.close()
@@ -0,0 +1,62 @@
+import pytest
+
+pytest.importorskip("langchain")
+
+from langchain.docstore.document import Document
+
+from context_packer import ContextPacker
+
+
+class WordTokenizer:
+    """One token per whitespace-separated word."""
+
+    def encode(self, text, add_special_tokens=False):
+        return text.split()
+
+    def decode(self, token_ids):
+        return " ".join(token_ids)
+
+
+def doc(words, score, name):
+    return Document(page_content=" ".join([name] * words), metadata={"similarity_score": score, "context": name})
+
+
+def packer(context_token_budget, similarity_floor=0.3):
+    # The separator "\n" encodes to no words, so only the documents count
+    return ContextPacker(WordTokenizer(), max_context_length=1000, max_new_tokens=100,
+                         context_token_budget=context_token_budget, similarity_floor=similarity_floor)
+
+
+def test_documents_below_the_floor_are_skipped_not_a_stop():
+    # Hybrid retrieval orders by fused rank, so a good document can follow a weak one
+    docs = [doc(3, 0.9, "a"), doc(3, 0.1, "b"), doc(3, 0.8, "c")]
+    packed, text = packer(100).pack(docs, "")
+    assert [d.metadata["context"] for d in packed] == ["a", "c"]
+    assert text == "a a a\nc c c"
+
+
+def test_documents_that_do_not_fit_are_skipped():
+    docs = [doc(4, 0.9, "a"), doc(10, 0.9, "b"), doc(5, 0.9, "c")]
+    packed, _ = packer(10).pack(docs, "")
+    assert [d.metadata["context"] for d in packed] == ["a", "c"]
+
+
+def test_only_a_first_document_too_long_for_the_budget_is_truncated():
+    docs = [doc(3, 0.1, "low"), doc(20, 0.9, "a"), doc(20, 0.9, "b")]
+    packed, text = packer(5).pack(docs, "")
+    assert [d.metadata["context"] for d in packed] == ["a"]
+    assert text == "a a a a a"
+
+
+def test_the_budget_is_what_the_fixed_prompt_leaves():
+    fixed_prompt = " ".join(["word"] * 895)
+    packed, text = packer(100).pack([doc(10, 0.9, "a")], fixed_prompt)
+    assert text == "a a a a a"
+    assert packer(100).pack([doc(10, 0.9, "a")], " ".join(["word"] * 900)) == ([], "")
+
+
+def test_memory_keeps_its_most_recent_part():
+    memory_packer = ContextPacker(WordTokenizer(), max_context_length=1000, max_new_tokens=100,
+                                  context_token_budget=100, similarity_floor=0.3, memory_token_budget=3)
+    assert memory_packer.fit_memory("one two three four five", "") == "three four five"
+    assert memory_packer.fit_memory("one two", "") == "one two"
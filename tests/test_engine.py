@@ -0,0 +1,65 @@
+import time
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("langchain")
+
+from backends import StubBackend
+from engine import Engine
+
+
+class FailingBackend(StubBackend):
+    """Streams two words, then fails."""
+
+    def stream(self, prompt):
+        yield "Partial"
+        yield " answer"
+        raise RuntimeError("generation failed")
+
+
+@pytest.fixture
+def engine():
+    # Only the streaming path is exercised, so no models, stores or retrieval are loaded
+    engine = Engine.__new__(Engine)
+    engine.backend = StubBackend(response="A complete answer")
+    engine.finished = []
+    engine._prepare_turn = lambda chat_id, user_email, user_message: {
+        "chat_id": chat_id,
+        "user_email": user_email,
+        "user_message": user_message,
+        "start": time.perf_counter(),
+        "timings": {},
+        "query_embedding": [1.0],
+        "doc_ids": [],
+        "cached_response": None,
+        "prompt": "prompt",
+    }
+    engine._finish_turn = lambda turn, response: engine.finished.append((turn, response))
+    return engine
+
+
+def test_completed_stream_saves_the_turn(engine):
+    assert "".join(engine.stream_response("chat", "user@example.com", "question")) == "A complete answer"
+    [(turn, response)] = engine.finished
+    assert response == "A complete answer"
+    assert turn["query_embedding"] == [1.0]
+
+
+def test_interrupted_stream_saves_the_partial_response(engine):
+    stream = engine.stream_response("chat", "user@example.com", "question")
+    assert next(stream) == "A"
+    stream.close()
+    [(turn, response)] = engine.finished
+    assert response == "A"
+    # A partial response is kept out of the semantic cache
+    assert turn["query_embedding"] is None
+
+
+def test_failed_generation_is_not_saved(engine):
+    engine.backend = FailingBackend()
+    stream = engine.stream_response("chat", "user@example.com", "question")
+    assert next(stream) == "Partial"
+    with pytest.raises(RuntimeError, match="generation failed"):
+        list(stream)
+    assert engine.finished == []
@@ -0,0 +1,104 @@
+import time
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+from generation_scheduler import GenerationRequest, GenerationScheduler
+
+# A few-kilobyte GPT-2, small enough to run speculative decoding on CPU
+TINY_MODEL = "sshleifer/tiny-gpt2"
+PROMPT = "How do I apply for a student residence permit in Finland?"
+NEW_TOKENS = 16
+
+
+@pytest.fixture(scope="module")
+def tiny_models():
+    try:
+        tokenizer = AutoTokenizer.from_pretrained(TINY_MODEL)
+        # Separate instances, so that the forward hooks count each model on its own
+        model = AutoModelForCausalLM.from_pretrained(TINY_MODEL).eval()
+        draft_model = AutoModelForCausalLM.from_pretrained(TINY_MODEL).eval()
+    except OSError as e:
+        pytest.skip(f"{TINY_MODEL} is not available: {e}")
+    return model, draft_model, tokenizer
+
+
+def generation_kwargs(tokenizer):
+    # Greedy, and no early end of sequence, so that both runs produce the same NEW_TOKENS tokens
+    return {
+        "max_new_tokens": NEW_TOKENS,
+        "min_new_tokens": NEW_TOKENS,
+        "do_sample": False,
+        "eos_token_id": tokenizer.eos_token_id,
+    }
+
+
+def test_speculative_generation_streams_and_reports_acceptance(tiny_models):
+    model, draft_model, tokenizer = tiny_models
+    scheduler = GenerationScheduler(
+        model,
+        tokenizer,
+        {**generation_kwargs(tokenizer), "num_assistant_tokens": 4},
+        max_wait_ms=0,
+        assistant_model=draft_model,
+        assistant_tokenizer=tokenizer
+    )
+    assert scheduler.max_batch_size == 1
+
+    deltas = list(scheduler.stream(PROMPT))
+    assert len(deltas) > 1
+    assert all(deltas)
+
+    # Greedy speculative decoding returns exactly what the target model alone would generate
+    baseline = GenerationScheduler(model, tokenizer, generation_kwargs(tokenizer), max_wait_ms=0)
+    assert "".join(deltas) == baseline.generate(PROMPT)
+
+    metrics = scheduler.metrics()
+    assert metrics["completed"] == 1
+    assert metrics["generated_tokens"] == NEW_TOKENS
+    assert metrics["target_forwards"] > 0
+    assert metrics["draft_forwards"] > 0
+    # The draft has the target's weights, so its proposals are accepted and each verification yields several tokens
+    assert 0 < metrics["acceptance_rate"] <= 1
+    assert metrics["tokens_per_target_forward"] > 1
+    assert metrics["ms_per_token"] > 0
+
+
+def test_closing_the_stream_stops_generation(tiny_models):
+    model, _, tokenizer = tiny_models
+    max_new_tokens = 512
+    scheduler = GenerationScheduler(
+        model,
+        tokenizer,
+        {**generation_kwargs(tokenizer), "max_new_tokens": max_new_tokens, "min_new_tokens": max_new_tokens},
+        max_wait_ms=0
+    )
+    stream = scheduler.stream(PROMPT)
+    assert next(stream)
+    stream.close()
+
+    deadline = time.monotonic() + 30
+    while scheduler.metrics()["completed"] < 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    metrics = scheduler.metrics()
+    assert metrics["completed"] == 1
+    # The worker stopped at its next token instead of generating max_new_tokens for nobody
+    assert metrics["generated_tokens"] < max_new_tokens
+
+
+def test_cancelled_requests_are_dropped_from_the_queue(tiny_models):
+    model, _, tokenizer = tiny_models
+    scheduler = GenerationScheduler(model, tokenizer, generation_kwargs(tokenizer), max_wait_ms=0)
+    # A request whose caller went away before the worker picked it up
+    request = GenerationRequest(PROMPT, tokenizer(PROMPT)["input_ids"])
+    request.cancelled = True
+    with scheduler.condition:
+        scheduler.pending.append(request)
+    assert scheduler.generate(PROMPT)
+    metrics = scheduler.metrics()
+    assert metrics["cancelled"] == 1
+    assert metrics["completed"] == 1
@@ -0,0 +1,67 @@
+import pytest
+
+from query_router import QueryRouter
+
+UNIVERSITIES = [
+    ("LAB University of Applied Sciences", "LAB"),
+    ("Turku University of Applied Sciences", "TurkuAMK"),
+    ("Karelia University of Applied Sciences", "Karelia UAS"),
+]
+
+
+@pytest.fixture
+def router():
+    aliases = {}
+    for university, short_name in UNIVERSITIES:
+        aliases.update(QueryRouter.aliases_for(university, short_name))
+    return QueryRouter(aliases)
+
+
+# The filters use the lowercased "short name" metadata that DocumentParser stores
+@pytest.mark.parametrize("query, short_name", [
+    ("What does LAB offer in engineering?", "lab"),
+    ("lab uas admission requirements", "lab"),
+    ("Is LAB University in Lahti?", "lab"),
+    ("Turku AMK application period", "turkuamk"),
+    ("Tuition fees at TurkuAMK", "turkuamk"),
+    ("Karelia UAS housing", "karelia uas"),
+])
+def test_qualified_names_and_acronyms_are_routed(router, query, short_name):
+    assert router.route(query) == {"short name": short_name}
+
+
+@pytest.mark.parametrize("query", [
+    "Is there a lab course?",
+    "Master's programmes at the University of Turku",
+    "Living costs in Turku",
+    "Hiking in North Karelia",
+])
+def test_bare_common_words_are_not_routed(router, query):
+    assert router.route(query) is None
+
+
+def test_bare_words_from_older_alias_tables_are_ignored():
+    router = QueryRouter({"lab": "lab", "turku": "turkuamk", "turku amk": "turkuamk"})
+    assert router.route("Is there a lab course in Turku?") is None
+    assert router.route("Turku AMK lab course") == {"short name": "turkuamk"}
+
+
+def test_aliases_built_from_parsed_documents_match_the_stored_metadata():
+    pytest.importorskip("langchain")
+    pytest.importorskip("chromadb")
+    from rag import DocumentParser
+
+    data = {
+        "university": "LAB University of Applied Sciences",
+        "short name": "LAB",
+        "about": "LAB is a university of applied sciences in Lahti and Lappeenranta.",
+        "master's programs": [{"program": "Business Analytics", "degree title": "Master of Business Administration"}],
+    }
+    documents = DocumentParser().process_json_data(data, "lab.json")
+    aliases = {}
+    for doc in documents:
+        aliases.update(QueryRouter.aliases_for(doc.metadata["original university"], doc.metadata["original short name"]))
+    where = QueryRouter(aliases).route("What are LAB masters programs?")
+    assert where == {"$and": [{"short name": "lab"}, {"degree type": {"$in": ["master", "all"]}}]}
+    # The filter value is the metadata Chroma stores with every document of the university
+    assert {doc.metadata["short name"] for doc in documents} == {where["$and"][0]["short name"]}